@@ -0,0 +1,107 @@
+"""
+Benchmark training throughput under different hardware profiles.
+
+Times optimizer steps of a randomly initialized DistilBERT-base-sized
+classifier or GPT-2-small-sized causal LM. It compares plain fp32, fp16
+autocast (what ``fp16=True`` gave on CPU hosts) and the profile
+``HardwareProfile`` detects for this machine. Reports tokens/s and the speedup
+over fp32.
+
+Example:
+    python benchmarks/bench_hardware.py --model classifier --layers 6
+    python benchmarks/bench_hardware.py --model causal_lm --seq-len 256 --compile
+"""
+
+import sys
+import json
+import time
+import argparse
+import logging
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import torch
+from transformers import DistilBertConfig, DistilBertForSequenceClassification, GPT2Config, GPT2LMHeadModel
+
+from utils.hardware import HardwareProfile
+
+logging.basicConfig(level=logging.WARNING)
+
+def build_model(kind: str, layers: int, dim: int):
+    torch.manual_seed(0)
+    if kind == "classifier":
+        config = DistilBertConfig(n_layers=layers, dim=dim, hidden_dim=4 * dim, num_labels=5)
+        return DistilBertForSequenceClassification(config)
+    config = GPT2Config(n_layer=layers, n_embd=dim, n_head=max(1, dim // 64))
+    return GPT2LMHeadModel(config)
+
+def make_batch(kind: str, vocab_size: int, batch_size: int, seq_len: int, device: str):
+    input_ids = torch.randint(0, vocab_size, (batch_size, seq_len), device=device)
+    batch = {'input_ids': input_ids, 'attention_mask': torch.ones_like(input_ids)}
+    batch['labels'] = torch.randint(0, 5, (batch_size,), device=device) if kind == "classifier" else input_ids
+    return batch
+
+def tokens_per_second(profile: HardwareProfile, args) -> float:
+    """Mean training throughput over ``args.steps`` steps after ``args.warmup`` untimed ones."""
+    profile.apply()
+    model = profile.prepare_model(build_model(args.model, args.layers, args.dim))
+    model.train()
+    step_model = torch.compile(model) if profile.compile else model
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
+    batch = make_batch(args.model, model.config.vocab_size, args.batch_size, args.seq_len, profile.device)
+
+    def step():
+        with profile.autocast():
+            loss = step_model(**batch).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+
+    for _ in range(args.warmup):
+        step()
+    if profile.device == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        step()
+    if profile.device == "cuda":
+        torch.cuda.synchronize()
+    return args.steps * args.batch_size * args.seq_len / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark training throughput per hardware profile")
+    parser.add_argument("--model", choices=["classifier", "causal_lm"], default="classifier")
+    parser.add_argument("--layers", type=int, default=6)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--seq-len", type=int, default=128)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--compile", action="store_true", help="Also run the detected profile with torch.compile")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    detected = HardwareProfile()
+    device = detected.device
+    profiles = {
+        'fp32': HardwareProfile(device=device, precision="fp32"),
+        'fp16_autocast': HardwareProfile(device=device, precision="fp16"),
+        'detected': detected
+    }
+    if args.compile:
+        profiles['detected_compiled'] = HardwareProfile(device=device, precision=detected.precision, compile=True)
+
+    print(f"detected: {detected.describe()}")
+    results = {name: tokens_per_second(profile, args) for name, profile in profiles.items()}
+
+    print(f"{'profile':<20}{'tokens/s':>12}{'speedup':>10}")
+    for name, value in results.items():
+        print(f"{name:<20}{value:>12.0f}{value / results['fp32']:>9.2f}x")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({'detected': detected.describe(), 'tokens_per_s': results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
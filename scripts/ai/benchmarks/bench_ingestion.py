@@ -0,0 +1,103 @@
+"""
+Benchmark serial vs. parallel content ingestion.
+
+Generates a synthetic Hugo content tree and times ContentProcessor.collect_content
+in serial mode, in parallel mode, and as a warm (fully cached) rebuild.
+
+Example:
+    python benchmarks/bench_ingestion.py --posts 10000 --workers 8
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from data.content_processor import ContentProcessor
+
+logging.basicConfig(level=logging.WARNING)
+
+WORDS = (
+    "model data search retrieval agent prompt token embedding vector latency "
+    "python cloud deploy query index cache batch training inference edge"
+).split()
+
+def generate_corpus(content_dir: str, num_posts: int, paragraphs: int = 12, seed: int = 0):
+    """Write ``num_posts`` markdown posts with frontmatter under ``content_dir/posts``."""
+    rng = random.Random(seed)
+    posts_dir = os.path.join(content_dir, "posts")
+    os.makedirs(os.path.join(content_dir, "pages"), exist_ok=True)
+
+    for i in range(num_posts):
+        # Spread files over subdirectories like a real section tree
+        subdir = os.path.join(posts_dir, f"{i % 100:02d}")
+        os.makedirs(subdir, exist_ok=True)
+        tags = rng.sample(WORDS, 4)
+        body = "\n\n".join(
+            " ".join(rng.choice(WORDS) for _ in range(80)) for _ in range(paragraphs)
+        )
+        with open(os.path.join(subdir, f"post-{i:06d}.md"), "w", encoding="utf-8") as f:
+            f.write(
+                "---\n"
+                f"title: 'Post {i}'\n"
+                f"description: 'Synthetic post {i}'\n"
+                "date: '2025-01-01T00:00:00-07:00'\n"
+                f"tags: [{', '.join(tags)}]\n"
+                f"categories: [{rng.choice(WORDS)}]\n"
+                "---\n\n"
+                f"# Post {i}\n\n{body}\n"
+            )
+
+def time_collect(processor: ContentProcessor, use_cache: bool) -> float:
+    start = time.perf_counter()
+    processor.collect_content(use_cache=use_cache)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--posts", type=int, default=10000, help="Number of posts to generate")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Workers for the parallel run")
+    parser.add_argument("--chunksize", type=int, default=None, help="Files per worker task")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        content_dir = os.path.join(tmp, "content")
+        cache_path = os.path.join(tmp, "content_manifest.json")
+        print(f"Generating {args.posts} posts...")
+        generate_corpus(content_dir, args.posts)
+
+        serial = ContentProcessor(content_dir, cache_path=cache_path, workers=1)
+        parallel = ContentProcessor(content_dir, cache_path=cache_path,
+                                    workers=args.workers, chunksize=args.chunksize)
+
+        results = {
+            "posts": args.posts,
+            "workers": parallel.workers,
+            "serial_s": time_collect(serial, use_cache=False),
+            "parallel_s": time_collect(parallel, use_cache=False),
+        }
+        # Populate the manifest, then measure a rebuild with nothing changed
+        parallel.collect_content(use_cache=True)
+        results["cached_s"] = time_collect(parallel, use_cache=True)
+        results["speedup"] = results["serial_s"] / results["parallel_s"]
+
+    print(f"{'mode':<10}{'seconds':>10}{'files/s':>12}")
+    for mode in ("serial", "parallel", "cached"):
+        seconds = results[f"{mode}_s"]
+        print(f"{mode:<10}{seconds:>10.2f}{args.posts / seconds:>12.0f}")
+    print(f"parallel speedup: {results['speedup']:.2f}x with {results['workers']} workers")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+End-to-end CPU benchmark suite for the training and serving scripts.
+
+Runs offline with tiny random models (``benchmarks/tiny_models.py``) and a
+synthetic Hugo content tree. It times each stage on the path from content to
+served predictions:
+
+    ingest              ContentProcessor.collect_content, cold (no manifest)
+    format              format_for_training plus write_training_data
+    tokenize            tokenize_grouped over the formatted records
+    train_classifier    one optimizer step of the DistilBERT classifier
+    train_causal_lm     one optimizer step of the causal LM
+    load_cold           ModelLoader.load_model from disk
+    load_warm           ModelLoader.load_model of a cached model
+    infer_single        classifier predictions one text at a time
+    infer_batched       the same texts in batches
+
+Every benchmark is repeated and the median is reported. Results are written
+as JSON. ``--baseline`` compares against an earlier results file, flags every
+benchmark that got slower by more than ``--threshold``, and exits with status 1
+if any did.
+
+Example:
+    python benchmarks/bench_suite.py --output bench.json
+    python benchmarks/bench_suite.py --baseline bench.json --only train_classifier,train_causal_lm
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import logging
+import statistics
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import torch
+from transformers import (
+    AutoModelForCausalLM,
+    AutoModelForSequenceClassification,
+    AutoTokenizer,
+    DataCollatorForSeq2Seq,
+    DataCollatorWithPadding
+)
+from transformers.utils import logging as hf_logging
+
+from benchmarks.bench_ingestion import generate_corpus
+from benchmarks.tiny_models import make_tiny_causal_lm, make_tiny_classifier, synthetic_texts
+from data.content_processor import ContentProcessor
+from data.tokenization import tokenize_grouped, tokenize_text
+from models.inference_server import classifier_runner
+from models.model_loader import ModelLoader
+
+# Some of the imported modules configure INFO logging; keep the report readable
+logging.basicConfig(level=logging.WARNING, force=True)
+hf_logging.disable_progress_bar()
+
+BENCHMARKS = (
+    "ingest", "format", "tokenize", "train_classifier", "train_causal_lm",
+    "load_cold", "load_warm", "infer_single", "infer_batched"
+)
+
+def measure(run: Callable[[], Any], repeats: int, warmup: int = 1) -> Dict[str, float]:
+    """Median and min wall time of ``run`` over ``repeats`` calls, after ``warmup`` untimed calls."""
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return {'seconds': statistics.median(timings), 'min_seconds': min(timings), 'repeats': repeats}
+
+def train_step(model, batch: Dict[str, torch.Tensor], optimizer) -> Callable[[], None]:
+    """One forward, backward and optimizer step, as the Trainer runs it."""
+    model.train()
+
+    def run():
+        loss = model(**batch).loss
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+
+    return run
+
+class Suite:
+    def __init__(self, workdir: str, posts: int, batch_size: int, max_length: int, repeats: int):
+        """
+        Args:
+            workdir (str): Scratch directory for the corpus and tiny models
+            posts (int): Synthetic posts in the content tree
+            batch_size (int): Examples per training and inference batch
+            max_length (int): Token limit for training examples
+            repeats (int): Timed runs per benchmark
+        """
+        self.workdir = workdir
+        self.posts = posts
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.repeats = repeats
+
+        self.content_dir = os.path.join(workdir, "content")
+        self.model_dir = os.path.join(workdir, "models")
+        generate_corpus(self.content_dir, posts, paragraphs=4)
+        make_tiny_classifier(os.path.join(self.model_dir, "classifier"))
+        make_tiny_causal_lm(os.path.join(self.model_dir, "causal_lm"))
+        self.causal_tokenizer = AutoTokenizer.from_pretrained(os.path.join(self.model_dir, "causal_lm"))
+        self.classifier_tokenizer = AutoTokenizer.from_pretrained(os.path.join(self.model_dir, "classifier"))
+        self.texts = synthetic_texts(256, seed=1)
+        self._content = None
+
+    def processor(self) -> ContentProcessor:
+        return ContentProcessor(self.content_dir, cache_path=os.path.join(self.workdir, "manifest.json"))
+
+    @property
+    def content(self) -> List[Dict[str, Any]]:
+        if self._content is None:
+            self._content = self.processor().collect_content(use_cache=False)
+        return self._content
+
+    def bench_ingest(self) -> Dict[str, Any]:
+        processor = self.processor()
+        result = measure(lambda: processor.collect_content(use_cache=False), self.repeats)
+        return {**result, 'items': self.posts}
+
+    def bench_format(self) -> Dict[str, Any]:
+        processor = self.processor()
+        output_path = os.path.join(self.workdir, "training_data.jsonl")
+        examples = sum(1 for _ in processor.format_for_training(self.content))
+
+        def run():
+            for _ in processor.format_for_training(self.content):
+                pass
+            processor.write_training_data(self.content, output_path)
+
+        return {**measure(run, self.repeats), 'items': examples}
+
+    def bench_tokenize(self) -> Dict[str, Any]:
+        records = list(self.processor().format_grouped(self.content))
+        batch = {key: [record[key] for record in records] for key in ("id", "response", "instructions")}
+        examples = sum(len(record['instructions']) for record in records)
+        result = measure(lambda: tokenize_grouped(batch, self.causal_tokenizer, max_length=self.max_length),
+                         self.repeats)
+        return {**result, 'items': examples}
+
+    def bench_train_classifier(self) -> Dict[str, Any]:
+        model = AutoModelForSequenceClassification.from_pretrained(os.path.join(self.model_dir, "classifier"))
+        features = tokenize_text({'text': self.texts[:self.batch_size], 'label': list(range(self.batch_size))},
+                                 self.classifier_tokenizer, max_length=self.max_length, label_column="label")
+        features['labels'] = [label % model.config.num_labels for label in features['labels']]
+        # The Trainer drops the 'length' column before collation
+        rows = [
+            {key: features[key][i] for key in ("input_ids", "attention_mask", "labels")}
+            for i in range(self.batch_size)
+        ]
+        batch = DataCollatorWithPadding(self.classifier_tokenizer, pad_to_multiple_of=8)(rows)
+        optimizer = torch.optim.AdamW(model.parameters(), lr=2e-5)
+        result = measure(train_step(model, dict(batch), optimizer), self.repeats)
+        return {**result, 'items': self.batch_size, 'tokens': int(batch['attention_mask'].sum())}
+
+    def bench_train_causal_lm(self) -> Dict[str, Any]:
+        model = AutoModelForCausalLM.from_pretrained(os.path.join(self.model_dir, "causal_lm"))
+        records = list(self.processor().format_grouped(self.content[:self.batch_size]))
+        batch = {key: [record[key] for record in records] for key in ("id", "response", "instructions")}
+        features = tokenize_grouped(batch, self.causal_tokenizer, max_length=self.max_length)
+        rows = [
+            {key: features[key][i] for key in ("input_ids", "attention_mask", "labels")}
+            for i in range(min(self.batch_size, len(features['input_ids'])))
+        ]
+        batch = DataCollatorForSeq2Seq(self.causal_tokenizer, label_pad_token_id=-100, pad_to_multiple_of=8)(rows)
+        optimizer = torch.optim.AdamW(model.parameters(), lr=2e-5)
+        result = measure(train_step(model, dict(batch), optimizer), self.repeats)
+        return {**result, 'items': len(rows), 'tokens': int(batch['attention_mask'].sum())}
+
+    def bench_load_cold(self) -> Dict[str, Any]:
+        # Files are in the page cache after the warmup call; this measures deserialization and setup
+        result = measure(lambda: ModelLoader(self.model_dir).load_model("classifier", "classifier"), self.repeats)
+        return {**result, 'items': 1}
+
+    def bench_load_warm(self) -> Dict[str, Any]:
+        loader = ModelLoader(self.model_dir)
+        result = measure(lambda: loader.load_model("classifier", "classifier"), self.repeats)
+        return {**result, 'items': 1}
+
+    def _classifier(self) -> Callable[[List[str]], List[Dict[str, Any]]]:
+        loader = ModelLoader(self.model_dir)
+        model = loader.load_model("classifier", "classifier")
+        model.eval()
+        return classifier_runner(model, loader.get_tokenizer("classifier"), max_length=self.max_length)
+
+    def bench_infer_single(self) -> Dict[str, Any]:
+        run = self._classifier()
+        texts = self.texts[:64]
+
+        def single():
+            for text in texts:
+                run([text])
+
+        return {**measure(single, self.repeats), 'items': len(texts)}
+
+    def bench_infer_batched(self) -> Dict[str, Any]:
+        run = self._classifier()
+        texts = self.texts[:64]
+
+        def batched():
+            for i in range(0, len(texts), self.batch_size):
+                run(texts[i:i + self.batch_size])
+
+        return {**measure(batched, self.repeats), 'items': len(texts)}
+
+    def run(self, names: List[str]) -> Dict[str, Dict[str, Any]]:
+        results = {}
+        for name in names:
+            result = getattr(self, f"bench_{name}")()
+            result['items_per_s'] = result['items'] / result['seconds'] if result['seconds'] else 0.0
+            if 'tokens' in result:
+                result['tokens_per_s'] = result['tokens'] / result['seconds'] if result['seconds'] else 0.0
+            results[name] = result
+            print(f"{name:<20}{result['seconds'] * 1000:>12.2f}{result['items_per_s']:>14.1f}")
+        return results
+
+def environment() -> Dict[str, Any]:
+    return {
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads()
+    }
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """
+    Compare median times against a baseline results file.
+
+    Returns:
+        List[Dict[str, Any]]: Per benchmark in both files: name, baseline and
+        current seconds, ratio, and whether it regressed by more than ``threshold``
+    """
+    rows = []
+    for name, result in results['benchmarks'].items():
+        before = baseline['benchmarks'].get(name)
+        if not before:
+            continue
+        ratio = result['seconds'] / before['seconds'] if before['seconds'] else float('inf')
+        rows.append({
+            'name': name,
+            'baseline_s': before['seconds'],
+            'current_s': result['seconds'],
+            'ratio': ratio,
+            'regressed': ratio > 1 + threshold
+        })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ML scripts on CPU with tiny models")
+    parser.add_argument("--only", help=f"Comma-separated benchmarks (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument("--posts", type=int, default=500, help="Synthetic posts to ingest")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-length", type=int, default=128)
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Slowdown that counts as a regression (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    torch.manual_seed(0)
+    print(f"{'benchmark':<20}{'median ms':>12}{'items/s':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        suite = Suite(tmp, args.posts, args.batch_size, args.max_length, args.repeats)
+        results = {
+            'environment': environment(),
+            'settings': {key: getattr(args, key) for key in ("posts", "batch_size", "max_length", "repeats")},
+            'benchmarks': suite.run(names)
+        }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get('environment') != results['environment'] or baseline.get('settings') != results['settings']:
+            print("warning: baseline was recorded with a different environment or settings")
+        rows = compare(results, baseline, args.threshold)
+        print(f"\n{'benchmark':<20}{'baseline ms':>12}{'current ms':>12}{'change':>10}")
+        for row in rows:
+            flag = "  REGRESSION" if row['regressed'] else ""
+            print(f"{row['name']:<20}{row['baseline_s'] * 1000:>12.2f}{row['current_s'] * 1000:>12.2f}"
+                  f"{row['ratio'] - 1:>+10.1%}{flag}")
+        if any(row['regressed'] for row in rows):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
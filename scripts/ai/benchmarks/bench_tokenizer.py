@@ -0,0 +1,81 @@
+"""
+Benchmark tokenization throughput in texts/sec.
+
+Compares calling the Hugging Face tokenizer directly with
+``TextProcessor.tokenize`` on a cold and a warm cache, with and without Rust
+parallelism. The corpus mixes long unique bodies with short strings that
+repeat, like the titles and tags in the grouped training data.
+
+Example:
+    python benchmarks/bench_tokenizer.py --texts 50000 --batch-size 1000
+    python benchmarks/bench_tokenizer.py --tokenizer distilbert-base-uncased
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.tiny_models import WORDS, make_tokenizer, synthetic_texts
+from utils.text_processor import TextProcessor, set_parallelism
+
+logging.basicConfig(level=logging.WARNING)
+
+def make_corpus(count: int, repeated_fraction: float, seed: int = 0):
+    """Long unique texts mixed with short strings drawn from a small pool."""
+    rng = random.Random(seed)
+    pool = [" ".join(rng.sample(WORDS, rng.randint(2, 6))) for _ in range(200)]
+    bodies = synthetic_texts(count, min_words=40, max_words=200, seed=seed)
+    return [rng.choice(pool) if rng.random() < repeated_fraction else body for body in bodies]
+
+def throughput(run, texts, batch_size: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        run(texts[i:i + batch_size])
+    return len(texts) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark TextProcessor tokenization throughput")
+    parser.add_argument("--tokenizer", help="Model name or path (default: tiny offline tokenizer)")
+    parser.add_argument("--texts", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--max-length", type=int, default=256)
+    parser.add_argument("--repeated-fraction", type=float, default=0.5,
+                        help="Share of texts that are short repeated strings")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    texts = make_corpus(args.texts, args.repeated_fraction)
+    results = {}
+    for parallel in (False, True):
+        set_parallelism(parallel)
+        tokenizer = make_tokenizer(classifier=True) if not args.tokenizer else args.tokenizer
+        processor = TextProcessor(tokenizer, max_length=args.max_length)
+        tokenizer = processor.tokenizer
+        suffix = "parallel" if parallel else "serial"
+
+        results[f"hf_tokenizer_{suffix}"] = throughput(
+            lambda batch: tokenizer(batch, padding=True, truncation=True,
+                                    max_length=args.max_length, return_tensors="np"),
+            texts, args.batch_size
+        )
+        results[f"text_processor_cold_{suffix}"] = throughput(processor.tokenize, texts, args.batch_size)
+        results[f"text_processor_warm_{suffix}"] = throughput(processor.tokenize, texts, args.batch_size)
+        results[f"cache_{suffix}"] = processor.cache_info()
+
+    print(f"{'run':<34}{'texts/s':>12}")
+    for name, value in results.items():
+        if not name.startswith("cache"):
+            print(f"{name:<34}{value:>12.0f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
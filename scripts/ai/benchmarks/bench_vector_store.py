@@ -0,0 +1,98 @@
+"""
+Benchmark VectorStore search latency.
+
+Fills a store with random unit vectors (optionally clustered, like real
+embeddings), then times exact block-scan search and IVF search and reports the
+IVF recall against the exact results.
+
+Example:
+    python benchmarks/bench_vector_store.py --rows 1000000 --dim 384 --dtype float16
+"""
+
+import sys
+import json
+import time
+import argparse
+import logging
+import tempfile
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from data.vector_store import VectorStore
+
+logging.basicConfig(level=logging.WARNING)
+
+def fill_store(store: VectorStore, rows: int, dim: int, clusters: int = 256, batch: int = 100000, seed: int = 0):
+    """Append ``rows`` vectors drawn around random cluster centers."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    for start in range(0, rows, batch):
+        size = min(batch, rows - start)
+        vectors = centers[rng.integers(clusters, size=size)] + 0.5 * rng.standard_normal((size, dim)).astype(np.float32)
+        store.add(vectors, ({'doc': start + i} for i in range(size)))
+    return centers
+
+def time_search(store: VectorStore, queries: np.ndarray, k: int, n_probe: int = None):
+    """Per-query latencies in ms and the hits."""
+    timings, hits = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits.append(store.search(query, k=k, n_probe=n_probe)[0])
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, hits
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VectorStore search")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float16")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-lists", type=int, help="IVF lists (default: 4 * sqrt(rows))")
+    parser.add_argument("--n-probe", type=int, default=16)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = VectorStore(str(Path(tmp) / "store"), dim=args.dim, dtype=args.dtype)
+
+        start = time.perf_counter()
+        centers = fill_store(store, args.rows, args.dim)
+        append_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store.build_index(n_lists=args.n_lists)
+        index_s = time.perf_counter() - start
+
+        rng = np.random.default_rng(1)
+        queries = centers[rng.integers(len(centers), size=args.queries)] + rng.standard_normal((args.queries, args.dim))
+
+        exact_ms, exact_hits = time_search(store, queries, args.k)
+        ivf_ms, ivf_hits = time_search(store, queries, args.k, n_probe=args.n_probe)
+        recall = np.mean([
+            len({row for _, row in approx} & {row for _, row in exact}) / max(len(exact), 1)
+            for approx, exact in zip(ivf_hits, exact_hits)
+        ])
+
+    results = {
+        'rows': args.rows,
+        'dim': args.dim,
+        'dtype': args.dtype,
+        'append_s': append_s,
+        'build_index_s': index_s,
+        'exact_p50_ms': float(np.median(exact_ms)),
+        'ivf_p50_ms': float(np.median(ivf_ms)),
+        'ivf_recall_at_k': float(recall)
+    }
+    print(f"{args.rows} x {args.dim} {args.dtype}: append {append_s:.1f}s, index {index_s:.1f}s")
+    print(f"exact search p50 {results['exact_p50_ms']:.1f} ms")
+    print(f"IVF search p50 {results['ivf_p50_ms']:.2f} ms (n_probe={args.n_probe}, recall@{args.k} {recall:.1%})")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
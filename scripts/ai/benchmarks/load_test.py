@@ -0,0 +1,172 @@
+"""
+Load test for the local inference server.
+
+Runs concurrent keep-alive HTTP clients against models/inference_server.py and
+reports client-side p50/p99 latency and throughput next to the server's own
+metrics. By default it starts the server in-process on a free localhost port;
+``--tiny`` uses tiny random models so no checkpoints or network are needed.
+
+Example:
+    python benchmarks/load_test.py --tiny --endpoint classify --concurrency 64 --requests 5000
+    python benchmarks/load_test.py --tiny --compare-unbatched
+    python benchmarks/load_test.py --url 127.0.0.1:8008 --endpoint generate
+"""
+
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.tiny_models import make_tiny_causal_lm, make_tiny_classifier, synthetic_texts
+from models.inference_server import InferenceServer, LatencyStats
+from models.model_loader import ModelLoader
+
+logging.basicConfig(level=logging.WARNING)
+
+class Connection:
+    """Minimal keep-alive HTTP/1.1 JSON client."""
+
+    def __init__(self, host: str, port: int, unix_socket: str = None):
+        self.host, self.port, self.unix_socket = host, port, unix_socket
+        self.reader = self.writer = None
+
+    async def open(self):
+        if self.unix_socket:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.unix_socket)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method: str, path: str, payload=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b""
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body
+        )
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+
+async def run_load(host, port, unix_socket, endpoint, concurrency, total_requests, texts, max_new_tokens):
+    stats = LatencyStats(window=total_requests)
+    remaining = iter(range(total_requests))
+    errors = 0
+    rng = random.Random(0)
+
+    async def client():
+        nonlocal errors
+        connection = Connection(host, port, unix_socket)
+        await connection.open()
+        try:
+            for _ in remaining:
+                text = rng.choice(texts)
+                if endpoint == "classify":
+                    path, payload = "/v1/classify", {'text': text}
+                else:
+                    path, payload = "/v1/generate", {'prompt': text, 'max_new_tokens': max_new_tokens}
+                start = time.perf_counter()
+                status, _ = await connection.request("POST", path, payload)
+                stats.record_batch(1, [(time.perf_counter() - start) * 1000])
+                errors += status != 200
+        finally:
+            connection.close()
+
+    stats.started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    result = stats.snapshot()
+
+    connection = Connection(host, port, unix_socket)
+    await connection.open()
+    _, server_metrics = await connection.request("GET", "/metrics")
+    connection.close()
+    return {**result, 'errors': errors, 'server': server_metrics.get(endpoint)}
+
+async def run_in_process(args, model_dir, classifier, generator, max_batch_size):
+    server = InferenceServer(ModelLoader(model_dir), classifier=classifier, generator=generator,
+                             max_batch_size=max_batch_size, max_wait_ms=args.max_wait_ms,
+                             max_new_tokens=args.max_new_tokens)
+    listener = await server.start("127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    try:
+        return await run_load("127.0.0.1", port, None, args.endpoint, args.concurrency,
+                              args.requests, synthetic_texts(256), args.max_new_tokens)
+    finally:
+        await server.stop()
+
+def print_result(label, result):
+    server = result['server'] or {}
+    print(f"{label:<22}{result['throughput_per_s']:>10.1f}{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+          f"{server.get('mean_batch_size') or 0:>12.1f}{result['errors']:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the local inference server")
+    parser.add_argument("--url", help="host:port of a running server (default: start one in-process)")
+    parser.add_argument("--unix-socket", help="Unix socket of a running server")
+    parser.add_argument("--tiny", action="store_true", help="Serve tiny random models in-process")
+    parser.add_argument("--model-dir", default="models", help="ModelLoader directory for in-process serving")
+    parser.add_argument("--classifier", default="finetuned_distilbert")
+    parser.add_argument("--generator", default="finetuned_phi")
+    parser.add_argument("--endpoint", choices=["classify", "generate"], default="classify")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--max-new-tokens", type=int, default=16)
+    parser.add_argument("--compare-unbatched", action="store_true",
+                        help="Also run the in-process server with max batch size 1")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    print(f"{'run':<22}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'mean batch':>12}{'errors':>8}")
+    results = {}
+
+    if args.url or args.unix_socket:
+        host, _, port = (args.url or "localhost:0").partition(':')
+        results['remote'] = asyncio.run(run_load(host, int(port), args.unix_socket, args.endpoint,
+                                                 args.concurrency, args.requests, synthetic_texts(256),
+                                                 args.max_new_tokens))
+        print_result("remote", results['remote'])
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            model_dir = tmp if args.tiny else args.model_dir
+            classifier = generator = None
+            if args.endpoint == "classify":
+                classifier = args.classifier
+                if args.tiny:
+                    make_tiny_classifier(str(Path(tmp) / classifier))
+            else:
+                generator = args.generator
+                if args.tiny:
+                    make_tiny_causal_lm(str(Path(tmp) / generator))
+
+            sizes = [args.max_batch_size] + ([1] if args.compare_unbatched else [])
+            for size in sizes:
+                label = f"max_batch_size={size}"
+                results[label] = asyncio.run(run_in_process(args, model_dir, classifier, generator, size))
+                print_result(label, results[label])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Tiny randomly-initialized models for offline benchmarks.
+
+Builds a word-level tokenizer plus a small DistilBERT classifier and a small
+GPT-2 causal LM, saved with ``save_pretrained`` so they load through
+``ModelLoader`` and ``from_pretrained`` exactly like the real checkpoints.
+Nothing is downloaded.
+"""
+
+import os
+import random
+from typing import List
+
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+from transformers import (
+    PreTrainedTokenizerFast,
+    DistilBertConfig,
+    DistilBertForSequenceClassification,
+    GPT2Config,
+    GPT2LMHeadModel
+)
+
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "<|endoftext|>"]
+
+WORDS = (
+    "the a an and or but of to in on for with from by at as is are was were be been "
+    "model data search retrieval agent prompt token embedding vector latency python "
+    "cloud deploy query index cache batch training inference edge service team great "
+    "bad slow fast price value store product customer review help need chatbot title "
+    "write content about instruction response ai machine learning language large"
+).split()
+
+def synthetic_texts(count: int, min_words: int = 8, max_words: int = 120, seed: int = 0) -> List[str]:
+    """Random sentences over the tiny vocabulary, with varied lengths."""
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+        for _ in range(count)
+    ]
+
+def make_tokenizer(classifier: bool = False) -> PreTrainedTokenizerFast:
+    """Word-level fast tokenizer; BERT-style [CLS]/[SEP] wrapping when ``classifier``."""
+    vocab = {token: index for index, token in enumerate(SPECIAL_TOKENS + WORDS)}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+
+    if classifier:
+        tokenizer.post_processor = processors.TemplateProcessing(
+            single="[CLS] $A [SEP]",
+            special_tokens=[("[CLS]", vocab["[CLS]"]), ("[SEP]", vocab["[SEP]"])]
+        )
+        return PreTrainedTokenizerFast(
+            tokenizer_object=tokenizer, unk_token="[UNK]", pad_token="[PAD]",
+            cls_token="[CLS]", sep_token="[SEP]", mask_token="[MASK]", model_max_length=512
+        )
+
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, unk_token="[UNK]", pad_token="<|endoftext|>",
+        eos_token="<|endoftext|>", bos_token="<|endoftext|>", model_max_length=512
+    )
+
+def make_tiny_classifier(path: str, num_labels: int = 5, layers: int = 2, dim: int = 64, seed: int = 0) -> str:
+    """Save a random DistilBERT sequence classifier and its tokenizer to ``path``."""
+    import torch
+
+    torch.manual_seed(seed)
+    tokenizer = make_tokenizer(classifier=True)
+    config = DistilBertConfig(
+        vocab_size=len(tokenizer), n_layers=layers, n_heads=4, dim=dim, hidden_dim=4 * dim,
+        max_position_embeddings=512, num_labels=num_labels, pad_token_id=tokenizer.pad_token_id
+    )
+    os.makedirs(path, exist_ok=True)
+    DistilBertForSequenceClassification(config).save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    return path
+
+def make_tiny_causal_lm(path: str, layers: int = 2, dim: int = 64, seed: int = 0) -> str:
+    """Save a random GPT-2 causal LM and its tokenizer to ``path``."""
+    import torch
+
+    torch.manual_seed(seed)
+    tokenizer = make_tokenizer()
+    config = GPT2Config(
+        vocab_size=len(tokenizer), n_layer=layers, n_head=4, n_embd=dim, n_positions=1024,
+        bos_token_id=tokenizer.eos_token_id, eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id
+    )
+    os.makedirs(path, exist_ok=True)
+    GPT2LMHeadModel(config).save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    return path
@@ -0,0 +1,233 @@
+"""
+Token-aware streaming chunker for markdown documents.
+
+Files are read line by line in binary mode, so memory stays bounded by the
+chunk budget rather than the document size. Lines are grouped into blocks
+(paragraphs, headings, fenced code), and blocks are packed into chunks of at
+most ``max_tokens`` tokens. The real tokenizer counts the chunk text, blank
+line separators included. Each heading starts a new chunk. When a section
+continues into a new chunk, that chunk starts with the last ``overlap`` tokens
+of the previous one. A block that is longer than the budget on its own is
+split into overlapping token windows.
+
+A chunk's ``text`` is its blocks joined with a blank line, which is what gets
+embedded. It covers the source bytes ``[start, end)``, but the whitespace
+between blocks is normalized, so it is not a byte-exact slice of the file.
+Every chunk also has an ID derived from the path and the chunk text.
+Re-chunking an edited file therefore gives the same IDs to the chunks that
+did not change, and their embeddings can be reused.
+"""
+
+import re
+import hashlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Longest line read at once; longer lines are read in pieces
+MAX_LINE_BYTES = 1 << 20
+# Paragraphs or code blocks larger than this are cut into several blocks
+MAX_BLOCK_BYTES = 1 << 20
+
+HEADING = re.compile(rb"^#{1,6}(\s|$)")
+# Blocks of a chunk are joined with a blank line
+SEPARATOR = "\n\n"
+
+def _iter_blocks(path: str) -> Iterator[Tuple[int, int, str, bool]]:
+    """
+    Yield ``(start_byte, end_byte, text, is_heading)`` for each markdown block.
+
+    YAML frontmatter at the top of the file is skipped. Blank lines end a
+    paragraph; headings are blocks of their own; fenced code is kept whole.
+    """
+    lines: List[bytes] = []
+    block_start = offset = 0
+    in_fence = in_frontmatter = False
+
+    def flush():
+        raw = b"".join(lines)
+        lines.clear()
+        text = raw.strip()
+        if not text:
+            return None
+        # Offsets cover the stripped text so they line up with token offsets
+        start = block_start + len(raw) - len(raw.lstrip())
+        return start, start + len(text), text.decode('utf-8', errors='replace'), False
+
+    with open(path, 'rb') as f:
+        while True:
+            line = f.readline(MAX_LINE_BYTES)
+            if not line:
+                break
+            line_start, offset = offset, offset + len(line)
+            stripped = line.strip()
+
+            if line_start == 0 and stripped == b"---":
+                in_frontmatter = True
+                block_start = offset
+            elif in_frontmatter:
+                in_frontmatter = stripped != b"---"
+                block_start = offset
+            elif stripped.startswith(b"```") or stripped.startswith(b"~~~"):
+                if not lines:
+                    block_start = line_start
+                lines.append(line)
+                in_fence = not in_fence
+            elif in_fence:
+                lines.append(line)
+            elif HEADING.match(stripped):
+                block = flush()
+                if block:
+                    yield block
+                heading_start = line_start + len(line) - len(line.lstrip())
+                yield heading_start, heading_start + len(stripped), stripped.decode('utf-8', errors='replace'), True
+                block_start = offset
+            elif not stripped:
+                block = flush()
+                if block:
+                    yield block
+                block_start = offset
+            else:
+                if not lines:
+                    block_start = line_start
+                lines.append(line)
+
+            if lines and offset - block_start > MAX_BLOCK_BYTES:
+                block = flush()
+                if block:
+                    yield block
+                block_start = offset
+
+    block = flush()
+    if block:
+        yield block
+
+class MarkdownChunker:
+    def __init__(self, tokenizer, max_tokens: int = 256, overlap: int = 32):
+        """
+        Args:
+            tokenizer: Hugging Face tokenizer used to measure chunks; a fast
+                tokenizer is needed to split blocks longer than ``max_tokens``
+            max_tokens (int): Token budget per chunk
+            overlap (int): Tokens repeated from the end of one chunk at the
+                start of the next within a section
+        """
+        if overlap >= max_tokens:
+            raise ValueError(f"overlap ({overlap}) must be smaller than max_tokens ({max_tokens})")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def _split_long(self, start: int, text: str) -> Iterator[Tuple[int, int, str, int]]:
+        """Split one oversized block into overlapping windows of ``max_tokens`` tokens."""
+        encoding = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        spans = encoding["offset_mapping"]
+        step = self.max_tokens - self.overlap
+        for first in range(0, len(spans), step):
+            window = spans[first:first + self.max_tokens]
+            char_start, char_end = window[0][0], window[-1][1]
+            byte_start = start + len(text[:char_start].encode('utf-8'))
+            piece = text[char_start:char_end]
+            yield byte_start, byte_start + len(piece.encode('utf-8')), piece, len(window)
+            if first + self.max_tokens >= len(spans):
+                break
+
+    def _overlap_tail(self, parts: List[Tuple[int, int, str]]) -> Optional[Tuple[int, int, str]]:
+        """The last ``overlap`` tokens of a chunk, as a part that starts the next chunk."""
+        if not self.overlap:
+            return None
+        text = SEPARATOR.join(part[2] for part in parts)
+        spans = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        if not spans:
+            return None
+        char_start = spans[-self.overlap:][0][0]
+        # Tokens can start with the whitespace of a separator
+        char_start += len(text[char_start:]) - len(text[char_start:].lstrip())
+        # Map the offset in the joined text back to a byte offset in the source
+        offset = 0
+        for start, _, part_text in parts:
+            if char_start < offset + len(part_text):
+                byte_start = start + len(part_text[:max(0, char_start - offset)].encode('utf-8'))
+                return byte_start, parts[-1][1], text[char_start:]
+            offset += len(part_text) + len(SEPARATOR)
+        return None
+
+    def chunk_file(self, path: str) -> Iterator[Dict[str, Any]]:
+        """
+        Stream the chunks of one markdown file.
+
+        Args:
+            path (str): Markdown file
+
+        Returns:
+            Iterator[Dict[str, Any]]: Chunks with ``id``, ``path``, ``start``
+            and ``end`` (byte offsets), ``text``, ``tokens`` and ``headings``
+        """
+        pending: List[Tuple[int, int, str]] = []
+        pending_tokens = 0
+        headings: List[Tuple[int, str]] = []
+        seen: Dict[str, int] = {}
+        # Whether ``pending`` holds a block that no emitted chunk has covered yet
+        fresh = False
+
+        def emit(parts, tokens: int) -> Dict[str, Any]:
+            nonlocal fresh
+            fresh = False
+            text = SEPARATOR.join(part[2] for part in parts)
+            digest = hashlib.sha256(f"{path}\0{text}".encode('utf-8')).hexdigest()[:16]
+            # Identical text within one file gets an occurrence suffix
+            occurrence = seen.get(digest, 0)
+            seen[digest] = occurrence + 1
+            return {
+                'id': digest if occurrence == 0 else f"{digest}-{occurrence}",
+                'path': path,
+                'start': parts[0][0],
+                'end': parts[-1][1],
+                'text': text,
+                'tokens': tokens,
+                'headings': [title for _, title in headings]
+            }
+
+        def joined_tokens(parts) -> int:
+            # Counted on the joined text: separators take tokens and can change merges at the seams
+            return self.count_tokens(SEPARATOR.join(part[2] for part in parts))
+
+        for start, end, text, is_heading in _iter_blocks(path):
+            block = (start, end, text)
+
+            if is_heading:
+                if pending and fresh:
+                    yield emit(pending, pending_tokens)
+                level = len(text) - len(text.lstrip('#'))
+                headings = [(lvl, title) for lvl, title in headings if lvl < level]
+                headings.append((level, text.lstrip('#').strip()))
+                pending, pending_tokens = [block], self.count_tokens(text)
+                fresh = True
+                continue
+
+            tokens = self.count_tokens(text)
+            if tokens > self.max_tokens:
+                if pending and fresh:
+                    yield emit(pending, pending_tokens)
+                pending, pending_tokens = [], 0
+                for piece_start, piece_end, piece, piece_tokens in self._split_long(start, text):
+                    yield emit([(piece_start, piece_end, piece)], piece_tokens)
+                continue
+
+            combined = joined_tokens(pending + [block]) if pending else tokens
+            if combined > self.max_tokens:
+                yield emit(pending, pending_tokens)
+                tail = self._overlap_tail(pending)
+                pending = [tail] if tail else []
+                combined = joined_tokens(pending + [block]) if pending else tokens
+                # Drop the carried tail if the new block does not fit next to it
+                if combined > self.max_tokens:
+                    pending, combined = [], tokens
+            pending.append(block)
+            pending_tokens = combined
+            fresh = True
+
+        # A trailing chunk made only of carried-over overlap adds nothing new
+        if pending and fresh:
+            yield emit(pending, pending_tokens)
@@ -1,116 +1,378 @@
 """
 Process website content for model training.
 Collects and processes all posts and pages from the Hugo website.
+
+Parsed records are cached in an on-disk manifest keyed by path, mtime and
+content hash, so a rebuild only re-parses files that were added or edited.
 """
 
 import os
+import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 import frontmatter
 import logging
 
+# Also runnable as ``python data/content_processor.py``
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from data.jsonl_io import write_jsonl
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+MANIFEST_VERSION = 1
+
+# Below this many files to parse, pool start-up costs more than it saves
+MIN_PARALLEL_FILES = 64
+
+def parse_markdown(file_path: str, raw: bytes) -> Dict[str, Any]:
+    """Parse raw markdown bytes into a content record. Raises on bad input."""
+    post = frontmatter.loads(raw.decode('utf-8'))
+    return {
+        'path': file_path,
+        'title': post.metadata.get('title', ''),
+        'description': post.metadata.get('description', ''),
+        'content': post.content,
+        'tags': post.metadata.get('tags', []),
+        'categories': post.metadata.get('categories', []),
+        # YAML may parse dates into date objects; keep records JSON-safe
+        'date': str(post.metadata.get('date', ''))
+    }
+
+def load_markdown(task: Tuple[str, Optional[str]]) -> Dict[str, Any]:
+    """
+    Read, hash and parse one file. Runs in pool workers, so it only returns data.
+
+    Args:
+        task (Tuple[str, Optional[str]]): File path and the cached content hash, if any
+
+    Returns:
+        Dict[str, Any]: ``sha256`` plus either ``record``, ``unchanged`` or ``error``
+    """
+    file_path, cached_sha256 = task
+    result = {'path': file_path, 'sha256': None, 'record': None, 'unchanged': False, 'error': None}
+    try:
+        with open(file_path, 'rb') as f:
+            raw = f.read()
+        result['sha256'] = hashlib.sha256(raw).hexdigest()
+        if result['sha256'] == cached_sha256:
+            result['unchanged'] = True
+        else:
+            result['record'] = parse_markdown(file_path, raw)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
 class ContentProcessor:
-    def __init__(self, content_dir: str = "content"):
+    def __init__(self,
+                 content_dir: str = "content",
+                 cache_path: str = None,
+                 workers: int = 1,
+                 chunksize: int = None):
+        """
+        Args:
+            content_dir (str): Hugo content directory
+            cache_path (str): Location of the parsed-record manifest
+            workers (int): Parser processes; 1 parses in-process, None uses every core
+            chunksize (int): Files handed to a worker at a time (default: auto)
+        """
         self.content_dir = content_dir
         self.posts_dir = os.path.join(content_dir, "posts")
         self.pages_dir = os.path.join(content_dir, "pages")
+        self.cache_path = cache_path or os.path.join("data", "processed", "content_manifest.json")
+        self.workers = workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.changes = self._empty_changes()
+        self.errors = []
     
-    def process_markdown(self, file_path: str) -> Dict[str, Any]:
+    @staticmethod
+    def _empty_changes() -> Dict[str, Any]:
+        return {
+            'changed': True,
+            'added': [],
+            'modified': [],
+            'removed': [],
+            'reused': 0,
+            'fingerprint': None
+        }
+
+    def process_markdown(self, file_path: str, raw: bytes = None) -> Dict[str, Any]:
         """Process a markdown file and extract content and metadata."""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                post = frontmatter.load(f)
-                
-            return {
-                'path': file_path,
-                'title': post.metadata.get('title', ''),
-                'description': post.metadata.get('description', ''),
-                'content': post.content,
-                'tags': post.metadata.get('tags', []),
-                'categories': post.metadata.get('categories', []),
-                'date': post.metadata.get('date', '')
-            }
+            if raw is None:
+                with open(file_path, 'rb') as f:
+                    raw = f.read()
+            return parse_markdown(file_path, raw)
         except Exception as e:
             logger.error(f"Error processing {file_path}: {str(e)}")
             return None
 
-    def collect_content(self) -> List[Dict[str, Any]]:
-        """Collect all content from posts and pages."""
-        content = []
-        
-        # Process posts
-        for root, _, files in os.walk(self.posts_dir):
-            for file in files:
-                if file.endswith('.md'):
-                    file_path = os.path.join(root, file)
-                    processed = self.process_markdown(file_path)
-                    if processed:
-                        content.append(processed)
-        
-        # Process pages
-        for root, _, files in os.walk(self.pages_dir):
-            for file in files:
-                if file.endswith('.md'):
-                    file_path = os.path.join(root, file)
-                    processed = self.process_markdown(file_path)
-                    if processed:
-                        content.append(processed)
-        
+    def _markdown_files(self) -> List[str]:
+        """
+        Scan the posts and pages directories once.
+
+        Posts come before pages and each tree is sorted, so the order of the
+        collected content does not depend on the filesystem or worker count.
+        """
+        paths = []
+        for directory in (self.posts_dir, self.pages_dir):
+            found = []
+            for root, _, files in os.walk(directory):
+                for file in files:
+                    if file.endswith('.md'):
+                        found.append(os.path.join(root, file))
+            paths.extend(sorted(found))
+        return paths
+
+    def load_manifest(self) -> Dict[str, Any]:
+        """Load the cached manifest, or an empty one if missing or stale."""
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+            logger.info("Content manifest version changed, rebuilding cache")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable content manifest {self.cache_path}: {str(e)}")
+        return {'version': MANIFEST_VERSION, 'fingerprint': None, 'files': {}}
+
+    def save_manifest(self, manifest: Dict[str, Any]):
+        """Atomically write the manifest next to the processed data."""
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+
+    @staticmethod
+    def corpus_fingerprint(files: Dict[str, Dict[str, Any]]) -> str:
+        """Hash of every (path, content hash) pair; changes iff the corpus does."""
+        digest = hashlib.sha256()
+        for path in sorted(files):
+            digest.update(path.encode('utf-8'))
+            digest.update(b'\0')
+            digest.update(files[path]['sha256'].encode('ascii'))
+            digest.update(b'\n')
+        return digest.hexdigest()
+
+    def output_is_current(self, output_path: str) -> bool:
+        """Whether ``output_path`` was built from the corpus last collected."""
+        try:
+            with open(f"{output_path}.fingerprint", 'r', encoding='utf-8') as f:
+                stamp = f.read().strip()
+        except OSError:
+            return False
+        return os.path.exists(output_path) and stamp == self.changes['fingerprint']
+
+    def mark_output_current(self, output_path: str):
+        """Stamp ``output_path`` with the fingerprint of the collected corpus."""
+        with open(f"{output_path}.fingerprint", 'w', encoding='utf-8') as f:
+            f.write(self.changes['fingerprint'] or '')
+
+    def _load_all(self, tasks: List[Tuple[str, Optional[str]]]) -> Iterator[Dict[str, Any]]:
+        """Run ``load_markdown`` over tasks, in a process pool when worthwhile."""
+        if self.workers <= 1 or len(tasks) < MIN_PARALLEL_FILES:
+            return map(load_markdown, tasks)
+
+        chunksize = self.chunksize or max(1, len(tasks) // (self.workers * 8))
+        logger.info(f"Parsing {len(tasks)} files with {self.workers} workers (chunksize={chunksize})")
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            # Executor.map preserves input order, which keeps output deterministic
+            return list(executor.map(load_markdown, tasks, chunksize=chunksize))
+
+    def collect_content(self, use_cache: bool = True) -> List[Dict[str, Any]]:
+        """
+        Collect all content from posts and pages.
+
+        Files whose mtime and size match the manifest are served from the cache
+        without being read. The rest are read, hashed and, if their content
+        changed, parsed - across ``self.workers`` processes when there are
+        enough of them. After the call, ``self.changes`` describes what
+        differed from the previous build; ``self.changes['changed']`` is False
+        when the corpus is identical, and ``output_is_current`` tells
+        downstream stages whether their output was already built from this
+        exact corpus. Files that failed to parse are listed in ``self.errors``.
+
+        Args:
+            use_cache (bool): Read and update the on-disk manifest
+
+        Returns:
+            List[Dict[str, Any]]: Parsed records, one per markdown file
+        """
+        previous = self.load_manifest() if use_cache else {'fingerprint': None, 'files': {}}
+        cached_files = previous['files']
+        files = {}
+        changes = self._empty_changes()
+        self.errors = []
+
+        paths = self._markdown_files()
+        stats = {}
+        tasks = []
+        for file_path in paths:
+            stat = os.stat(file_path)
+            entry = cached_files.get(file_path)
+
+            if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+                files[file_path] = entry
+                changes['reused'] += 1
+                continue
+
+            stats[file_path] = stat
+            tasks.append((file_path, entry['sha256'] if entry else None))
+
+        for result in self._load_all(tasks):
+            file_path = result['path']
+            entry = cached_files.get(file_path)
+
+            if result['error']:
+                logger.error(f"Error processing {file_path}: {result['error']}")
+                self.errors.append({'path': file_path, 'error': result['error']})
+                continue
+
+            if result['unchanged']:
+                # Touched but not edited: refresh the stat, keep the record
+                record = entry['record']
+                changes['reused'] += 1
+            else:
+                record = result['record']
+                changes['modified' if entry else 'added'].append(file_path)
+
+            stat = stats[file_path]
+            files[file_path] = {
+                'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'sha256': result['sha256'],
+                'record': record
+            }
+
+        content = [files[file_path]['record'] for file_path in paths if file_path in files]
+
+        changes['removed'] = sorted(set(cached_files) - set(files))
+        changes['fingerprint'] = self.corpus_fingerprint(files)
+        changes['changed'] = changes['fingerprint'] != previous['fingerprint']
+        self.changes = changes
+
+        if use_cache and (changes['changed'] or files != cached_files):
+            self.save_manifest({
+                'version': MANIFEST_VERSION,
+                'fingerprint': changes['fingerprint'],
+                'files': files
+            })
+
+        logger.info(
+            f"Collected {len(content)} content items "
+            f"({len(changes['added'])} added, {len(changes['modified'])} modified, "
+            f"{len(changes['removed'])} removed, {changes['reused']} cached, "
+            f"{len(self.errors)} failed)"
+        )
         return content
 
-    def format_for_training(self, content: List[Dict[str, Any]]) -> List[Dict[str, str]]:
-        """Format content for model training."""
-        training_data = []
-        
+    def format_grouped(self, content: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Format content as deduplicated training records.
+
+        Each post yields one record holding its response body once, with every
+        instruction that maps to it (title, then categories, then tags).
+        ``GCPTrainer`` expands the records at tokenization time and tokenizes
+        each body only once.
+
+        Args:
+            content (Iterable[Dict[str, Any]]): Records from ``collect_content``
+
+        Returns:
+            Iterator[Dict[str, Any]]: ``{'id', 'response', 'instructions'}`` records
+        """
         for item in content:
-            # Create instruction-response pairs
-            instruction = f"Write content about {item['title']}"
             response = f"Title: {item['title']}\n\n{item['content']}"
-            
-            training_data.append({
-                'instruction': instruction,
-                'response': response
-            })
+            instructions = [f"Write content about {item['title']}"]
             
             # Add category-based examples
-            if item['categories']:
-                for category in item['categories']:
-                    instruction = f"Write content about {category}"
-                    response = f"Title: {item['title']}\n\n{item['content']}"
-                    training_data.append({
-                        'instruction': instruction,
-                        'response': response
-                    })
+            for category in item['categories'] or []:
+                instructions.append(f"Write content about {category}")
             
             # Add tag-based examples
-            if item['tags']:
-                for tag in item['tags']:
-                    instruction = f"Write content about {tag}"
-                    response = f"Title: {item['title']}\n\n{item['content']}"
-                    training_data.append({
-                        'instruction': instruction,
-                        'response': response
-                    })
-        
-        return training_data
+            for tag in item['tags'] or []:
+                instructions.append(f"Write content about {tag}")
+            
+            yield {
+                'id': hashlib.sha256(response.encode('utf-8')).hexdigest()[:16],
+                'response': response,
+                'instructions': instructions
+            }
+
+    def format_for_training(self, content: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, str]]:
+        """
+        Format content for model training as flat instruction-response pairs.
+
+        Examples are yielded one at a time so they can be streamed to disk
+        with ``write_jsonl`` without materializing the expanded list.
+        """
+        for record in self.format_grouped(content):
+            for instruction in record['instructions']:
+                yield {
+                    'instruction': instruction,
+                    'response': record['response']
+                }
+
+    def write_training_data(self, content: Iterable[Dict[str, Any]], output_path: str) -> Tuple[int, int]:
+        """
+        Stream deduplicated training records to ``output_path`` and stamp it.
+
+        Args:
+            content (Iterable[Dict[str, Any]]): Records from ``collect_content``
+            output_path (str): JSONL output path (.gz/.zst to compress)
+
+        Returns:
+            Tuple[int, int]: Number of records (unique responses) and of expanded examples
+        """
+        num_examples = 0
+
+        def counted(records):
+            nonlocal num_examples
+            for record in records:
+                num_examples += len(record['instructions'])
+                yield record
+
+        num_records = write_jsonl(counted(self.format_grouped(content)), output_path)
+        self.mark_output_current(output_path)
+        return num_records, num_examples
 
 def main():
-    processor = ContentProcessor()
-    content = processor.collect_content()
-    training_data = processor.format_for_training(content)
+    parser = argparse.ArgumentParser(description="Build training data from the website content")
+    parser.add_argument("--content-dir", default="content", help="Hugo content directory")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Parser processes (0 uses every core)")
+    parser.add_argument("--chunksize", type=int, default=None, help="Files per worker task")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore the content manifest")
+    parser.add_argument("--output", default="data/processed/training_data.jsonl",
+                        help="Output JSONL file; a .gz or .zst suffix compresses it")
+    args = parser.parse_args()
+
+    processor = ContentProcessor(
+        content_dir=args.content_dir,
+        workers=args.workers or None,
+        chunksize=args.chunksize
+    )
+    content = processor.collect_content(use_cache=not args.no_cache)
     
     # Save processed data
-    output_dir = "data/processed"
-    os.makedirs(output_dir, exist_ok=True)
-    
-    import json
-    with open(os.path.join(output_dir, "training_data.json"), 'w', encoding='utf-8') as f:
-        json.dump(training_data, f, indent=2, ensure_ascii=False)
+    output_path = args.output
+
+    if processor.output_is_current(output_path):
+        logger.info("Content unchanged since last build, keeping existing training data")
+        return
+
+    num_records, num_examples = processor.write_training_data(content, output_path)
     
-    logger.info(f"Processed {len(content)} content items into {len(training_data)} training examples")
+    logger.info(f"Processed {len(content)} content items into {num_examples} training examples "
+                f"({num_records} unique responses)")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
@@ -3,9 +3,13 @@ Document loader for AI tasks.
 Handles loading and processing of documents for model training or inference.
 """
 
-import json
+import os
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Set
+import numpy as np
+
+from data.chunker import MarkdownChunker
+from data.vector_store import VectorStore
 
 class DocumentLoader:
     def __init__(self, data_dir: str = None):
@@ -36,13 +40,72 @@ class DocumentLoader:
         
         return documents
     
-    def save_embeddings(self, embeddings: List[Dict[str, Any]], output_path: str):
+    def iter_chunks(self,
+                    file_paths: List[str],
+                    tokenizer,
+                    max_tokens: int = 256,
+                    overlap: int = 32,
+                    skip_ids: Optional[Set[str]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Stream token-bounded chunks of markdown documents.
+        
+        Files are read incrementally, so memory does not grow with document
+        size. See ``data/chunker.py`` for how chunks are formed.
+        
+        Args:
+            file_paths (List[str]): List of file paths to chunk
+            tokenizer: Hugging Face tokenizer that measures chunk length
+            max_tokens (int): Token budget per chunk
+            overlap (int): Overlap in tokens between consecutive chunks of a section
+            skip_ids (Optional[Set[str]]): Chunk IDs that are already embedded
+            
+        Returns:
+            Iterator[Dict[str, Any]]: Chunks with ``id``, ``path``, ``start``,
+            ``end``, ``text``, ``tokens`` and ``headings``
+        """
+        chunker = MarkdownChunker(tokenizer, max_tokens=max_tokens, overlap=overlap)
+        for file_path in file_paths:
+            try:
+                for chunk in chunker.chunk_file(file_path):
+                    if skip_ids is None or chunk['id'] not in skip_ids:
+                        yield chunk
+            except OSError as e:
+                print(f"Error loading {file_path}: {str(e)}")
+    
+    def save_embeddings(self,
+                        embeddings: List[Dict[str, Any]],
+                        output_path: str,
+                        dtype: str = "float32",
+                        metric: str = "cosine") -> VectorStore:
+        """
+        Append document embeddings to a memory-mapped vector store.
+        
+        Args:
+            embeddings (List[Dict[str, Any]]): Records with an 'embedding'
+                vector; all other keys are stored as the row's metadata
+            output_path (str): Vector store directory; created if missing,
+                appended to otherwise
+            dtype (str): On-disk dtype for a new store ('float32' or 'float16')
+            metric (str): Search metric for a new store ('cosine' or 'dot')
+            
+        Returns:
+            VectorStore: The store, ready for ``search``/``query``
+        """
+        store = VectorStore(output_path, dtype=dtype, metric=metric)
+        if embeddings:
+            store.add(
+                np.asarray([record['embedding'] for record in embeddings], dtype=np.float32),
+                [{key: value for key, value in record.items() if key != 'embedding'} for record in embeddings]
+            )
+        return store
+    
+    def load_embeddings(self, path: str) -> VectorStore:
         """
-        Save document embeddings to a file.
+        Open a vector store written by ``save_embeddings``.
         
         Args:
-            embeddings (List[Dict[str, Any]]): List of document embeddings
-            output_path (str): Path to save embeddings
+            path (str): Vector store directory
         """
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(embeddings, f, indent=2) 
\ No newline at end of file
+        if not os.path.exists(os.path.join(path, "header.json")):
+            raise FileNotFoundError(f"No vector store at {path}")
+        return VectorStore(path)
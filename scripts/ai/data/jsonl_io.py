@@ -0,0 +1,67 @@
+"""
+Streaming JSONL writer for training data.
+
+Records are written one per line, so the whole dataset is never held in
+memory. ``GCPTrainer.prepare_dataset`` reads the files back through the
+``datasets`` json builder. Compression is picked from the file suffix:
+``.gz`` uses gzip and ``.zst`` uses zstandard (optional dependency).
+"""
+
+import os
+import io
+import gzip
+import json
+from typing import Any, Dict, Iterable
+
+def open_text(path: str, mode: str = 'r'):
+    """
+    Open a possibly compressed text file.
+
+    Args:
+        path (str): File path; the suffix selects the compression
+        mode (str): 'r' or 'w'
+
+    Returns:
+        A text file object
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("Reading or writing .zst files requires `pip install zstandard`") from e
+        if mode == 'w':
+            stream = zstandard.ZstdCompressor(level=10).stream_writer(open(path, 'wb'))
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def write_jsonl(records: Iterable[Dict[str, Any]], path: str) -> int:
+    """
+    Stream records to a JSONL file, replacing it atomically.
+
+    Args:
+        records (Iterable[Dict[str, Any]]): Records to write; consumed lazily
+        path (str): Output path (.jsonl, .jsonl.gz or .jsonl.zst)
+
+    Returns:
+        int: Number of records written
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # Keep the compression suffix on the temp file so open_text picks the same codec
+    tmp_path = os.path.join(os.path.dirname(path), f".tmp-{os.path.basename(path)}")
+    count = 0
+    try:
+        with open_text(tmp_path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False))
+                f.write('\n')
+                count += 1
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return count
@@ -0,0 +1,285 @@
+"""
+Streaming training data from local parquet or Arrow files.
+
+``StreamingTextDataset`` reads a split straight from its files, one row group
+(parquet) or record batch (Arrow) at a time, so nothing is materialized or
+tokenized before the first step. Row groups are split between data-parallel
+ranks and loader workers, read in a seeded order each epoch, and mixed
+through a shuffle buffer. Texts are tokenized in small chunks as they leave
+the buffer, inside the data-loader workers. Training streams repeat, so the
+run length is set by ``max_steps``.
+
+``num_samples`` keeps a deterministic, label-stratified subsample. Only the
+label column is read up front to choose the rows, and the same seed always
+picks the same rows. ``load_eval_subset`` tokenizes a bounded stratified
+subset into a regular ``Dataset`` for evaluation.
+
+The files are the ones the Hugging Face Hub serves for a dataset (e.g.
+``train-00000-of-00001.parquet``), or ``.arrow`` files from a
+``save_to_disk``/``datasets`` cache, so runs work offline.
+"""
+
+import os
+import glob
+import random
+import logging
+import functools
+import itertools
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from torch.utils.data import IterableDataset, get_worker_info
+
+from utils.text_processor import processor_for
+
+logger = logging.getLogger(__name__)
+
+DATA_FILE_EXTENSIONS = (".parquet", ".arrow")
+
+# Rows per tokenizer call
+TOKENIZE_CHUNK_SIZE = 256
+
+def split_files(data_dir: str, split: str) -> List[str]:
+    """Parquet or Arrow files of ``split`` under ``data_dir``, e.g. ``train-00000-of-00002.parquet``."""
+    files = []
+    for path in glob.glob(os.path.join(data_dir, "**", "*"), recursive=True):
+        name = os.path.basename(path)
+        if not name.endswith(DATA_FILE_EXTENSIONS):
+            continue
+        # Hub layout names the files by split; save_to_disk puts them in a directory per split
+        if name.startswith((f"{split}-", f"{split}.")) or os.path.basename(os.path.dirname(path)) == split:
+            files.append(path)
+    files.sort()
+    if not files:
+        raise FileNotFoundError(f"No {split} parquet or Arrow files under {data_dir}")
+    return files
+
+def _open_arrow(path: str):
+    source = pa.memory_map(path, "r")
+    try:
+        return pa.ipc.open_file(source)
+    except pa.ArrowInvalid:
+        # datasets writes the streaming IPC format
+        source.seek(0)
+        return pa.ipc.open_stream(source)
+
+@functools.lru_cache(maxsize=8)
+def _arrow_batches(path: str) -> List[pa.RecordBatch]:
+    """Record batches of an Arrow file, memory-mapped rather than read."""
+    reader = _open_arrow(path)
+    if isinstance(reader, pa.ipc.RecordBatchFileReader):
+        return [reader.get_batch(i) for i in range(reader.num_record_batches)]
+    return list(reader)
+
+def list_fragments(files: List[str]) -> List[Tuple[str, int, int]]:
+    """``(path, index, rows)`` for every parquet row group or Arrow record batch, in file order."""
+    fragments = []
+    for path in files:
+        if path.endswith(".parquet"):
+            metadata = pq.ParquetFile(path).metadata
+            fragments.extend((path, i, metadata.row_group(i).num_rows) for i in range(metadata.num_row_groups))
+        else:
+            fragments.extend((path, i, batch.num_rows) for i, batch in enumerate(_arrow_batches(path)))
+    return fragments
+
+def read_fragment(path: str, index: int, columns: List[str]) -> Dict[str, List[Any]]:
+    """Columns of one row group or record batch as Python lists."""
+    if path.endswith(".parquet"):
+        table = pq.ParquetFile(path).read_row_group(index, columns=columns)
+    else:
+        table = pa.Table.from_batches([_arrow_batches(path)[index]]).select(columns)
+    return table.to_pydict()
+
+def read_labels(files: List[str], label_column: str) -> np.ndarray:
+    """The label column of all files, in row order, without reading any text."""
+    columns = []
+    for path in files:
+        if path.endswith(".parquet"):
+            columns.append(pq.read_table(path, columns=[label_column]).column(0).to_numpy())
+        else:
+            columns.extend(batch.column(label_column).to_numpy() for batch in _arrow_batches(path))
+    return np.concatenate(columns) if columns else np.array([], dtype=np.int64)
+
+def stratified_sample(labels: np.ndarray, num_samples: int, seed: int = 0) -> np.ndarray:
+    """
+    Row indices of a subsample with (as near as possible) equal rows per label.
+
+    Labels with fewer rows than their share contribute all of them, and the
+    shortfall goes to the others. The same labels and seed give the same rows.
+
+    Returns:
+        np.ndarray: Sorted row indices
+    """
+    rng = np.random.default_rng(seed)
+    groups = [rng.permutation(np.flatnonzero(labels == label)) for label in np.unique(labels)]
+    quotas = [0] * len(groups)
+    remaining = min(num_samples, len(labels))
+    # Hand out rows one equal share at a time; small labels drop out as they run dry
+    open_groups = [i for i, group in enumerate(groups) if len(group)]
+    while remaining and open_groups:
+        share, extra = divmod(remaining, len(open_groups))
+        for position, i in enumerate(open_groups):
+            take = min(share + (position < extra), len(groups[i]) - quotas[i])
+            quotas[i] += take
+            remaining -= take
+        open_groups = [i for i in open_groups if quotas[i] < len(groups[i])]
+    selected = [group[:quota] for group, quota in zip(groups, quotas)]
+    return np.sort(np.concatenate(selected)) if selected else np.array([], dtype=np.int64)
+
+class StreamingTextDataset(IterableDataset):
+    def __init__(self,
+                 files: List[str],
+                 tokenizer,
+                 max_length: Optional[int] = 512,
+                 text_column: str = "text",
+                 label_column: Optional[str] = "label",
+                 num_samples: Optional[int] = None,
+                 shuffle: bool = True,
+                 buffer_size: int = 10000,
+                 repeat: bool = True,
+                 seed: int = 0,
+                 rank: int = 0,
+                 world_size: int = 1):
+        """
+        Args:
+            files (List[str]): Parquet or Arrow files of one split
+            tokenizer: Hugging Face fast tokenizer
+            max_length (Optional[int]): Truncation length; None keeps texts whole
+            text_column (str): Column to tokenize
+            label_column (Optional[str]): Column copied to ``labels``; also the
+                strata for ``num_samples``
+            num_samples (Optional[int]): Keep a label-stratified subsample of this many rows
+            shuffle (bool): Shuffle the row-group order each epoch and mix rows in a buffer
+            buffer_size (int): Rows held in the shuffle buffer; more mixes better
+                but takes longer to fill before the first batch
+            repeat (bool): Start the next epoch when the data runs out (for training)
+            seed (int): Seed for the subsample and, with the epoch, the order
+            rank (int): Data-parallel rank reading this stream
+            world_size (int): Data-parallel ranks sharing the files
+        """
+        self.files = files
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.text_column = text_column
+        self.label_column = label_column
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.repeat = repeat
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+
+        fragments = list_fragments(files)
+        if num_samples is not None:
+            if not label_column:
+                raise ValueError("Stratified subsampling needs a label_column")
+            selected = stratified_sample(read_labels(files, label_column), num_samples, seed)
+            offsets = np.cumsum([0] + [rows for _, _, rows in fragments])
+            # Rows to keep per fragment, as offsets inside it
+            self.fragments = []
+            for (path, index, rows), start in zip(fragments, offsets):
+                keep = selected[(selected >= start) & (selected < start + rows)] - start
+                if len(keep):
+                    self.fragments.append((path, index, keep.tolist()))
+            self.num_rows = len(selected)
+        else:
+            self.fragments = [(path, index, None) for path, index, _ in fragments]
+            self.num_rows = sum(rows for _, _, rows in fragments)
+        logger.info(f"Streaming {self.num_rows} rows from {len(self.fragments)} row groups in {len(files)} files")
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _shard(self, epoch: int) -> Tuple[List[Tuple[str, int, Optional[List[int]]]], int, int]:
+        """This reader's row groups for ``epoch``, and the row stride and offset inside them."""
+        worker = get_worker_info()
+        num_workers, worker_id = (worker.num_workers, worker.id) if worker else (1, 0)
+        readers = self.world_size * num_workers
+        reader = self.rank * num_workers + worker_id
+
+        order = list(range(len(self.fragments)))
+        if self.shuffle:
+            random.Random(self.seed + epoch).shuffle(order)
+        if len(order) >= readers:
+            return [self.fragments[i] for i in order[reader::readers]], 1, 0
+        # Too few row groups to give every reader its own: all read them and keep every readers-th row
+        return [self.fragments[i] for i in order], readers, reader
+
+    def _rows(self, epoch: int) -> Iterator[Tuple[str, Any]]:
+        """This reader's ``(text, label)`` rows for ``epoch``, untokenized."""
+        fragments, stride, offset = self._shard(epoch)
+        columns = [self.text_column] + ([self.label_column] if self.label_column else [])
+        for path, index, keep in fragments:
+            data = read_fragment(path, index, columns)
+            texts = data[self.text_column]
+            labels = data[self.label_column] if self.label_column else [None] * len(texts)
+            rows = keep if keep is not None else range(len(texts))
+            for row in rows[offset::stride]:
+                yield texts[row], labels[row]
+
+    def _shuffled(self, rows: Iterator[Tuple[str, Any]], epoch: int) -> Iterator[Tuple[str, Any]]:
+        worker = get_worker_info()
+        rng = random.Random(f"{self.seed}-{epoch}-{self.rank}-{worker.id if worker else 0}")
+        buffer = []
+        for row in rows:
+            if len(buffer) < self.buffer_size:
+                buffer.append(row)
+                continue
+            # Emit a random buffered row and keep the new one in its place
+            i = rng.randrange(len(buffer))
+            yield buffer[i]
+            buffer[i] = row
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _tokenized(self, rows: Iterator[Tuple[str, Any]]) -> Iterator[Dict[str, Any]]:
+        # Tokenize after shuffling, so filling the buffer costs only reads, and in
+        # chunks, so the fast tokenizer still gets batched calls
+        while True:
+            chunk = list(itertools.islice(rows, TOKENIZE_CHUNK_SIZE))
+            if not chunk:
+                return
+            texts, labels = zip(*chunk)
+            input_ids = processor_for(self.tokenizer).tokenize(list(texts), max_length=self.max_length,
+                                                               return_tensors=None)
+            for ids, label in zip(input_ids, labels):
+                example = {'input_ids': ids, 'attention_mask': np.ones(len(ids), dtype=np.int64)}
+                if self.label_column:
+                    example['labels'] = label
+                yield example
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        epoch = self.epoch
+        while True:
+            rows = self._rows(epoch)
+            yield from self._tokenized(self._shuffled(rows, epoch) if self.shuffle else rows)
+            if not self.repeat:
+                return
+            epoch += 1
+
+def load_eval_subset(files: List[str],
+                     tokenizer,
+                     max_length: Optional[int] = 512,
+                     num_samples: int = 2000,
+                     text_column: str = "text",
+                     label_column: str = "label",
+                     seed: int = 0):
+    """
+    Tokenize a bounded, label-stratified evaluation subset into a ``Dataset``.
+
+    Returns:
+        ``Dataset`` with ``input_ids``, ``attention_mask``, ``labels`` and ``length`` columns
+    """
+    from datasets import Dataset
+
+    stream = StreamingTextDataset(
+        files, tokenizer, max_length=max_length, text_column=text_column, label_column=label_column,
+        num_samples=num_samples, shuffle=False, repeat=False, seed=seed
+    )
+    examples = list(stream)
+    columns = {key: [example[key] for example in examples] for key in examples[0]} if examples else {}
+    columns['length'] = [len(ids) for ids in columns.get('input_ids', [])]
+    return Dataset.from_dict(columns)
@@ -0,0 +1,206 @@
+"""
+Tokenization shared by the training scripts.
+
+Records produced by ``ContentProcessor.format_grouped`` store each response
+body once with all of its instructions. ``tokenize_grouped`` expands them into
+one example per instruction while tokenizing every body a single time and
+reusing its token IDs across the instruction variants. ``tokenize_text``
+handles plain ``text`` columns. Both encode through the tokenizer's shared
+``TextProcessor`` (``utils/text_processor.py``), so instructions that repeat
+across records are tokenized once per process.
+
+``tokenize_cached`` runs either function as a batched, multi-process
+``Dataset.map`` and stores the result as memory-mapped Arrow shards. The
+cache key covers the tokenizer name and revision, ``max_length``, the input
+data and the tokenization code, so a restarted run skips straight to training.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import inspect
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from datasets import DatasetDict, load_from_disk
+
+from utils.text_processor import processor_for
+
+logger = logging.getLogger(__name__)
+
+TOKENIZATION_CACHE_DIR = os.getenv("TOKENIZATION_CACHE_DIR", os.path.join("data", "cache", "tokenized"))
+
+PROMPT_TEMPLATE = "### Instruction:\n{instruction}\n\n### Response:\n"
+
+def format_prompt(instruction: str) -> str:
+    """Return the prompt that precedes a response in a training example."""
+    return PROMPT_TEMPLATE.format(instruction=instruction)
+
+def tokenize_grouped(batch: Dict[str, List[Any]],
+                     tokenizer,
+                     max_length: Optional[int] = 512,
+                     padding: bool = False) -> Dict[str, List[Any]]:
+    """
+    Expand and tokenize a batch of grouped records (a batched ``Dataset.map`` function).
+
+    The prompt ends in a newline, which byte-level BPE tokenizers (GPT-2,
+    CodeGen/Phi) always split on, so tokenizing prompt and body separately
+    gives the same IDs as tokenizing the joined text.
+
+    Args:
+        batch (Dict[str, List[Any]]): Columns ``id``, ``response`` and ``instructions``
+        tokenizer: Fast Hugging Face tokenizer of the causal LM
+        max_length (Optional[int]): Examples are truncated to this many tokens;
+            None keeps them whole (for packing)
+        padding (bool): Pad every example to ``max_length``; leave this off and
+            let the data collator pad each batch instead
+
+    Returns:
+        Dict[str, List[Any]]: ``input_ids``, ``attention_mask``, ``labels``,
+        ``length`` and ``response_id`` columns, one row per instruction
+    """
+    processor = processor_for(tokenizer)
+    bodies = processor.tokenize(batch["response"], add_special_tokens=False, return_tensors=None)
+    prompts = processor.tokenize(
+        [format_prompt(instruction) for instructions in batch["instructions"] for instruction in instructions],
+        add_special_tokens=False, return_tensors=None
+    )
+    # Special tokens the tokenizer puts in front of a sequence (e.g. BOS), without the ones after it
+    prefix = processor.prefix
+
+    output = {"input_ids": [], "attention_mask": [], "labels": [], "length": [], "response_id": []}
+    prompt_index = 0
+    for record_id, instructions, body in zip(batch["id"], batch["instructions"], bodies):
+        for _ in instructions:
+            input_ids = np.concatenate([prefix, prompts[prompt_index], body])[:max_length]
+            prompt_index += 1
+            num_pad = max_length - len(input_ids) if padding and max_length else 0
+
+            output["input_ids"].append(np.pad(input_ids, (0, num_pad), constant_values=tokenizer.pad_token_id))
+            output["attention_mask"].append(np.pad(np.ones(len(input_ids), dtype=np.int64), (0, num_pad)))
+            output["labels"].append(np.pad(input_ids, (0, num_pad), constant_values=-100))
+            output["length"].append(len(input_ids))
+            output["response_id"].append(record_id)
+
+    return output
+
+def tokenize_text(batch: Dict[str, List[Any]],
+                  tokenizer,
+                  max_length: Optional[int] = 512,
+                  label_column: Optional[str] = None) -> Dict[str, List[Any]]:
+    """
+    Tokenize a ``text`` column without padding (a batched ``Dataset.map`` function).
+
+    Args:
+        batch (Dict[str, List[Any]]): Batch with a ``text`` column
+        tokenizer: Fast Hugging Face tokenizer
+        max_length (Optional[int]): Truncation length; None keeps texts whole
+        label_column (Optional[str]): Column copied to ``labels`` for classifiers
+
+    Returns:
+        Dict[str, List[Any]]: ``input_ids``, ``attention_mask`` and ``length``
+        columns, plus ``labels`` when ``label_column`` is given
+    """
+    input_ids = processor_for(tokenizer).tokenize(batch["text"], max_length=max_length, return_tensors=None)
+    tokenized = {
+        "input_ids": input_ids,
+        "attention_mask": [np.ones(len(ids), dtype=np.int64) for ids in input_ids],
+        "length": [len(ids) for ids in input_ids]
+    }
+    if label_column:
+        tokenized["labels"] = batch[label_column]
+    return tokenized
+
+def tokenizer_fingerprint(tokenizer) -> Dict[str, Any]:
+    """Identify a tokenizer by name, revision and vocabulary."""
+    return {
+        'class': type(tokenizer).__name__,
+        'name': tokenizer.name_or_path,
+        'revision': tokenizer.init_kwargs.get('revision') or getattr(tokenizer, '_commit_hash', None),
+        'vocab_size': len(tokenizer),
+        'special_tokens': {key: str(value) for key, value in sorted(tokenizer.special_tokens_map.items())}
+    }
+
+def dataset_fingerprint(dataset) -> str:
+    """Fingerprint of a Dataset, or of every split of a DatasetDict."""
+    if isinstance(dataset, DatasetDict):
+        return json.dumps({split: dataset[split]._fingerprint for split in sorted(dataset)})
+    return dataset._fingerprint
+
+def _function_fingerprint(function: Callable) -> str:
+    try:
+        source = inspect.getsource(function)
+    except (OSError, TypeError):
+        source = ''
+    return f"{function.__module__}.{function.__qualname__}:{hashlib.sha256(source.encode('utf-8')).hexdigest()}"
+
+def tokenize_cached(dataset,
+                    function: Callable,
+                    tokenizer,
+                    max_length: Optional[int],
+                    fn_kwargs: Dict[str, Any] = None,
+                    remove_columns: List[str] = None,
+                    data_hash: str = None,
+                    num_proc: int = None,
+                    batch_size: int = 1000,
+                    cache_dir: str = None):
+    """
+    Tokenize a Dataset or DatasetDict once and reuse the result across runs.
+
+    Args:
+        dataset: ``Dataset`` or ``DatasetDict`` to tokenize
+        function (Callable): Batched map function taking ``tokenizer`` and
+            ``max_length`` keyword arguments, e.g. ``tokenize_grouped``
+        tokenizer: Hugging Face tokenizer
+        max_length (Optional[int]): Passed to ``function``
+        fn_kwargs (Dict[str, Any]): Extra keyword arguments for ``function``
+        remove_columns (List[str]): Input columns to drop
+        data_hash (str): Identity of the input data; defaults to the datasets fingerprint
+        num_proc (int): Tokenization processes (default: one per 1000 rows, up to the core count)
+        batch_size (int): Rows per map batch
+        cache_dir (str): Cache root (default: ``TOKENIZATION_CACHE_DIR``)
+
+    Returns:
+        The tokenized ``Dataset``/``DatasetDict``, memory-mapped from the cache
+    """
+    fn_kwargs = dict(fn_kwargs or {})
+    cache_dir = cache_dir or TOKENIZATION_CACHE_DIR
+    key = hashlib.sha256(json.dumps({
+        'tokenizer': tokenizer_fingerprint(tokenizer),
+        'max_length': max_length,
+        'data': data_hash or dataset_fingerprint(dataset),
+        'function': _function_fingerprint(function),
+        'fn_kwargs': fn_kwargs,
+        'remove_columns': remove_columns
+    }, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:24]
+    path = os.path.join(cache_dir, key)
+
+    if os.path.exists(path):
+        logger.info(f"Loading tokenized dataset from cache: {path}")
+        return load_from_disk(path)
+
+    if num_proc is None:
+        rows = max(len(split) for split in dataset.values()) if isinstance(dataset, DatasetDict) else len(dataset)
+        num_proc = max(1, min(os.cpu_count() or 1, rows // 1000))
+
+    logger.info(f"Tokenizing with {num_proc} processes (cache key {key})...")
+    tokenized = dataset.map(
+        function,
+        fn_kwargs={"tokenizer": tokenizer, "max_length": max_length, **fn_kwargs},
+        batched=True,
+        batch_size=batch_size,
+        num_proc=num_proc if num_proc > 1 else None,
+        remove_columns=remove_columns
+    )
+
+    # Write next to the final location and rename, so an interrupted run never leaves a partial cache
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    tokenized.save_to_disk(tmp_path)
+    if os.path.exists(path):
+        # Another run finished the same tokenization first
+        shutil.rmtree(tmp_path)
+    else:
+        os.replace(tmp_path, path)
+    return load_from_disk(path)
@@ -0,0 +1,340 @@
+"""
+Memory-mapped vector store for document embeddings.
+
+A store is a directory holding:
+
+- ``vectors.bin``: raw row-major float32 or float16 rows, appended in place
+- ``metadata.jsonl``: one JSON object per row, plus ``metadata.idx`` with the
+  byte offset of every line so single rows can be read without a scan
+- ``header.json``: dimension, dtype, metric and the committed row count
+- ``ivf.npz`` (optional): an inverted-file index built by ``build_index``
+
+``header.json`` is rewritten last, so an interrupted append leaves the store at
+its previous count and the partial tail is truncated by the next append.
+Searches read the matrix through ``np.memmap`` in fixed-size blocks and never
+load the whole file into RAM.
+"""
+
+import os
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+DTYPES = {"float32": np.float32, "float16": np.float16}
+METRICS = ("cosine", "dot")
+# Rows scored per block in a brute-force scan (~200 MB of float32 at dim 768)
+SEARCH_BLOCK_ROWS = 65536
+
+def _atomic_write_json(data: Dict[str, Any], path: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _top_k(scores: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Best ``k`` scores per query row, sorted descending; ``scores`` is (queries, candidates)."""
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        ids = np.take_along_axis(np.broadcast_to(ids, (scores.shape[0], ids.shape[-1])), part, axis=1)
+    else:
+        ids = np.broadcast_to(ids, scores.shape)
+    order = np.argsort(-scores, axis=1)
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+class VectorStore:
+    def __init__(self, path: str, dim: int = None, dtype: str = "float32", metric: str = "cosine"):
+        """
+        Open a store, creating it when ``path`` does not exist yet.
+
+        Args:
+            path (str): Store directory
+            dim (int): Vector dimension; required to create a store, inferred
+                from the first ``add`` when omitted
+            dtype (str): On-disk dtype, 'float32' or 'float16'
+            metric (str): 'cosine' (rows are L2-normalized on insert) or 'dot'
+        """
+        self.path = path
+        self.header_path = os.path.join(path, "header.json")
+        self.vectors_path = os.path.join(path, "vectors.bin")
+        self.metadata_path = os.path.join(path, "metadata.jsonl")
+        self.offsets_path = os.path.join(path, "metadata.idx")
+        self.index_path = os.path.join(path, "ivf.npz")
+
+        if os.path.exists(self.header_path):
+            with open(self.header_path, 'r', encoding='utf-8') as f:
+                self.header = json.load(f)
+            if self.header.get('version') != FORMAT_VERSION:
+                raise ValueError(f"Unsupported vector store version in {path}: {self.header.get('version')}")
+        else:
+            if dtype not in DTYPES:
+                raise ValueError(f"Unsupported dtype: {dtype}")
+            if metric not in METRICS:
+                raise ValueError(f"Unsupported metric: {metric}")
+            self.header = {
+                'version': FORMAT_VERSION,
+                'dim': dim,
+                'dtype': dtype,
+                'metric': metric,
+                'count': 0,
+                'metadata_bytes': 0
+            }
+
+        self._vectors = None
+        self._offsets = None
+        self._index = None
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self.header['dim']
+
+    @property
+    def dtype(self):
+        return DTYPES[self.header['dtype']]
+
+    @property
+    def metric(self) -> str:
+        return self.header['metric']
+
+    def __len__(self) -> int:
+        return self.header['count']
+
+    def vectors(self) -> np.ndarray:
+        """Read-only memory map over the committed rows."""
+        if self._vectors is None or self._vectors.shape[0] != len(self):
+            if len(self) == 0:
+                return np.empty((0, self.dim or 0), dtype=self.dtype)
+            self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode='r', shape=(len(self), self.dim))
+        return self._vectors
+
+    def _metadata_offsets(self) -> np.ndarray:
+        if self._offsets is None or self._offsets.shape[0] != len(self):
+            if len(self) == 0:
+                return np.empty(0, dtype=np.uint64)
+            self._offsets = np.memmap(self.offsets_path, dtype=np.uint64, mode='r', shape=(len(self),))
+        return self._offsets
+
+    def _prepare(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        if self.dim is not None and vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}")
+        if self.metric == "cosine":
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+        return vectors
+
+    def add(self, vectors, metadata: Iterable[Dict[str, Any]] = None) -> int:
+        """
+        Append rows without rewriting the existing ones.
+
+        Args:
+            vectors: Array-like of shape (n, dim)
+            metadata (Iterable[Dict[str, Any]]): One JSON-serializable dict per row
+
+        Returns:
+            int: Row id of the first appended row
+        """
+        vectors = self._prepare(vectors)
+        metadata = list(metadata) if metadata is not None else [{} for _ in range(len(vectors))]
+        if len(metadata) != len(vectors):
+            raise ValueError(f"Got {len(vectors)} vectors but {len(metadata)} metadata records")
+
+        if len(vectors) == 0:
+            return len(self)
+
+        os.makedirs(self.path, exist_ok=True)
+        if self.header['dim'] is None:
+            self.header['dim'] = int(vectors.shape[1])
+
+        start = len(self)
+        row_bytes = self.dim * np.dtype(self.dtype).itemsize
+        lines = [(json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8') for record in metadata]
+        offsets = np.cumsum([self.header['metadata_bytes']] + [len(line) for line in lines[:-1]], dtype=np.uint64)
+
+        # Drop anything past the committed count left by an interrupted append
+        appends = (
+            (self.vectors_path, start * row_bytes, vectors.astype(self.dtype).tobytes()),
+            (self.metadata_path, self.header['metadata_bytes'], b"".join(lines)),
+            (self.offsets_path, start * 8, offsets.tobytes())
+        )
+        for path, committed_size, payload in appends:
+            with open(path, 'ab') as f:
+                f.truncate(committed_size)
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+
+        self.header['count'] = start + len(vectors)
+        self.header['metadata_bytes'] += sum(len(line) for line in lines)
+        _atomic_write_json(self.header, self.header_path)
+        return start
+
+    def metadata(self, row_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        """Metadata of the given rows, read by offset."""
+        offsets = self._metadata_offsets()
+        records = []
+        with open(self.metadata_path, 'rb') as f:
+            for row_id in row_ids:
+                f.seek(int(offsets[row_id]))
+                records.append(json.loads(f.readline()))
+        return records
+
+    def iter_metadata(self) -> Iterable[Dict[str, Any]]:
+        with open(self.metadata_path, 'rb') as f:
+            for _ in range(len(self)):
+                yield json.loads(f.readline())
+
+    def build_index(self, n_lists: int = None, n_iter: int = 10, sample_size: int = 100000, seed: int = 0):
+        """
+        Build an inverted-file (IVF) index: k-means centroids over a sample, and
+        every row assigned to its nearest centroid. Rows added later are scanned
+        exactly until the index is rebuilt.
+
+        Args:
+            n_lists (int): Number of clusters (default: 4 * sqrt(rows))
+            n_iter (int): k-means iterations
+            sample_size (int): Rows used to fit the centroids
+            seed (int): Random seed for sampling and initialization
+        """
+        vectors = self.vectors()
+        count = len(self)
+        n_lists = min(n_lists or max(1, int(4 * np.sqrt(count))), count)
+        rng = np.random.default_rng(seed)
+
+        sample_ids = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+        sample = np.asarray(vectors[sample_ids], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+
+        logger.info(f"Fitting {n_lists} IVF centroids on {len(sample)} of {count} vectors")
+        for _ in range(n_iter):
+            assignment = self._nearest_centroid(sample, centroids)
+            sizes = np.bincount(assignment, minlength=n_lists)
+            order = np.argsort(assignment, kind='stable')
+            filled = np.flatnonzero(sizes)
+            sums = np.zeros_like(centroids)
+            sums[filled] = np.add.reduceat(sample[order], np.cumsum(sizes)[filled] - sizes[filled], axis=0)
+            sizes = sizes[:, None]
+            # Empty clusters keep their previous centroid
+            centroids = np.where(sizes > 0, sums / np.maximum(sizes, 1), centroids)
+            if self.metric == "cosine":
+                centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+        assignment = np.concatenate([
+            self._nearest_centroid(np.asarray(vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32), centroids)
+            for start in range(0, count, SEARCH_BLOCK_ROWS)
+        ])
+        # Row ids grouped by list, ascending within each list for sequential reads
+        order = np.argsort(assignment, kind='stable')
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+
+        tmp_path = f"{self.index_path}.tmp.npz"
+        np.savez(tmp_path, centroids=centroids, row_ids=order.astype(np.int64),
+                 list_offsets=list_offsets.astype(np.int64), count=np.int64(count))
+        os.replace(tmp_path, self.index_path)
+        self._index = None
+        logger.info(f"Built IVF index over {count} vectors in {self.index_path}")
+
+    def _nearest_centroid(self, vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        if self.metric == "cosine":
+            return np.argmax(vectors @ centroids.T, axis=1)
+        # Nearest by inner product would favour large centroids; use L2 distance
+        distances = (centroids ** 2).sum(axis=1)[None, :] - 2 * vectors @ centroids.T
+        return np.argmin(distances, axis=1)
+
+    def _load_index(self):
+        if self._index is None and os.path.exists(self.index_path):
+            with np.load(self.index_path) as data:
+                self._index = {name: data[name] for name in data.files}
+        return self._index
+
+    def search(self, queries, k: int = 10, n_probe: int = None) -> List[List[Tuple[float, int]]]:
+        """
+        Top-k rows by cosine similarity or dot product.
+
+        Args:
+            queries: A vector or an array of shape (queries, dim)
+            k (int): Results per query
+            n_probe (int): With an IVF index, the number of lists to scan;
+                None scans every row exactly
+
+        Returns:
+            List[List[Tuple[float, int]]]: Per query, (score, row id) pairs, best first
+        """
+        queries = self._prepare(queries)
+        k = min(k, len(self))
+        if k == 0:
+            return [[] for _ in range(len(queries))]
+
+        index = self._load_index() if n_probe else None
+        if index is None:
+            scores, ids = self._scan(queries, 0, len(self), k)
+        else:
+            scores, ids = self._search_ivf(queries, index, k, n_probe)
+        return [
+            [(float(score), int(row_id)) for score, row_id in zip(row_scores, row_ids) if row_id >= 0]
+            for row_scores, row_ids in zip(scores, ids)
+        ]
+
+    def _scan(self, queries: np.ndarray, start: int, stop: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact top-k over rows ``start:stop``, one memory-mapped block at a time."""
+        vectors = self.vectors()
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        for block_start in range(start, stop, SEARCH_BLOCK_ROWS):
+            block_stop = min(block_start + SEARCH_BLOCK_ROWS, stop)
+            block = np.asarray(vectors[block_start:block_stop], dtype=np.float32)
+            scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+            ids = np.concatenate([
+                best_ids, np.broadcast_to(np.arange(block_start, block_stop), (len(queries), block_stop - block_start))
+            ], axis=1)
+            best_scores, best_ids = _top_k(scores, ids, k)
+        return best_scores, best_ids
+
+    def _search_ivf(self, queries: np.ndarray, index, k: int, n_probe: int):
+        vectors = self.vectors()
+        centroids, row_ids, list_offsets = index['centroids'], index['row_ids'], index['list_offsets']
+        indexed = int(index['count'])
+
+        if self.metric == "cosine":
+            probes = np.argsort(-(queries @ centroids.T), axis=1)[:, :n_probe]
+        else:
+            distances = (centroids ** 2).sum(axis=1)[None, :] - 2 * queries @ centroids.T
+            probes = np.argsort(distances, axis=1)[:, :n_probe]
+
+        # Rows appended after the index was built are scanned exactly
+        tail_scores, tail_ids = self._scan(queries, indexed, len(self), k) if indexed < len(self) else (None, None)
+
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, query in enumerate(queries):
+            candidates = np.sort(np.concatenate([
+                row_ids[list_offsets[probe]:list_offsets[probe + 1]] for probe in probes[i]
+            ]))
+            scores = np.asarray(vectors[candidates], dtype=np.float32) @ query
+            ids = candidates
+            if tail_scores is not None:
+                scores = np.concatenate([scores, tail_scores[i]])
+                ids = np.concatenate([ids, tail_ids[i]])
+            if len(ids) == 0:
+                continue
+            top_scores, top_ids = _top_k(scores[None, :], ids[None, :], min(k, len(ids)))
+            all_scores[i, :top_scores.shape[1]] = top_scores[0]
+            all_ids[i, :top_ids.shape[1]] = top_ids[0]
+        return all_scores, all_ids
+
+    def query(self, queries, k: int = 10, n_probe: int = None) -> List[List[Dict[str, Any]]]:
+        """``search`` with each hit's metadata merged in under 'score' and 'row'."""
+        results = []
+        for hits in self.search(queries, k=k, n_probe=n_probe):
+            records = self.metadata([row_id for _, row_id in hits])
+            results.append([
+                {**record, 'row': row_id, 'score': score}
+                for (score, row_id), record in zip(hits, records)
+            ])
+        return results
@@ -0,0 +1,352 @@
+"""
+Distill the fine-tuned Phi model into a small causal LM for edge and browser targets.
+
+The teacher (``models/finetuned_phi``, full weights or a LoRA adapter) runs
+once over the tokenized training data, and its top-k next-token
+log-probabilities are cached on disk (see ``utils/distillation.py``). The
+student is then trained on KL + CE against that cache. Later runs with the
+same teacher, data and k reuse the cache and never load the teacher.
+
+The student keeps the teacher's tokenizer, and its embeddings are resized to
+the teacher's vocabulary. The default student, distilgpt2, shares GPT-2's
+BPE vocabulary with Phi, so its pretrained embeddings line up.
+
+    python -m models.distill --student distilgpt2 --top-k 32 --max-steps 2000
+
+``distill_report.json`` in the output directory compares the student with the
+teacher: held-out cross-entropy and perplexity, agreement with the teacher's
+top token, parameters, weight bytes and generation speed.
+"""
+
+import os
+import gc
+import json
+import time
+import hashlib
+import argparse
+import logging
+import traceback
+from pathlib import Path
+from typing import Any, Dict, List
+
+import torch
+from datasets import load_dataset
+from transformers import AutoModelForCausalLM, AutoTokenizer, TrainingArguments
+
+from data.tokenization import tokenize_cached, tokenize_grouped
+from models.model_loader import ModelLoader, WEIGHT_SUFFIXES, model_nbytes
+from utils.adapters import adapter_base_model, count_parameters
+from utils.distillation import (
+    DistillationCollator,
+    DistillationDataset,
+    DistillationTrainer,
+    LogitCache,
+    build_logit_cache,
+    directory_fingerprint,
+    evaluate_distillation,
+    logit_cache_path
+)
+from utils.hardware import HardwareProfile
+from utils.memory_plan import plan_batch, training_args as plan_training_args
+from utils.training_metrics import TrainingMetricsCallback
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+TEACHER_DIR = "models/finetuned_phi"
+TRAINING_DATA_PATH = "data/processed/training_data.jsonl"
+STUDENT_MODEL = "distilgpt2"
+OUTPUT_DIR = "models/distilled_phi"
+
+DISTILL_CONFIG = {
+    "top_k": 32,
+    "alpha": 0.5,  # Weight of the KL to the teacher; the rest goes to the label cross-entropy
+    "temperature": 2.0,
+    "max_length": 512,
+    "num_train_epochs": 3,
+    "max_steps": -1,
+    "learning_rate": 1e-4,
+    "target_batch_size": 16,
+    "eval_percent": 5  # Share of responses held out, with all of their instructions
+}
+
+# Prompt and generated tokens per example in the speed comparison
+BENCHMARK_PROMPT_TOKENS = 32
+BENCHMARK_NEW_TOKENS = 32
+
+def load_training_data(data_path: str):
+    """The training JSONL as grouped records (``id``, ``response``, ``instructions``)."""
+    dataset = load_dataset("json", data_files=data_path, split="train")
+    if "instructions" not in dataset.column_names:
+        dataset = dataset.map(
+            lambda batch: {
+                "id": [hashlib.sha256(response.encode("utf-8")).hexdigest()[:16] for response in batch["response"]],
+                "response": batch["response"],
+                "instructions": [[instruction] for instruction in batch["instruction"]]
+            },
+            batched=True,
+            remove_columns=dataset.column_names
+        )
+    return dataset
+
+def load_teacher_tokenizer(teacher_dir: str):
+    """The teacher's tokenizer, from its directory or, for an adapter without one, its base model."""
+    has_tokenizer = os.path.exists(os.path.join(teacher_dir, "tokenizer_config.json"))
+    tokenizer = AutoTokenizer.from_pretrained(teacher_dir if has_tokenizer else adapter_base_model(teacher_dir))
+    tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
+def is_eval_response(response_id: str, eval_percent: int) -> bool:
+    """Stable held-out split by response, so no instruction variant of an eval response is trained on."""
+    return int(hashlib.sha256(str(response_id).encode("utf-8")).hexdigest()[:8], 16) % 100 < eval_percent
+
+def shared_vocabulary(student_tokenizer, teacher_tokenizer) -> float:
+    """Share of the student's tokens that have the same ID in the teacher's vocabulary."""
+    teacher_vocab = teacher_tokenizer.get_vocab()
+    student_vocab = student_tokenizer.get_vocab()
+    return sum(teacher_vocab.get(token) == index for token, index in student_vocab.items()) / max(len(student_vocab), 1)
+
+def generation_speed(model, prompts: List[List[int]], eos_token_id: int, hardware: HardwareProfile) -> Dict[str, float]:
+    """Greedy generation speed at batch size 1, the edge serving case."""
+    device = next(model.parameters()).device
+    model.eval()
+    tokens = 0
+    seconds = 0.0
+    with torch.no_grad(), hardware.autocast():
+        for i, prompt in enumerate(prompts):
+            input_ids = torch.tensor([prompt], device=device)
+            start = time.perf_counter()
+            output = model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                    max_new_tokens=BENCHMARK_NEW_TOKENS, min_new_tokens=BENCHMARK_NEW_TOKENS,
+                                    do_sample=False, pad_token_id=eos_token_id)
+            if i == 0:
+                # The first call warms up kernels and caches
+                continue
+            seconds += time.perf_counter() - start
+            tokens += output.shape[1] - input_ids.shape[1]
+    return {
+        'tokens_per_s': tokens / seconds if seconds else 0.0,
+        'ms_per_token': 1000 * seconds / tokens if tokens else 0.0
+    }
+
+def weight_file_bytes(path: str) -> int:
+    return sum(entry.stat().st_size for entry in Path(path).iterdir() if entry.name.endswith(WEIGHT_SUFFIXES))
+
+def distill(teacher_dir: str = TEACHER_DIR,
+            training_data_path: str = TRAINING_DATA_PATH,
+            output_dir: str = OUTPUT_DIR,
+            student_model: str = STUDENT_MODEL,
+            top_k: int = 32,
+            alpha: float = 0.5,
+            temperature: float = 2.0,
+            max_length: int = 512,
+            num_train_epochs: int = 3,
+            max_steps: int = -1,
+            learning_rate: float = 1e-4,
+            target_batch_size: int = 16,
+            eval_percent: int = 5,
+            benchmark_prompts: int = 8,
+            cache_dir: str = None) -> Dict[str, Any]:
+    """
+    Cache the teacher's logits (once), train the student on them and compare the two.
+
+    Args:
+        teacher_dir (str): Fine-tuned teacher (full weights or LoRA adapter)
+        training_data_path (str): Grouped or flat instruction/response JSONL
+        output_dir (str): Where the student, its tokenizer and the report go
+        student_model (str): Hub name or directory of the student's starting weights
+        top_k (int): Teacher tokens cached per position
+        alpha (float): Weight of the KL term against the label cross-entropy
+        temperature (float): Distillation temperature
+        max_length (int): Token limit per example
+        num_train_epochs (int): Passes over the training split
+        max_steps (int): Stop after this many optimizer steps (-1: run the epochs)
+        learning_rate (float): Peak learning rate
+        target_batch_size (int): Examples per optimizer step
+        eval_percent (int): Percent of responses held out for the comparison
+        benchmark_prompts (int): Held-out prompts timed for generation speed
+        cache_dir (str): Logit cache root (default: ``TEACHER_LOGITS_CACHE_DIR``)
+
+    Returns:
+        Dict[str, Any]: The report, also written to ``distill_report.json``
+    """
+    hardware = HardwareProfile().apply()
+
+    logger.info(f"Loading teacher tokenizer from {teacher_dir}")
+    tokenizer = load_teacher_tokenizer(teacher_dir)
+    dataset = load_training_data(training_data_path)
+    tokenized = tokenize_cached(dataset, tokenize_grouped, tokenizer, max_length=max_length,
+                                remove_columns=dataset.column_names)
+
+    # Hold out whole responses, so no instruction variant of an eval example is trained on
+    eval_indices = [i for i, response_id in enumerate(tokenized['response_id']) if is_eval_response(response_id, eval_percent)]
+    held_out = set(eval_indices)
+    train_indices = [i for i in range(len(tokenized)) if i not in held_out]
+    # Both models are timed on the same held-out prompts
+    prompts = [tokenized[i]['input_ids'][:BENCHMARK_PROMPT_TOKENS]
+               for i in (eval_indices or train_indices)[:benchmark_prompts]]
+
+    # The teacher runs only when no cache matches its files, the data and k
+    path = logit_cache_path(directory_fingerprint(teacher_dir), tokenized, top_k, cache_dir)
+    cache_hit = LogitCache.exists(path)
+    if cache_hit:
+        logger.info(f"Reusing cached teacher logits from {path}")
+        cache = LogitCache(path)
+    else:
+        teacher_root, teacher_name = os.path.split(os.path.normpath(teacher_dir))
+        loader = ModelLoader(model_dir=teacher_root, device=hardware.device)
+        teacher = loader.load_model(teacher_name, "phi", merge_adapter=True)
+        cache = build_logit_cache(teacher, tokenized, path, top_k=top_k, max_tokens=4 * max_length, hardware=hardware)
+        # Benchmarked now, while the teacher is loaded, so later runs can compare without it
+        cache.update_meta(teacher={
+            'parameters': count_parameters(teacher)[1],
+            'weight_bytes': model_nbytes(teacher),
+            **generation_speed(teacher, prompts, tokenizer.eos_token_id, hardware)
+        })
+        loader.unload(teacher_name)
+        del teacher
+        gc.collect()
+
+    train_dataset = DistillationDataset(tokenized, cache, train_indices)
+    eval_dataset = DistillationDataset(tokenized, cache, eval_indices)
+    logger.info(f"{len(train_dataset)} training and {len(eval_dataset)} held-out examples")
+
+    logger.info(f"Loading student: {student_model}")
+    student = AutoModelForCausalLM.from_pretrained(student_model)
+    shared = shared_vocabulary(AutoTokenizer.from_pretrained(student_model), tokenizer)
+    if shared < 0.99:
+        logger.warning(f"Only {shared:.1%} of the student's vocabulary matches the teacher's; "
+                       f"its pretrained embeddings will not line up with the teacher's token IDs")
+    student.resize_token_embeddings(cache.meta['vocab_size'])
+    student.config.pad_token_id = tokenizer.eos_token_id
+    student = hardware.prepare_model(student)
+
+    plan = plan_batch(student, target_batch_size, max_length, hardware)
+    training_args = TrainingArguments(
+        output_dir=output_dir,
+        num_train_epochs=num_train_epochs,
+        max_steps=max_steps,
+        learning_rate=learning_rate,
+        warmup_steps=100,
+        weight_decay=0.01,
+        logging_steps=50,
+        save_steps=500,
+        save_total_limit=2,
+        report_to="none",
+        # The teacher columns must reach the collator
+        remove_unused_columns=False,
+        **plan_training_args(plan),
+        **hardware.training_args()
+    )
+    collator = DistillationCollator(tokenizer.eos_token_id)
+    trainer = DistillationTrainer(
+        model=student,
+        args=training_args,
+        train_dataset=train_dataset,
+        data_collator=collator,
+        alpha=alpha,
+        temperature=temperature,
+        callbacks=[TrainingMetricsCallback(os.path.join(output_dir, "metrics.jsonl"))]
+    )
+    logger.info(f"Distilling with alpha={alpha}, T={temperature}, top-{cache.top_k} teacher log-probs")
+    trainer.train()
+
+    trainer.save_model(output_dir)
+    tokenizer.save_pretrained(output_dir)
+
+    quality = evaluate_distillation(student, eval_dataset, collator, hardware=hardware)
+    student_speed = generation_speed(student, prompts, tokenizer.eos_token_id, hardware)
+    teacher_info = cache.meta.get('teacher', {})
+    student_parameters = count_parameters(student)[1]
+
+    report = {
+        'teacher': {
+            'path': teacher_dir,
+            'parameters': teacher_info.get('parameters'),
+            'weight_bytes': teacher_info.get('weight_bytes'),
+            'cross_entropy': quality['teacher_ce'],
+            'perplexity': quality['teacher_perplexity'],
+            'tokens_per_s': teacher_info.get('tokens_per_s')
+        },
+        'student': {
+            'path': output_dir,
+            'base': student_model,
+            'parameters': student_parameters,
+            'weight_bytes': weight_file_bytes(output_dir),
+            'cross_entropy': quality['student_ce'],
+            'perplexity': quality['student_perplexity'],
+            'tokens_per_s': student_speed['tokens_per_s']
+        },
+        'quality_gap': {
+            'cross_entropy': quality['student_ce'] - quality['teacher_ce'],
+            'perplexity_ratio': quality['student_perplexity'] / quality['teacher_perplexity'],
+            'kl_to_teacher': quality['kl_to_teacher'],
+            'top1_agreement': quality['top1_agreement'],
+            'eval_tokens': quality['tokens']
+        },
+        'speedup': (student_speed['tokens_per_s'] / teacher_info['tokens_per_s']
+                    if teacher_info.get('tokens_per_s') else None),
+        'size_ratio': (teacher_info['parameters'] / student_parameters
+                       if teacher_info.get('parameters') else None),
+        'cache': {
+            'path': path,
+            'hit': cache_hit,
+            'bytes': cache.nbytes(),
+            'top_k': cache.top_k,
+            'teacher_seconds': cache.meta['teacher_seconds']
+        },
+        'config': {'alpha': alpha, 'temperature': temperature, 'max_length': max_length,
+                   'learning_rate': learning_rate, 'max_steps': max_steps, 'num_train_epochs': num_train_epochs}
+    }
+    with open(os.path.join(output_dir, "distill_report.json"), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    speedup = f"{report['speedup']:.1f}x" if report['speedup'] else "unknown"
+    logger.info(
+        f"Student perplexity {quality['student_perplexity']:.2f} vs teacher {quality['teacher_perplexity']:.2f}, "
+        f"top-1 agreement {quality['top1_agreement']:.1%}, generation speedup {speedup}"
+    )
+    return report
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Distill the fine-tuned Phi model into a small causal LM")
+    parser.add_argument("--teacher-dir", default=TEACHER_DIR)
+    parser.add_argument("--data-path", default=TRAINING_DATA_PATH)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--student", default=STUDENT_MODEL, help="Hub name or directory of the student's starting weights")
+    parser.add_argument("--top-k", type=int, default=DISTILL_CONFIG["top_k"], help="Teacher tokens cached per position")
+    parser.add_argument("--alpha", type=float, default=DISTILL_CONFIG["alpha"], help="Weight of the KL term")
+    parser.add_argument("--temperature", type=float, default=DISTILL_CONFIG["temperature"])
+    parser.add_argument("--max-length", type=int, default=DISTILL_CONFIG["max_length"])
+    parser.add_argument("--epochs", type=int, default=DISTILL_CONFIG["num_train_epochs"])
+    parser.add_argument("--max-steps", type=int, default=DISTILL_CONFIG["max_steps"], help="Stop after this many optimizer steps")
+    parser.add_argument("--learning-rate", type=float, default=DISTILL_CONFIG["learning_rate"])
+    parser.add_argument("--batch-size", type=int, default=DISTILL_CONFIG["target_batch_size"], help="Examples per optimizer step")
+    parser.add_argument("--eval-percent", type=int, default=DISTILL_CONFIG["eval_percent"], help="Percent of responses held out")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    try:
+        distill(
+            teacher_dir=args.teacher_dir,
+            training_data_path=args.data_path,
+            output_dir=args.output_dir,
+            student_model=args.student,
+            top_k=args.top_k,
+            alpha=args.alpha,
+            temperature=args.temperature,
+            max_length=args.max_length,
+            num_train_epochs=args.epochs,
+            max_steps=args.max_steps,
+            learning_rate=args.learning_rate,
+            target_batch_size=args.batch_size,
+            eval_percent=args.eval_percent
+        )
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise
+
+if __name__ == "__main__":
+    main()
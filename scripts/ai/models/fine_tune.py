@@ -1,64 +1,136 @@
 """
 Fine-tuning script for DistilBERT model using Yelp reviews dataset.
 DistilBERT is optimized for web deployment and provides a good balance of performance and size.
+
+Runs in one process by default. For data-parallel training on CPU hosts,
+start it through the launcher (see ``utils/launch.py``):
+
+    python -m utils.launch --nproc 4 models.fine_tune
+
+``--streaming`` reads local parquet/Arrow files of the dataset as it trains
+(see ``data/streaming.py``) instead of tokenizing everything up front:
+
+    python -m models.fine_tune --streaming --train-samples 20000 --max-steps 500
 """
 
 import os
+import math
+import argparse
 import logging
 from datasets import load_dataset
 from transformers import (
     AutoTokenizer,
     AutoModelForSequenceClassification,
     TrainingArguments,
-    Trainer,
     DataCollatorWithPadding
 )
 import torch
 import traceback
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from data.streaming import StreamingTextDataset, load_eval_subset, split_files
+from data.tokenization import tokenize_cached, tokenize_text
+from utils.batching import TokenBudgetTrainer
+from utils.hardware import HardwareProfile
+from utils.distributed import (
+    broadcast_object,
+    cleanup_distributed,
+    init_distributed,
+    is_main_process,
+    local_main_process_first,
+    local_world_size,
+    rank,
+    world_size
+)
+from utils.memory_plan import memory_limit, plan_batch, training_args as plan_training_args
+from utils.text_processor import set_parallelism
+from utils.training_metrics import TrainingMetricsCallback
+
+# Configure logging; other workers only report warnings
+logging.basicConfig(level=logging.INFO if is_main_process() else logging.WARNING,
+                    format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Constants
 MODEL_NAME = "distilbert-base-uncased"  # Changed to DistilBERT
 OUTPUT_DIR = "models/finetuned_distilbert"
 DATASET_NAME = "yelp_review_full"
+DATA_DIR = os.path.join("data", DATASET_NAME)  # Local parquet/Arrow copy of the dataset for --streaming
+MAX_LENGTH = 128
+NUM_EPOCHS = 3
+SEED = 42
+TARGET_BATCH_SIZE = 16  # Reviews per optimizer step over all workers; the memory planner splits it into micro-batches
 
-def preprocess(examples, tokenizer):
-    """Tokenize the texts and prepare for training."""
-    return tokenizer(
-        examples["text"],
-        padding="max_length",
-        truncation=True,
-        max_length=128,
-        return_tensors="pt"
-    )
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fine-tune DistilBERT on Yelp reviews")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--max-steps", type=int, default=-1, help="Stop after this many optimizer steps")
+    parser.add_argument("--metrics-path", help="Per-step metrics JSONL (default: metrics.jsonl in the output directory)")
+    parser.add_argument("--streaming", action="store_true", help="Stream and tokenize local files while training")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Parquet or Arrow files of the dataset (streaming)")
+    parser.add_argument("--train-samples", type=int, help="Train on a label-stratified subsample of this many reviews (streaming)")
+    parser.add_argument("--eval-samples", type=int, default=2000, help="Label-stratified evaluation reviews (streaming)")
+    parser.add_argument("--shuffle-buffer", type=int, default=10000, help="Reviews in the shuffle buffer (streaming)")
+    return parser.parse_args()
 
 def main():
     """Main training function."""
+    args = parse_args()
     try:
         logger.info("Starting fine-tuning process...")
         
-        # Load dataset
-        logger.info(f"Loading dataset: {DATASET_NAME}")
-        dataset = load_dataset(DATASET_NAME)
+        # Join the other workers, pinned to this worker's cores, when launched data-parallel
+        distributed = init_distributed()
         
-        # Load tokenizer
-        logger.info(f"Loading tokenizer: {MODEL_NAME}")
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        # Device, precision, threads and data-loader workers for this machine
+        hardware = HardwareProfile().apply()
         
-        # Tokenize dataset (do NOT remove 'label' column)
-        logger.info("Tokenizing dataset...")
-        tokenized_datasets = dataset.map(
-            lambda x: preprocess(x, tokenizer),
-            batched=True
-        )
-        
-        # Add labels (do NOT try to remove 'label' column)
-        tokenized_datasets = tokenized_datasets.map(
-            lambda x: {"labels": x["label"]},
-        )
+        if args.streaming:
+            # Tokenization runs in forked data-loader workers, where the Rust thread pool must stay off
+            set_parallelism(False)
+            logger.info(f"Loading tokenizer: {MODEL_NAME}")
+            tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+            
+            # Reviews are read and tokenized as training consumes them; only a
+            # bounded evaluation subset is tokenized up front
+            logger.info(f"Streaming {DATASET_NAME} from {args.data_dir}")
+            train_dataset = StreamingTextDataset(
+                split_files(args.data_dir, "train"),
+                tokenizer,
+                max_length=MAX_LENGTH,
+                num_samples=args.train_samples,
+                buffer_size=args.shuffle_buffer,
+                seed=SEED,
+                rank=rank(),
+                world_size=world_size()
+            )
+            eval_dataset = load_eval_subset(
+                split_files(args.data_dir, "test"), tokenizer, max_length=MAX_LENGTH,
+                num_samples=args.eval_samples, seed=SEED
+            )
+        else:
+            # One worker per host downloads and tokenizes first; the others then read its cache
+            with local_main_process_first():
+                # Load dataset
+                logger.info(f"Loading dataset: {DATASET_NAME}")
+                dataset = load_dataset(DATASET_NAME)
+                
+                # Load tokenizer
+                logger.info(f"Loading tokenizer: {MODEL_NAME}")
+                tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+                
+                # Tokenize dataset and copy 'label' to 'labels' in one batched,
+                # multi-process pass; reused from the cache on later runs.
+                # Padding is left to the collator.
+                logger.info("Tokenizing dataset...")
+                tokenized_datasets = tokenize_cached(
+                    dataset,
+                    tokenize_text,
+                    tokenizer,
+                    max_length=MAX_LENGTH,
+                    fn_kwargs={"label_column": "label"}
+                )
+            train_dataset = tokenized_datasets["train"]
+            eval_dataset = tokenized_datasets["test"]
         
         # Load model
         logger.info(f"Loading model: {MODEL_NAME}")
@@ -67,44 +139,73 @@ def main():
             num_labels=5  # Yelp reviews have 5 star ratings
         )
         
-        # Create data collator
-        data_collator = DataCollatorWithPadding(tokenizer=tokenizer)
+        # Largest micro-batch that fits, with accumulation up to each worker's share of
+        # TARGET_BATCH_SIZE. Rank 0 plans for its share of this host's memory and every
+        # worker uses its plan, so all of them accumulate the same number of steps.
+        model = hardware.prepare_model(model)
+        plan = None
+        if is_main_process():
+            plan = plan_batch(model, math.ceil(TARGET_BATCH_SIZE / world_size()), MAX_LENGTH, hardware,
+                              task="classifier", limit=memory_limit(hardware.device) // local_world_size())
+        plan = broadcast_object(plan)
+        
+        # Create data collator (pads each batch to its longest review)
+        data_collator = DataCollatorWithPadding(tokenizer=tokenizer, pad_to_multiple_of=8)
+        
+        max_steps = args.max_steps
+        hardware_args = hardware.training_args()
+        if args.streaming:
+            if max_steps < 0:
+                # A stream has no length; cover the selected reviews NUM_EPOCHS times
+                max_steps = math.ceil(NUM_EPOCHS * train_dataset.num_rows / TARGET_BATCH_SIZE)
+            # At least one loader worker, so tokenizing the next batches overlaps the training math
+            hardware_args.update(dataloader_num_workers=max(1, hardware.dataloader_workers),
+                                 dataloader_persistent_workers=True)
         
         # Training arguments
         training_args = TrainingArguments(
-            output_dir=OUTPUT_DIR,
-            num_train_epochs=3,
-            per_device_train_batch_size=16,  # Increased batch size as DistilBERT is smaller
+            output_dir=args.output_dir,
+            num_train_epochs=NUM_EPOCHS,
+            max_steps=max_steps,
+            seed=SEED,
             per_device_eval_batch_size=16,
             warmup_steps=500,
             weight_decay=0.01,
             logging_dir="./logs",
             logging_steps=100,
             save_total_limit=2,
-            no_cuda=True,  # Force CPU usage
-            dataloader_num_workers=1,
-            dataloader_pin_memory=False,
-            report_to="none"
+            report_to="none",
+            # Gradients are all-reduced over gloo; logs and checkpoints come from rank 0 only
+            ddp_backend="gloo" if distributed else None,
+            ddp_find_unused_parameters=False if distributed else None,
+            log_on_each_node=False,
+            **plan_training_args(plan),
+            **hardware_args
         )
         
-        # Initialize trainer
-        trainer = Trainer(
+        # Initialize trainer with length-bucketed, token-budgeted batches
+        # (fixed-size batches of the planned micro-batch when streaming)
+        trainer = TokenBudgetTrainer(
             model=model,
             args=training_args,
-            train_dataset=tokenized_datasets["train"],
-            eval_dataset=tokenized_datasets["test"],
+            train_dataset=train_dataset,
+            eval_dataset=eval_dataset,
             data_collator=data_collator,
-            tokenizer=tokenizer
+            tokenizer=tokenizer,
+            max_tokens_per_batch=plan['max_tokens_per_batch'],
+            # Per-step throughput and time split; set PROFILE_STEPS=start:end for a trace
+            callbacks=[TrainingMetricsCallback(args.metrics_path or os.path.join(args.output_dir, "metrics.jsonl"))]
         )
         
         # Start training
         logger.info("Starting training...")
         trainer.train()
         
-        # Save model
-        logger.info(f"Saving model to {OUTPUT_DIR}")
-        trainer.save_model(OUTPUT_DIR)
-        tokenizer.save_pretrained(OUTPUT_DIR)
+        # Save model (the trainer writes from rank 0 only)
+        logger.info(f"Saving model to {args.output_dir}")
+        trainer.save_model(args.output_dir)
+        if is_main_process():
+            tokenizer.save_pretrained(args.output_dir)
         
         logger.info("Training completed successfully!")
         
@@ -112,6 +213,8 @@ def main():
         logger.error(f"An error occurred: {str(e)}")
         logger.error(traceback.format_exc())
         raise
+    finally:
+        cleanup_distributed()
 
 if __name__ == "__main__":
     main()
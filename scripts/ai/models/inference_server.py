@@ -0,0 +1,389 @@
+"""
+Local batched inference server built on ModelLoader.
+
+Serves the fine-tuned DistilBERT classifier and the Phi causal LM over HTTP
+(TCP or a Unix socket) using only asyncio. Concurrent requests are merged
+into micro-batches: a batch runs as soon as it holds ``max_batch_size``
+inputs or its oldest input has waited ``max_wait_ms``. Model calls run in a
+worker thread so the event loop keeps accepting requests.
+
+Endpoints:
+    POST /v1/classify   {"texts": ["...", ...]} or {"text": "..."}
+    POST /v1/generate   {"prompt": "...", "max_new_tokens": 64}
+    GET  /metrics       p50/p99 latency, throughput and batch sizes per model
+    GET  /health
+
+Example:
+    python -m models.inference_server --classifier finetuned_distilbert --generator finetuned_phi
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+
+from models.model_loader import ModelLoader
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 1 << 20
+
+class LatencyStats:
+    """Rolling latency percentiles and throughput over the most recent requests."""
+
+    def __init__(self, window: int = 10000):
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.started = time.perf_counter()
+        self.completed = 0
+
+    def record_batch(self, size: int, latencies_ms: List[float]):
+        self.batch_sizes.append(size)
+        self.latencies.extend(latencies_ms)
+        self.completed += size
+
+    @staticmethod
+    def _percentile(values: List[float], percentile: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = list(self.latencies)
+        elapsed = time.perf_counter() - self.started
+        return {
+            'completed': self.completed,
+            'throughput_per_s': self.completed / elapsed if elapsed else 0.0,
+            'p50_ms': self._percentile(latencies, 50),
+            'p99_ms': self._percentile(latencies, 99),
+            'mean_batch_size': sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else None
+        }
+
+class MicroBatcher:
+    """Collect single inputs from concurrent requests and run them in batches."""
+
+    def __init__(self,
+                 name: str,
+                 run_batch: Callable[[List[Any]], List[Any]],
+                 executor: ThreadPoolExecutor,
+                 max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0):
+        """
+        Args:
+            name (str): Name used in logs and metrics
+            run_batch (Callable[[List[Any]], List[Any]]): Blocking function mapping
+                a list of inputs to a list of results of the same length
+            executor (ThreadPoolExecutor): Where ``run_batch`` runs
+            max_batch_size (int): Most inputs per batch
+            max_wait_ms (float): Longest an input waits for others to join its batch
+        """
+        self.name = name
+        self.run_batch = run_batch
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.stats = LatencyStats()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # Requests still queued would otherwise wait forever
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            self._fail([item], RuntimeError(f"{self.name} batcher stopped"))
+
+    @staticmethod
+    def _fail(batch, error: BaseException):
+        for _, future, _ in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def submit(self, item: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = batch[0][2] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                # Inputs that queued up while the previous batch ran join immediately
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            items = [item for item, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.run_batch, items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name} returned {len(results)} results for {len(items)} inputs")
+            except asyncio.CancelledError:
+                self._fail(batch, RuntimeError(f"{self.name} batcher stopped"))
+                raise
+            except Exception as e:
+                logger.error(f"{self.name} batch of {len(items)} failed: {str(e)}")
+                self._fail(batch, e)
+                continue
+
+            finished = time.perf_counter()
+            for (_, future, enqueued), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            self.stats.record_batch(len(batch), [(finished - enqueued) * 1000 for _, _, enqueued in batch])
+
+def classifier_runner(model, tokenizer, max_length: int = 256) -> Callable[[List[str]], List[Dict[str, Any]]]:
+    """Batch function for a sequence classifier: texts -> label and scores."""
+    labels = model.config.id2label
+
+    def run(texts: List[str]) -> List[Dict[str, Any]]:
+        inputs = tokenizer(texts, padding=True, truncation=True, max_length=max_length, return_tensors="pt")
+        inputs = {key: value.to(model.device) for key, value in inputs.items()}
+        with torch.inference_mode():
+            probabilities = torch.softmax(model(**inputs).logits.float(), dim=-1).cpu()
+        return [
+            {'label': labels.get(int(row.argmax()), str(int(row.argmax()))), 'scores': row.tolist()}
+            for row in probabilities
+        ]
+
+    return run
+
+def generator_runner(model, tokenizer, max_input_length: int = 512) -> Callable[[List[Dict[str, Any]]], List[str]]:
+    """Batch function for a causal LM: greedy decoding of left-padded prompts."""
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+
+    def run(requests: List[Dict[str, Any]]) -> List[str]:
+        inputs = tokenizer([request['prompt'] for request in requests], padding=True, truncation=True,
+                           max_length=max_input_length, return_tensors="pt")
+        inputs = {key: value.to(model.device) for key, value in inputs.items()}
+        with torch.inference_mode():
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=max(request['max_new_tokens'] for request in requests),
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id
+            )
+        prompt_length = inputs["input_ids"].shape[1]
+        return [
+            tokenizer.decode(output[prompt_length:prompt_length + request['max_new_tokens']], skip_special_tokens=True)
+            for output, request in zip(outputs, requests)
+        ]
+
+    return run
+
+class InferenceServer:
+    def __init__(self,
+                 loader: ModelLoader,
+                 classifier: str = None,
+                 generator: str = None,
+                 max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0,
+                 max_new_tokens: int = 64):
+        """
+        Args:
+            loader (ModelLoader): Loader the models are taken from
+            classifier (str): Name of the classifier model under the loader's model_dir
+            generator (str): Name of the causal LM under the loader's model_dir
+            max_batch_size (int): Most inputs per model call
+            max_wait_ms (float): Longest an input waits for a batch to fill
+            max_new_tokens (int): Default and upper bound for generation length
+        """
+        if not classifier and not generator:
+            raise ValueError("At least one of classifier or generator must be given")
+
+        self.loader = loader
+        self.classifier = classifier
+        self.generator = generator
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_new_tokens = max_new_tokens
+        # One thread per model: batches for different models may overlap
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="inference")
+        self.batchers = {}
+        self._server = None
+
+    def _build_batchers(self):
+        if self.classifier:
+            model = self.loader.load_model(self.classifier, model_type="classifier").eval()
+            self.batchers['classify'] = MicroBatcher(
+                'classify', classifier_runner(model, self.loader.get_tokenizer(self.classifier)),
+                self.executor, self.max_batch_size, self.max_wait_ms)
+        if self.generator:
+            model = self.loader.load_model(self.generator, model_type="phi").eval()
+            self.batchers['generate'] = MicroBatcher(
+                'generate', generator_runner(model, self.loader.get_tokenizer(self.generator)),
+                self.executor, self.max_batch_size, self.max_wait_ms)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8008, unix_socket: str = None):
+        """Load the models and start listening. Returns once the server accepts connections."""
+        self._build_batchers()
+        for batcher in self.batchers.values():
+            batcher.start()
+
+        if unix_socket:
+            self._server = await asyncio.start_unix_server(self._handle_connection, path=unix_socket)
+            logger.info(f"Serving {', '.join(self.batchers)} on unix:{unix_socket}")
+        else:
+            self._server = await asyncio.start_server(self._handle_connection, host, port)
+            port = self._server.sockets[0].getsockname()[1]
+            logger.info(f"Serving {', '.join(self.batchers)} on http://{host}:{port}")
+        return self._server
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        for batcher in self.batchers.values():
+            await batcher.stop()
+        self.executor.shutdown(wait=False)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            name: {**batcher.stats.snapshot(), 'max_batch_size': batcher.max_batch_size,
+                   'max_wait_ms': batcher.max_wait * 1000, 'queued': batcher.queue.qsize()}
+            for name, batcher in self.batchers.items()
+        }
+
+    @staticmethod
+    def _json_object(body: bytes) -> Dict[str, Any]:
+        payload = json.loads(body or b"{}")
+        if not isinstance(payload, dict):
+            raise ValueError("request body must be a JSON object")
+        return payload
+
+    async def _route(self, method: str, path: str, body: bytes):
+        if method == "GET" and path == "/health":
+            return 200, {'status': 'ok', 'models': list(self.batchers)}
+        if method == "GET" and path == "/metrics":
+            return 200, self.metrics()
+
+        if method == "POST" and path == "/v1/classify" and 'classify' in self.batchers:
+            payload = self._json_object(body)
+            texts = payload['texts'] if 'texts' in payload else [payload['text']]
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                raise ValueError("'texts' must be a list of strings")
+            results = await asyncio.gather(*(self.batchers['classify'].submit(text) for text in texts))
+            return 200, {'results': results}
+
+        if method == "POST" and path == "/v1/generate" and 'generate' in self.batchers:
+            payload = self._json_object(body)
+            if not isinstance(payload['prompt'], str):
+                raise ValueError("'prompt' must be a string")
+            max_new_tokens = min(int(payload.get('max_new_tokens', self.max_new_tokens)), self.max_new_tokens)
+            text = await self.batchers['generate'].submit(
+                {'prompt': payload['prompt'], 'max_new_tokens': max_new_tokens})
+            return 200, {'text': text}
+
+        return 404, {'error': f"No route for {method} {path}"}
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode('latin-1').split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    status, response = 413, {'error': 'Request body too large'}
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    try:
+                        status, response = await self._route(method, path, body)
+                    except (KeyError, TypeError, ValueError) as e:
+                        status, response = 400, {'error': f"Bad request: {str(e)}"}
+                    except Exception as e:
+                        logger.error(f"Error handling {method} {path}: {str(e)}")
+                        status, response = 500, {'error': str(e)}
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                payload = json.dumps(response).encode('utf-8')
+                writer.write(
+                    f"{version} {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(args):
+    server = InferenceServer(
+        ModelLoader(args.model_dir),
+        classifier=args.classifier,
+        generator=args.generator,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_new_tokens=args.max_new_tokens
+    )
+    listener = await server.start(args.host, args.port, args.unix_socket)
+    try:
+        await listener.serve_forever()
+    finally:
+        await server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fine-tuned models with dynamic micro-batching")
+    parser.add_argument("--model-dir", default=os.getenv('MODEL_DIR', 'models'), help="ModelLoader model directory")
+    parser.add_argument("--classifier", help="Classifier model name, e.g. finetuned_distilbert")
+    parser.add_argument("--generator", help="Causal LM model name, e.g. finetuned_phi")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--unix-socket", help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,339 @@
 """
 Model loader for AI tasks.
 Handles loading and initialization of AI models.
+
+Loaded models live in an LRU cache with an optional memory budget (bytes of
+parameters and buffers). When a load would exceed the budget, the least
+recently used unpinned models are evicted first. Models can be registered
+up front and are then loaded lazily on first use. All public methods are
+thread-safe, and concurrent loads of the same model share a single load.
+
+A model directory may hold a LoRA adapter (``utils/adapters.py``) instead of
+full weights. Its base model is loaded first, from ``model_dir`` when a
+directory of that name exists and from the Hub otherwise, and the adapter is
+attached to it. With ``merge_adapter`` the adapter is folded into the base
+weights, so inference runs at the base model's speed.
 """
 
+import gc
 import os
+import json
+import logging
+import importlib.util
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from typing import Any, Dict, Optional
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM, AutoModelForSequenceClassification
+
+from utils.adapters import adapter_base_model, is_adapter_dir
+
+logger = logging.getLogger(__name__)
+
+# Model class used for each supported model type
+MODEL_CLASSES = {
+    "phi": AutoModelForCausalLM,
+    "classifier": AutoModelForSequenceClassification
+}
+
+DTYPES = {
+    "fp32": torch.float32,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16
+}
+
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt")
+
+def model_nbytes(model) -> int:
+    """Bytes held by a model's weights, including dynamically quantized (packed) ones."""
+    seen = set()
+
+    def nbytes(value) -> int:
+        if isinstance(value, (tuple, list)):
+            return sum(nbytes(item) for item in value)
+        if not isinstance(value, torch.Tensor) or value.data_ptr() in seen:
+            return 0
+        seen.add(value.data_ptr())
+        return value.numel() * value.element_size()
+
+    # state_dict rather than parameters(): quantized Linear weights are not parameters
+    return sum(nbytes(value) for value in model.state_dict().values())
 
 class ModelLoader:
-    def __init__(self, model_dir: str = None):
+    def __init__(self, model_dir: str = None, memory_budget: int = None, device: str = None):
+        """
+        Args:
+            model_dir (str): Directory containing one subdirectory per model
+            memory_budget (int): Bytes of model weights to keep loaded
+                (default: ``MODEL_MEMORY_BUDGET`` env var, unlimited if unset)
+            device (str): Device models are moved to (default: ``MODEL_DEVICE`` or 'cpu')
+        """
         self.model_dir = model_dir or os.getenv('MODEL_DIR', 'models')
-        self.models = {}
+        budget = memory_budget if memory_budget is not None else os.getenv('MODEL_MEMORY_BUDGET')
+        self.memory_budget = int(budget) if budget else None
+        self.device = device or os.getenv('MODEL_DEVICE', 'cpu')
+        # Least recently used first
+        self.models = OrderedDict()
         self.tokenizers = {}
-    
-    def load_model(self, model_name: str, model_type: str = "phi"):
+        self.sizes = {}
+        self.pinned = set()
+        self.specs = {}
+        self._lock = threading.RLock()
+        self._load_locks = {}
+
+    def register(self, model_name: str, model_type: str = "phi", pin: bool = False, **load_options):
+        """
+        Register a model to be loaded lazily by ``get_model``/``get_tokenizer``.
+
+        Args:
+            model_name (str): Name of the model directory
+            model_type (str): Type of model, see ``load_model``
+            pin (bool): Never evict this model once loaded
+            **load_options: ``dtype``, ``low_cpu_mem_usage`` and ``merge_adapter``, see ``load_model``
+        """
+        if model_type not in MODEL_CLASSES:
+            raise ValueError(f"Unsupported model type: {model_type}")
+        with self._lock:
+            self.specs[model_name] = {'model_type': model_type, 'pin': pin, **load_options}
+
+    def _cached(self, model_name: str, pin: bool):
+        """The loaded model, marked as most recently used (and pinned if asked); call with ``_lock`` held."""
+        if model_name not in self.models:
+            return None
+        self.models.move_to_end(model_name)
+        if pin:
+            self.pinned.add(model_name)
+        return self.models[model_name]
+
+    def load_model(self,
+                   model_name: str,
+                   model_type: str = "phi",
+                   dtype: Optional[str] = None,
+                   pin: bool = False,
+                   low_cpu_mem_usage: bool = True,
+                   merge_adapter: bool = False):
         """
         Load a specific model by name and type.
-        
+
         Args:
             model_name (str): Name of the model to load
-            model_type (str): Type of model (e.g., 'phi', 'embedding', 'generation')
+            model_type (str): Type of model ('phi' for causal LMs, 'classifier'
+                for sequence classifiers such as the fine-tuned DistilBERT)
+            dtype (Optional[str]): 'fp32', 'fp16', 'bf16' or 'int8' (default: as saved)
+            pin (bool): Never evict this model
+            low_cpu_mem_usage (bool): Load weights straight into the model
+                (safetensors files are memory-mapped) instead of materializing
+                a randomly initialized copy first
+            merge_adapter (bool): For adapter directories, merge the adapter
+                into the base weights instead of keeping it attached
         """
-        if model_name in self.models:
-            return self.models[model_name]
-            
-        if model_type == "phi":
+        with self._lock:
+            model = self._cached(model_name, pin)
+            if model is not None:
+                return model
+            load_lock = self._load_locks.setdefault(model_name, threading.Lock())
+
+        # Loads of different models run in parallel; loads of the same model wait for the first
+        with load_lock:
+            with self._lock:
+                # Another thread loaded it while this one waited
+                model = self._cached(model_name, pin)
+                if model is not None:
+                    return model
+
+            if model_type not in MODEL_CLASSES:
+                raise ValueError(f"Unsupported model type: {model_type}")
+            if dtype is not None and dtype not in DTYPES and dtype != "int8":
+                raise ValueError(f"Unsupported dtype: {dtype}")
+
             model_path = os.path.join(self.model_dir, model_name)
             if not os.path.exists(model_path):
                 raise FileNotFoundError(f"Model not found at {model_path}")
-                
-            self.tokenizers[model_name] = AutoTokenizer.from_pretrained(model_path)
-            self.models[model_name] = AutoModelForCausalLM.from_pretrained(model_path)
-        else:
-            raise ValueError(f"Unsupported model type: {model_type}")
-            
-        return self.models[model_name]
-    
+
+            self._make_room(self._estimate_nbytes(model_path, dtype), exclude=model_name)
+
+            logger.info(f"Loading {model_type} model {model_name} (dtype={dtype or 'default'})")
+            if is_adapter_dir(model_path):
+                base_path = self._base_model_path(model_path)
+                has_tokenizer = os.path.exists(os.path.join(model_path, "tokenizer_config.json"))
+                tokenizer = AutoTokenizer.from_pretrained(model_path if has_tokenizer else base_path)
+                model = self._from_adapter(MODEL_CLASSES[model_type], model_path, base_path, dtype,
+                                           low_cpu_mem_usage, merge_adapter)
+            else:
+                tokenizer = AutoTokenizer.from_pretrained(model_path)
+                model = self._from_pretrained(MODEL_CLASSES[model_type], model_path, dtype, low_cpu_mem_usage)
+            nbytes = model_nbytes(model)
+
+            with self._lock:
+                self.models[model_name] = model
+                self.tokenizers[model_name] = tokenizer
+                self.sizes[model_name] = nbytes
+                if pin:
+                    self.pinned.add(model_name)
+                # Remember how it was loaded so get_model can bring it back after eviction
+                self.specs.setdefault(model_name, {
+                    'model_type': model_type, 'dtype': dtype, 'low_cpu_mem_usage': low_cpu_mem_usage,
+                    'merge_adapter': merge_adapter
+                })
+            # The estimate may have been low; settle the budget with the real size
+            self._make_room(0, exclude=model_name)
+
+        return model
+
+    def _from_pretrained(self, model_class, model_path: str, dtype: Optional[str], low_cpu_mem_usage: bool):
+        if low_cpu_mem_usage and importlib.util.find_spec("accelerate") is None:
+            logger.info("accelerate is not installed; loading without low_cpu_mem_usage")
+            low_cpu_mem_usage = False
+        kwargs = {'low_cpu_mem_usage': low_cpu_mem_usage}
+        if any(name.endswith('.safetensors') for name in os.listdir(model_path)):
+            kwargs['use_safetensors'] = True
+
+        if dtype == "int8":
+            if self.device.startswith("cuda"):
+                from transformers import BitsAndBytesConfig
+
+                return model_class.from_pretrained(
+                    model_path, quantization_config=BitsAndBytesConfig(load_in_8bit=True),
+                    device_map=self.device, **kwargs)
+            # No bitsandbytes on CPU: quantize Linear layers dynamically instead
+            model = model_class.from_pretrained(model_path, **kwargs).eval()
+            return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        if dtype:
+            kwargs['torch_dtype'] = DTYPES[dtype]
+        return model_class.from_pretrained(model_path, **kwargs).to(self.device)
+
+    def _base_model_path(self, adapter_path: str) -> str:
+        """The adapter's base model: a directory in ``model_dir`` if present, else its Hub name."""
+        base = adapter_base_model(adapter_path)
+        if not base:
+            raise ValueError(f"Adapter at {adapter_path} does not record its base model")
+        local = os.path.join(self.model_dir, os.path.basename(os.path.normpath(base)))
+        return local if os.path.isdir(local) else base
+
+    def _from_adapter(self, model_class, adapter_path: str, base_path: str, dtype: Optional[str],
+                      low_cpu_mem_usage: bool, merge_adapter: bool):
+        from peft import PeftModel
+
+        # Dynamically quantized layers cannot take adapters: merge at full precision, then quantize
+        quantize_after = dtype == "int8" and not self.device.startswith("cuda")
+        if quantize_after and not merge_adapter:
+            raise ValueError("int8 on CPU needs merge_adapter=True for adapter models")
+        model = self._from_pretrained(model_class, base_path, None if quantize_after else dtype, low_cpu_mem_usage)
+        model = PeftModel.from_pretrained(model, adapter_path)
+        if merge_adapter:
+            model = model.merge_and_unload()
+        if quantize_after:
+            return torch.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+        # bitsandbytes models are placed by device_map and cannot be moved
+        return model if dtype == "int8" else model.to(self.device)
+
+    def _estimate_nbytes(self, model_path: str, dtype: Optional[str]) -> int:
+        """Approximate in-memory size from the weight files and the target dtype."""
+        if is_adapter_dir(model_path):
+            base_path = self._base_model_path(model_path)
+            # A Hub base has no local files to measure; the real size settles the budget after loading
+            base = self._estimate_nbytes(base_path, dtype) if os.path.isdir(base_path) else 0
+            return base + sum(path.stat().st_size for path in Path(model_path).iterdir()
+                              if path.name.endswith(WEIGHT_SUFFIXES))
+        on_disk = sum(
+            path.stat().st_size for path in Path(model_path).iterdir()
+            if path.name.endswith(WEIGHT_SUFFIXES)
+        )
+        try:
+            with open(os.path.join(model_path, "config.json"), 'r', encoding='utf-8') as f:
+                saved = str(json.load(f).get('torch_dtype') or 'float32')
+        except (OSError, ValueError):
+            saved = 'float32'
+        saved_bytes = 2 if saved in ('float16', 'bfloat16') else 4
+        target_bytes = {'fp32': 4, 'fp16': 2, 'bf16': 2, 'int8': 1}.get(dtype, saved_bytes)
+        return on_disk * target_bytes // saved_bytes
+
+    def _make_room(self, incoming: int, exclude: str = None):
+        """Evict least recently used unpinned models until ``incoming`` more bytes fit."""
+        if self.memory_budget is None:
+            return
+        with self._lock:
+            for name in list(self.models):
+                if self.memory_usage() + incoming <= self.memory_budget:
+                    return
+                if name not in self.pinned and name != exclude:
+                    self._evict(name)
+            if self.memory_usage() + incoming > self.memory_budget:
+                logger.warning(
+                    f"Model memory {self.memory_usage() + incoming} bytes exceeds the budget of "
+                    f"{self.memory_budget} bytes after evicting every unpinned model"
+                )
+
+    def _evict(self, model_name: str):
+        logger.info(f"Evicting model {model_name} ({self.sizes.get(model_name, 0)} bytes)")
+        self.models.pop(model_name, None)
+        self.tokenizers.pop(model_name, None)
+        self.sizes.pop(model_name, None)
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def unload(self, model_name: str):
+        """Drop a model from the cache, pinned or not."""
+        with self._lock:
+            self.pinned.discard(model_name)
+            if model_name in self.models:
+                self._evict(model_name)
+
+    def pin(self, model_name: str):
+        with self._lock:
+            self.pinned.add(model_name)
+
+    def unpin(self, model_name: str):
+        with self._lock:
+            self.pinned.discard(model_name)
+        self._make_room(0)
+
+    def memory_usage(self) -> int:
+        """Bytes of weights currently loaded."""
+        with self._lock:
+            return sum(self.sizes.values())
+
+    def cache_info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'budget': self.memory_budget,
+                'used': self.memory_usage(),
+                'models': [
+                    {'name': name, 'bytes': self.sizes[name], 'pinned': name in self.pinned}
+                    for name in self.models
+                ]
+            }
+
+    def _ensure_loaded(self, model_name: str):
+        with self._lock:
+            if model_name in self.models:
+                self.models.move_to_end(model_name)
+                return self.models[model_name]
+            spec = self.specs.get(model_name)
+        if spec is None:
+            return None
+        spec = dict(spec)
+        return self.load_model(model_name, spec.pop('model_type'), **spec)
+
     def get_model(self, model_name: str):
         """
-        Get a loaded model by name.
-        
+        Get a model by name, loading it if it was registered but is not loaded.
+
         Args:
             model_name (str): Name of the model to retrieve
         """
-        return self.models.get(model_name)
-        
+        return self._ensure_loaded(model_name)
+
     def get_tokenizer(self, model_name: str):
         """
-        Get a loaded tokenizer by name.
-        
+        Get a tokenizer by name, loading its model if it was registered but is not loaded.
+
         Args:
             model_name (str): Name of the tokenizer to retrieve
         """
-        return self.tokenizers.get(model_name) 
\ No newline at end of file
+        self._ensure_loaded(model_name)
+        with self._lock:
+            return self.tokenizers.get(model_name)
@@ -4,11 +4,19 @@ This script:
 1. Converts the model to ONNX format
 2. Quantizes the model for better web performance
 3. Prepares the model files for Netlify CDN deployment
+
+Every ONNX variant (fp32, dynamic INT8 and optionally fp16) is checked against
+the PyTorch model and timed, and a size/latency report is written next to the
+model files. The files follow the Transformers.js layout
+(``config.json``, tokenizer files and ``onnx/model*.onnx``).
 """
 
 import os
-import shutil
+import json
+import time
+import argparse
 from pathlib import Path
+import numpy as np
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import logging
@@ -20,26 +28,203 @@ logger = logging.getLogger(__name__)
 # Constants
 MODEL_DIR = "models/finetuned_distilbert"
 WEB_MODEL_DIR = "static/models/finetuned_distilbert"
+MAX_LENGTH = 256
+OPSET = 14
+
+# Largest allowed |logit difference| from PyTorch, per variant
+TOLERANCES = {
+    "fp32": 1e-4,
+    "fp16": 5e-2,
+    "int8": 5e-1
+}
+
+VALIDATION_TEXTS = [
+    "The service was fantastic and the team delivered ahead of schedule.",
+    "I waited three weeks and never heard back. Very disappointing.",
+    "It was okay, nothing special but it got the job done.",
+    "Can you help us add AI search to our online store?",
+    "Absolutely terrible experience, would not recommend to anyone.",
+    "Great value for the price, I will definitely come back.",
+    "The consultation was helpful although a bit rushed at the end.",
+    "We need a chatbot that understands our product catalog."
+]
+
+def export_onnx(model, tokenizer, output_path: str, opset: int = OPSET):
+    """Export the classifier to ONNX with dynamic batch and sequence axes."""
+    model.eval()
+    inputs = tokenizer(VALIDATION_TEXTS[:2], padding=True, return_tensors="pt")
+
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (inputs["input_ids"], inputs["attention_mask"]),
+            output_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch_size", 1: "sequence_length"},
+                "attention_mask": {0: "batch_size", 1: "sequence_length"},
+                "logits": {0: "batch_size"}
+            },
+            opset_version=opset,
+            do_constant_folding=True
+        )
+
+def optimize_onnx(input_path: str, output_path: str):
+    """
+    Apply onnxruntime's basic graph optimizations (constant folding, redundant
+    node elimination). Higher levels add fused contrib ops that onnxruntime-web
+    may not support, so they are not used for the browser artifact.
+    """
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_BASIC
+    options.optimized_model_filepath = output_path
+    ort.InferenceSession(input_path, options, providers=["CPUExecutionProvider"])
+
+def quantize_int8(input_path: str, output_path: str):
+    """Dynamically quantize weights to INT8 (activations are quantized at runtime)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(input_path, output_path, weight_type=QuantType.QInt8)
+
+def convert_fp16(input_path: str, output_path: str):
+    """Convert weights to fp16 while keeping fp32 inputs and outputs."""
+    import onnx
+    try:
+        from onnxconverter_common import float16
+    except ImportError as e:
+        raise ImportError("fp16 export requires `pip install onnxconverter-common`") from e
+
+    model = onnx.load(input_path)
+    onnx.save(float16.convert_float_to_float16(model, keep_io_types=True), output_path)
+
+def pytorch_logits(model, tokenizer, texts):
+    inputs = tokenizer(texts, padding=True, truncation=True, max_length=MAX_LENGTH, return_tensors="pt")
+    with torch.no_grad():
+        return model(**inputs).logits.numpy()
+
+def onnx_session(path: str):
+    import onnxruntime as ort
+
+    return ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+
+def onnx_logits(session, tokenizer, texts):
+    inputs = tokenizer(texts, padding=True, truncation=True, max_length=MAX_LENGTH, return_tensors="np")
+    return session.run(["logits"], {
+        "input_ids": inputs["input_ids"].astype(np.int64),
+        "attention_mask": inputs["attention_mask"].astype(np.int64)
+    })[0]
+
+def measure_latency(run, repeats: int = 20, warmup: int = 3) -> float:
+    """Median wall time of ``run()`` in milliseconds."""
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+def evaluate_variant(name: str, path: str, tokenizer, reference, tolerance: float) -> dict:
+    """Compare an ONNX variant against the PyTorch logits and time it at batch size 1."""
+    session = onnx_session(path)
+    logits = onnx_logits(session, tokenizer, VALIDATION_TEXTS)
+    max_diff = float(np.max(np.abs(logits - reference)))
+    agreement = float(np.mean(np.argmax(logits, axis=-1) == np.argmax(reference, axis=-1)))
+
+    return {
+        "variant": name,
+        "path": path,
+        "size_mb": os.path.getsize(path) / 2**20,
+        "latency_ms": measure_latency(lambda: onnx_logits(session, tokenizer, VALIDATION_TEXTS[:1])),
+        "max_abs_diff": max_diff,
+        "label_agreement": agreement,
+        "tolerance": tolerance,
+        "passed": max_diff <= tolerance
+    }
 
-def prepare_web_model():
+def prepare_web_model(model_dir: str = MODEL_DIR,
+                      web_model_dir: str = WEB_MODEL_DIR,
+                      fp16: bool = False,
+                      opset: int = OPSET,
+                      tolerances: dict = None):
     """Prepare the model for web deployment."""
     logger.info("Starting web model preparation...")
-    
+    tolerances = {**TOLERANCES, **(tolerances or {})}
+
     # Create web model directory
-    os.makedirs(WEB_MODEL_DIR, exist_ok=True)
-    
+    onnx_dir = os.path.join(web_model_dir, "onnx")
+    os.makedirs(onnx_dir, exist_ok=True)
+
     # Load model and tokenizer
     logger.info("Loading model and tokenizer...")
-    model = AutoModelForSequenceClassification.from_pretrained(MODEL_DIR)
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR)
-    
-    # Save model files for web deployment
-    logger.info("Saving model files for web deployment...")
-    model.save_pretrained(WEB_MODEL_DIR)
-    tokenizer.save_pretrained(WEB_MODEL_DIR)
-    
+    model = AutoModelForSequenceClassification.from_pretrained(model_dir)
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model.eval()
+
+    # Save config and tokenizer; the weights ship as ONNX only
+    logger.info("Saving config and tokenizer for web deployment...")
+    model.config.save_pretrained(web_model_dir)
+    tokenizer.save_pretrained(web_model_dir)
+    for stale in ("model.safetensors", "pytorch_model.bin"):
+        if os.path.exists(os.path.join(web_model_dir, stale)):
+            logger.info(f"Removing fp32 PyTorch weights {stale} from the web directory")
+            os.remove(os.path.join(web_model_dir, stale))
+
+    # Export and optimize the fp32 graph
+    logger.info(f"Exporting ONNX graph (opset {opset})...")
+    raw_path = os.path.join(onnx_dir, "model_unoptimized.onnx")
+    fp32_path = os.path.join(onnx_dir, "model.onnx")
+    export_onnx(model, tokenizer, raw_path, opset=opset)
+    optimize_onnx(raw_path, fp32_path)
+    os.remove(raw_path)
+
+    variants = {"fp32": fp32_path}
+
+    logger.info("Quantizing to INT8...")
+    variants["int8"] = os.path.join(onnx_dir, "model_quantized.onnx")
+    quantize_int8(fp32_path, variants["int8"])
+
+    if fp16:
+        logger.info("Converting to fp16...")
+        variants["fp16"] = os.path.join(onnx_dir, "model_fp16.onnx")
+        convert_fp16(fp32_path, variants["fp16"])
+
+    # Validate and benchmark every variant against PyTorch
+    logger.info("Validating variants against PyTorch...")
+    reference = pytorch_logits(model, tokenizer, VALIDATION_TEXTS)
+    torch_size = sum(p.numel() * p.element_size() for p in model.parameters()) / 2**20
+    torch_latency = measure_latency(lambda: pytorch_logits(model, tokenizer, VALIDATION_TEXTS[:1]))
+
+    report = {
+        "pytorch": {"size_mb": torch_size, "latency_ms": torch_latency},
+        "variants": [
+            evaluate_variant(name, path, tokenizer, reference, tolerances[name])
+            for name, path in variants.items()
+        ]
+    }
+
+    logger.info(f"{'variant':<10}{'size MB':>10}{'x smaller':>11}{'ms (bs=1)':>11}{'max diff':>11}{'agree':>8}")
+    logger.info(f"{'pytorch':<10}{torch_size:>10.1f}{1:>11.1f}{torch_latency:>11.2f}{'-':>11}{'-':>8}")
+    for result in report["variants"]:
+        logger.info(
+            f"{result['variant']:<10}{result['size_mb']:>10.1f}{torch_size / result['size_mb']:>11.1f}"
+            f"{result['latency_ms']:>11.2f}{result['max_abs_diff']:>11.4f}{result['label_agreement']:>8.0%}"
+        )
+
+    with open(os.path.join(web_model_dir, "export_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    failed = [result["variant"] for result in report["variants"] if not result["passed"]]
+    if failed:
+        raise ValueError(f"ONNX variants exceed their tolerance against PyTorch: {', '.join(failed)}")
+
     # Create model card
     logger.info("Creating model card...")
+    fp16_line = "- `onnx/model_fp16.onnx`: fp16 weights\n" if fp16 else ""
     model_card = f"""# Fine-tuned DistilBERT for Sentiment Analysis
 
 This model is a fine-tuned version of DistilBERT for sentiment analysis of customer inquiries.
@@ -49,17 +234,31 @@ It was trained on the Yelp reviews dataset and adapted for web deployment.
 - Base Model: distilbert-base-uncased
 - Task: Text Classification
 - Number of Labels: 5
-- Max Sequence Length: 256
+- Max Sequence Length: {MAX_LENGTH}
+
+## Files
+- `onnx/model.onnx`: fp32 ONNX graph
+- `onnx/model_quantized.onnx`: dynamic INT8 quantization (recommended for the browser)
+{fp16_line}
+See `export_report.json` for sizes, latency and accuracy against the PyTorch model.
 
 ## Usage
 This model is optimized for web deployment and can be used with the Transformers.js library.
 """
-    
-    with open(os.path.join(WEB_MODEL_DIR, "README.md"), "w") as f:
+
+    with open(os.path.join(web_model_dir, "README.md"), "w") as f:
         f.write(model_card)
-    
+
     logger.info("Model preparation completed successfully!")
-    logger.info(f"Model files are ready in: {WEB_MODEL_DIR}")
+    logger.info(f"Model files are ready in: {web_model_dir}")
+    return report
 
 if __name__ == "__main__":
-    prepare_web_model() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Export the fine-tuned classifier to ONNX for the web")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Fine-tuned PyTorch model")
+    parser.add_argument("--output-dir", default=WEB_MODEL_DIR, help="Web model directory")
+    parser.add_argument("--fp16", action="store_true", help="Also export an fp16 variant")
+    parser.add_argument("--opset", type=int, default=OPSET, help="ONNX opset version")
+    args = parser.parse_args()
+
+    prepare_web_model(args.model_dir, args.output_dir, fp16=args.fp16, opset=args.opset)
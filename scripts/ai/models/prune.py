@@ -0,0 +1,227 @@
+"""
+Prune the fine-tuned DistilBERT classifier for faster CPU inference.
+
+Each pruning level drops transformer layers, attention heads and FFN neurons
+ranked by their importance on a calibration set (see ``utils/pruning.py``).
+It can then run a short recovery fine-tune. Every level is saved as a dense
+model that loads with ``from_pretrained`` and can go through
+``prepare_web_model.py`` like the original:
+
+    python -m models.prune --recovery-steps 300
+    python -m models.prepare_web_model --model-dir models/pruned_distilbert/medium
+
+Calibration, evaluation and recovery data are read from local parquet or
+Arrow files of the Yelp dataset (``data/streaming.py``).
+``pruning_report.json`` lists parameters, weight file size, CPU latency at
+batch sizes 1, 8 and 32, and accuracy for the original model and each level.
+"""
+
+import os
+import argparse
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, List
+
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer, DataCollatorWithPadding, TrainingArguments
+
+from data.streaming import StreamingTextDataset, load_eval_subset, split_files
+from models.prepare_web_model import measure_latency
+from utils.adapters import count_parameters
+from utils.batching import TokenBudgetTrainer
+from utils.hardware import HardwareProfile
+from utils.pruning import layer_importance, prune_model
+from utils.text_processor import set_parallelism
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = "models/finetuned_distilbert"
+OUTPUT_DIR = "models/pruned_distilbert"
+DATA_DIR = os.path.join("data", "yelp_review_full")
+MAX_LENGTH = 256
+SEED = 42
+
+# Layers dropped, and fractions of attention heads and FFN neurons removed
+PRUNING_LEVELS = {
+    "light": {"layers": 0, "heads": 0.25, "ffn": 0.25},
+    "medium": {"layers": 1, "heads": 0.33, "ffn": 0.5},
+    "heavy": {"layers": 2, "heads": 0.5, "ffn": 0.75}
+}
+
+LATENCY_BATCH_SIZES = (1, 8, 32)
+EVAL_BATCH_SIZE = 32
+RECOVERY_BATCH_SIZE = 16
+
+def make_batches(dataset, collator, batch_size: int) -> List[Dict[str, torch.Tensor]]:
+    """Padded, labelled batches of a tokenized dataset, in order."""
+    rows = [{key: value for key, value in dataset[i].items() if key != 'length'} for i in range(len(dataset))]
+    return [collator(rows[start:start + batch_size]) for start in range(0, len(rows), batch_size)]
+
+def accuracy(model, batches: List[Dict[str, torch.Tensor]]) -> float:
+    model.eval()
+    correct = total = 0
+    with torch.no_grad():
+        for batch in batches:
+            predictions = model(input_ids=batch['input_ids'], attention_mask=batch['attention_mask']).logits.argmax(-1)
+            correct += int((predictions == batch['labels']).sum())
+            total += len(predictions)
+    return correct / total if total else 0.0
+
+def cpu_latency(model, inputs: Dict[int, Dict[str, torch.Tensor]]) -> Dict[str, float]:
+    """Median fp32 forward latency in milliseconds for each batch size."""
+    model.eval()
+    with torch.no_grad():
+        return {
+            str(batch_size): measure_latency(lambda: model(**batch), repeats=10 if batch_size > 8 else 20)
+            for batch_size, batch in inputs.items()
+        }
+
+def weight_file_mb(path: str) -> float:
+    return sum(entry.stat().st_size for entry in Path(path).iterdir()
+               if entry.name.endswith((".safetensors", ".bin"))) / 2**20
+
+def describe(model, path: str, eval_batches, latency_inputs) -> Dict[str, Any]:
+    return {
+        'path': path,
+        'layers': model.config.n_layers,
+        'ffn_dim': model.config.hidden_dim,
+        'parameters': count_parameters(model)[1],
+        'file_mb': weight_file_mb(path),
+        'latency_ms': cpu_latency(model, latency_inputs),
+        'accuracy': accuracy(model, eval_batches)
+    }
+
+def recover(model, tokenizer, train_files: List[str], steps: int, output_dir: str, hardware: HardwareProfile):
+    """Short fine-tune of a pruned model on a stratified stream of training reviews."""
+    train_dataset = StreamingTextDataset(
+        train_files, tokenizer, max_length=MAX_LENGTH, num_samples=steps * RECOVERY_BATCH_SIZE, seed=SEED
+    )
+    training_args = TrainingArguments(
+        output_dir=output_dir,
+        max_steps=steps,
+        per_device_train_batch_size=RECOVERY_BATCH_SIZE,
+        learning_rate=3e-5,
+        warmup_steps=max(1, steps // 10),
+        weight_decay=0.01,
+        logging_steps=50,
+        save_strategy="no",
+        seed=SEED,
+        report_to="none",
+        **{**hardware.training_args(), 'dataloader_num_workers': max(1, hardware.dataloader_workers),
+           'dataloader_persistent_workers': True}
+    )
+    trainer = TokenBudgetTrainer(
+        model=model,
+        args=training_args,
+        train_dataset=train_dataset,
+        data_collator=DataCollatorWithPadding(tokenizer=tokenizer, pad_to_multiple_of=8),
+        max_tokens_per_batch=RECOVERY_BATCH_SIZE * MAX_LENGTH
+    )
+    trainer.train()
+    return trainer.model
+
+def prune(model_dir: str = MODEL_DIR,
+          output_dir: str = OUTPUT_DIR,
+          data_dir: str = DATA_DIR,
+          levels: Dict[str, Dict[str, Any]] = None,
+          calibration_samples: int = 512,
+          eval_samples: int = 2000,
+          recovery_steps: int = 0) -> Dict[str, Any]:
+    """
+    Prune the classifier at each level, optionally recover, and compare against the original.
+
+    Args:
+        model_dir (str): Fine-tuned DistilBERT classifier
+        output_dir (str): One subdirectory per level, plus ``pruning_report.json``
+        data_dir (str): Parquet or Arrow files of the Yelp dataset
+        levels (Dict[str, Dict[str, Any]]): Name to ``layers``/``heads``/``ffn``
+            settings (default: ``PRUNING_LEVELS``)
+        calibration_samples (int): Label-stratified training reviews used to score importance
+        eval_samples (int): Label-stratified test reviews used for accuracy
+        recovery_steps (int): Fine-tuning steps after pruning (0: none)
+
+    Returns:
+        Dict[str, Any]: The report
+    """
+    levels = levels or PRUNING_LEVELS
+    # Tokenization runs in forked data-loader workers during recovery
+    set_parallelism(False)
+    hardware = HardwareProfile(device="cpu").apply()
+
+    logger.info(f"Loading model from {model_dir}")
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = AutoModelForSequenceClassification.from_pretrained(model_dir).eval()
+
+    logger.info(f"Loading calibration and evaluation reviews from {data_dir}")
+    train_files = split_files(data_dir, "train")
+    collator = DataCollatorWithPadding(tokenizer=tokenizer, pad_to_multiple_of=8)
+    calibration = make_batches(
+        load_eval_subset(train_files, tokenizer, MAX_LENGTH, num_samples=calibration_samples, seed=SEED),
+        collator, EVAL_BATCH_SIZE
+    )
+    eval_dataset = load_eval_subset(split_files(data_dir, "test"), tokenizer, MAX_LENGTH,
+                                    num_samples=eval_samples, seed=SEED)
+    eval_batches = make_batches(eval_dataset, collator, EVAL_BATCH_SIZE)
+    # The same real reviews time every model
+    latency_inputs = {}
+    for batch_size in LATENCY_BATCH_SIZES:
+        batch = make_batches(eval_dataset, collator, batch_size)[0]
+        latency_inputs[batch_size] = {'input_ids': batch['input_ids'], 'attention_mask': batch['attention_mask']}
+
+    report = {'original': describe(model, model_dir, eval_batches, latency_inputs), 'levels': {}}
+    layer_scores = layer_importance(model, calibration)
+    logger.info("Layer importance (calibration loss rise when skipped): "
+                + ", ".join(f"{i}: {score:.4f}" for i, score in enumerate(layer_scores)))
+
+    for name, settings in levels.items():
+        logger.info(f"Pruning level {name}: {settings}")
+        result = prune_model(model, calibration, layer_scores=layer_scores, **settings)
+        pruned = result['model']
+        level_dir = os.path.join(output_dir, name)
+        entry = {'settings': settings, 'dropped_layers': result['dropped_layers'],
+                 'pruned_heads': result['pruned_heads'], 'heads': result['heads']}
+        if recovery_steps:
+            entry['accuracy_before_recovery'] = accuracy(pruned, eval_batches)
+            logger.info(f"Recovery fine-tuning for {recovery_steps} steps")
+            pruned = recover(pruned, tokenizer, train_files, recovery_steps, level_dir, hardware).eval()
+
+        pruned.save_pretrained(level_dir)
+        tokenizer.save_pretrained(level_dir)
+        # Measure the model as it loads from disk, so the files are known to round-trip
+        reloaded = AutoModelForSequenceClassification.from_pretrained(level_dir).eval()
+        entry.update(describe(reloaded, level_dir, eval_batches, latency_inputs))
+        report['levels'][name] = entry
+
+    original = report['original']
+    logger.info(f"{'model':<10}{'params M':>10}{'file MB':>10}"
+                + "".join(f"{f'ms bs={size}':>12}" for size in LATENCY_BATCH_SIZES)
+                + f"{'speedup':>9}{'accuracy':>10}")
+    for name, entry in [('original', original)] + list(report['levels'].items()):
+        entry['speedup'] = {size: original['latency_ms'][size] / entry['latency_ms'][size]
+                            for size in entry['latency_ms']}
+        logger.info(f"{name:<10}{entry['parameters'] / 1e6:>10.1f}{entry['file_mb']:>10.1f}"
+                    + "".join(f"{entry['latency_ms'][str(size)]:>12.1f}" for size in LATENCY_BATCH_SIZES)
+                    + f"{entry['speedup']['1']:>8.2f}x{entry['accuracy']:>10.1%}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "pruning_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prune the fine-tuned classifier for faster CPU inference")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Fine-tuned PyTorch model")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Pruned models and report")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Parquet or Arrow files of the dataset")
+    parser.add_argument("--levels", nargs="+", choices=sorted(PRUNING_LEVELS), help="Levels to build (default: all)")
+    parser.add_argument("--calibration-samples", type=int, default=512, help="Reviews used to score importance")
+    parser.add_argument("--eval-samples", type=int, default=2000, help="Reviews used for accuracy")
+    parser.add_argument("--recovery-steps", type=int, default=0, help="Fine-tuning steps after pruning")
+    args = parser.parse_args()
+
+    prune(args.model_dir, args.output_dir, args.data_dir,
+          levels={name: PRUNING_LEVELS[name] for name in args.levels} if args.levels else None,
+          calibration_samples=args.calibration_samples, eval_samples=args.eval_samples,
+          recovery_steps=args.recovery_steps)
@@ -18,89 +18,247 @@ Note: You need to:
 """
 
 import os
-import json
+import sys
+import hashlib
 import logging
-from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Tuple
 from google.cloud import aiplatform
 from google.cloud import storage
-from transformers import AutoTokenizer, AutoModelForCausalLM, TrainingArguments, Trainer
-from datasets import Dataset
+from transformers import (
+    AutoTokenizer,
+    AutoModelForCausalLM,
+    TrainingArguments,
+    Trainer,
+    DataCollatorForSeq2Seq
+)
+from datasets import Dataset, load_dataset
 import torch
 
+# Also runnable as ``python models/train_on_gcp.py``
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from data.tokenization import tokenize_cached, tokenize_grouped
+from utils.batching import TokenBudgetTrainer
+from utils.packing import PackedDataset, PackedCollator
+from utils.artifact_store import ArtifactStore, BucketBackend
+from utils.hardware import HardwareProfile
+from utils.adapters import adapter_base_model, apply_lora, is_adapter_dir, load_base_model
+from utils.memory_plan import plan_batch
+from utils.training_metrics import TrainingMetricsCallback
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class GCPTrainer:
-    def __init__(self, project_id: str, bucket_name: str, location: str = "us-central1"):
+    def __init__(self,
+                 project_id: str,
+                 bucket_name: str,
+                 location: str = "us-central1",
+                 bucket=None,
+                 upload_workers: int = 8):
+        """
+        Args:
+            project_id (str): GCP project
+            bucket_name (str): GCS bucket for training data and models
+            location (str): Vertex AI region
+            bucket: Bucket object to use instead of ``bucket_name``, e.g. a
+                ``LocalBucket`` for offline runs
+            upload_workers (int): Concurrent file uploads and hash checks
+        """
         self.project_id = project_id
         self.bucket_name = bucket_name
         self.location = location
-        self.storage_client = storage.Client(project=project_id)
-        self.bucket = self.storage_client.bucket(bucket_name)
+        if bucket is None:
+            self.storage_client = storage.Client(project=project_id)
+            bucket = self.storage_client.bucket(bucket_name)
+        self.bucket = bucket
+        # Datasets and models are stored by content hash, so unchanged files are never re-uploaded
+        self.artifacts = ArtifactStore(BucketBackend(self.bucket, prefix="artifacts", max_workers=upload_workers))
         
         # Initialize Vertex AI
         aiplatform.init(project=project_id, location=location)
         
     def upload_training_data(self, local_path: str) -> str:
-        """Upload training data to GCS bucket."""
-        blob_name = f"training_data/{datetime.now().strftime('%Y%m%d_%H%M%S')}/training_data.json"
-        blob = self.bucket.blob(blob_name)
-        blob.upload_from_filename(local_path)
-        return f"gs://{self.bucket_name}/{blob_name}"
+        """
+        Publish training data to the artifact store in the GCS bucket.
+
+        Unchanged training data is already stored and is not uploaded again.
+
+        Returns:
+            str: ``gs://`` path of the run manifest
+        """
+        manifest = self.artifacts.publish(local_path, "training_data")
+        return f"gs://{self.bucket_name}/artifacts/manifests/training_data/{manifest['run_id']}.json"
+    
+    def upload_model(self, output_dir: str, run_id: str = None) -> Dict[str, Any]:
+        """
+        Publish a saved model directory to the artifact store.
+
+        Only files whose content is not stored yet are uploaded (concurrently),
+        so re-publishing an unchanged model writes just a new manifest.
+        ``ArtifactStore.materialize`` restores a run into a directory. For an
+        adapter directory, the manifest records its base model.
+
+        Args:
+            output_dir (str): Local model directory; its name is the artifact name
+            run_id (str): Run identifier (default: a timestamp)
+
+        Returns:
+            Dict[str, Any]: The run manifest
+        """
+        metadata = {'base_model': adapter_base_model(output_dir)} if is_adapter_dir(output_dir) else None
+        return self.artifacts.publish(output_dir, os.path.basename(os.path.normpath(output_dir)),
+                                      run_id=run_id, metadata=metadata)
     
     def prepare_dataset(self, data_path: str) -> Dataset:
-        """Prepare dataset for training."""
-        with open(data_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        """
+        Prepare dataset for training.
+
+        The JSONL file (optionally .gz/.zst compressed) is converted once into
+        the datasets Arrow cache and memory-mapped, so memory use does not
+        grow with the corpus. Records keep one response body with all of its
+        instructions; they are expanded lazily by ``tokenize_grouped``. Flat
+        instruction/response files (including legacy JSON arrays) are
+        converted to single-instruction records.
+        """
+        dataset = load_dataset("json", data_files=data_path, split="train")
         
-        # Convert to Dataset format
-        dataset = Dataset.from_list([
-            {
-                "text": f"### Instruction:\n{item['instruction']}\n\n### Response:\n{item['response']}"
-            }
-            for item in data
-        ])
+        if "instructions" not in dataset.column_names:
+            def to_grouped(batch):
+                return {
+                    "id": [hashlib.sha256(response.encode("utf-8")).hexdigest()[:16]
+                           for response in batch["response"]],
+                    "response": batch["response"],
+                    "instructions": [[instruction] for instruction in batch["instruction"]]
+                }
+            
+            dataset = dataset.map(to_grouped, batched=True, remove_columns=dataset.column_names)
         
         return dataset
     
+    def load_tokenizer(self, model_id: str):
+        """Load the causal LM tokenizer, padding with EOS."""
+        tokenizer = AutoTokenizer.from_pretrained(model_id)
+        tokenizer.pad_token = tokenizer.eos_token
+        return tokenizer
+    
+    def tokenize_dataset(self, tokenizer, training_data_path: str, max_length: int = 512, packing: bool = False):
+        """
+        Tokenize the training data, reusing the tokenization cache when the
+        data, tokenizer and settings are unchanged.
+
+        Packed training keeps examples whole; they are cut into blocks later.
+        """
+        logger.info("Preparing dataset...")
+        dataset = self.prepare_dataset(training_data_path)
+        return tokenize_cached(
+            dataset,
+            tokenize_grouped,
+            tokenizer,
+            max_length=None if packing else max_length,
+            remove_columns=dataset.column_names
+        ).remove_columns(["response_id"])
+    
     def train_model(self, 
                    model_id: str = "microsoft/phi-2",
-                   training_data_path: str = "data/processed/training_data.json",
+                   training_data_path: str = "data/processed/training_data.jsonl",
                    output_dir: str = "models/finetuned_phi",
                    num_train_epochs: int = 3,
                    per_device_train_batch_size: int = 4,
                    gradient_accumulation_steps: int = 4,
                    learning_rate: float = 2e-5,
-                   max_steps: int = 1000):
-        """Train model on GCP."""
+                   max_steps: int = 1000,
+                   max_length: int = 512,
+                   max_tokens_per_batch: int = None,
+                   packing: bool = False,
+                   upload: bool = True,
+                   metrics_path: str = None,
+                   profile_steps: Tuple[int, int] = None,
+                   hardware: HardwareProfile = None,
+                   lora: bool = False,
+                   lora_rank: int = 16,
+                   lora_alpha: int = 32,
+                   lora_dropout: float = 0.05,
+                   load_in_8bit: bool = False,
+                   target_batch_size: int = None):
+        """
+        Train model on GCP.
+
+        With ``upload`` (the default) the training data is published before
+        training and the model after it; a pipeline that publishes in
+        separate stages turns it off.
+
+        Examples are padded per batch rather than to ``max_length``. When
+        ``max_tokens_per_batch`` is set, batches are length-bucketed and
+        filled up to that many padded tokens in place of
+        ``per_device_train_batch_size`` examples.
+
+        With ``packing``, examples are instead joined with EOS into full
+        blocks of ``max_length`` tokens. Long posts are split across blocks
+        rather than truncated, and attention stays within each example.
+
+        Per-step throughput, time split and peak memory are appended to
+        ``metrics_path`` (default: ``<output_dir>/metrics.jsonl``). Optimizer
+        steps in ``profile_steps`` (first, last) get a torch.profiler trace.
+
+        Device, mixed precision, threads and data-loader workers come from
+        ``hardware`` (default: detected for this machine).
+
+        With ``lora``, the base model is frozen and only low-rank adapters on
+        the attention and MLP projections are trained (``utils/adapters.py``).
+        Checkpoints, the saved model and the upload then contain just the
+        adapter. ``load_in_8bit`` also loads the frozen base in int8 (CUDA
+        with bitsandbytes only). Adapters usually need a higher
+        ``learning_rate`` than full fine-tuning, around 1e-4 to 2e-4.
+
+        With ``target_batch_size``, ``utils/memory_plan.plan_batch`` runs
+        trial steps to find the largest micro-batch of ``max_length`` tokens
+        that fits in memory. It enables gradient checkpointing only if that
+        allows a bigger, faster batch. The plan replaces
+        ``per_device_train_batch_size``, ``gradient_accumulation_steps`` and
+        (when token budgeting is on) ``max_tokens_per_batch``.
+        """
         try:
-            # Upload training data
-            logger.info("Uploading training data to GCS...")
-            gcs_data_path = self.upload_training_data(training_data_path)
+            hardware = (hardware or HardwareProfile()).apply()
             
-            # Prepare dataset
-            logger.info("Preparing dataset...")
-            dataset = self.prepare_dataset(training_data_path)
+            if upload:
+                # Upload training data
+                logger.info("Uploading training data to GCS...")
+                gcs_data_path = self.upload_training_data(training_data_path)
             
             # Load model and tokenizer
             logger.info(f"Loading model: {model_id}")
-            tokenizer = AutoTokenizer.from_pretrained(model_id)
-            model = AutoModelForCausalLM.from_pretrained(model_id)
-            
-            # Configure tokenizer
-            tokenizer.pad_token = tokenizer.eos_token
+            tokenizer = self.load_tokenizer(model_id)
+            if lora:
+                model = load_base_model(model_id, load_in_8bit=load_in_8bit, device=hardware.device)
+            else:
+                model = AutoModelForCausalLM.from_pretrained(model_id)
             model.config.pad_token_id = tokenizer.eos_token_id
+            if lora:
+                model = apply_lora(model, r=lora_rank, alpha=lora_alpha, dropout=lora_dropout)
             
-            # Tokenize dataset
-            def tokenize(example):
-                return tokenizer(
-                    example["text"],
-                    padding="max_length",
-                    truncation=True,
-                    max_length=512
-                )
+            gradient_checkpointing = False
+            if target_batch_size:
+                # bitsandbytes models are already placed on the GPU
+                if not (lora and load_in_8bit and hardware.device == "cuda"):
+                    model = hardware.prepare_model(model)
+                plan = plan_batch(model, target_batch_size, max_length, hardware)
+                per_device_train_batch_size = plan['per_device_train_batch_size']
+                gradient_accumulation_steps = plan['gradient_accumulation_steps']
+                gradient_checkpointing = plan['gradient_checkpointing']
+                if max_tokens_per_batch:
+                    max_tokens_per_batch = plan['max_tokens_per_batch']
             
-            tokenized_dataset = dataset.map(tokenize, remove_columns=["text"])
+            # Tokenize dataset, each unique response body once (cached across runs)
+            tokenized_dataset = self.tokenize_dataset(tokenizer, training_data_path, max_length, packing)
+            
+            if packing:
+                tokenized_dataset = PackedDataset(tokenized_dataset, block_size=max_length,
+                                                  eos_token_id=tokenizer.eos_token_id)
+                stats = tokenized_dataset.stats()
+                logger.info(f"Packed {stats['examples']} examples ({stats['tokens']} tokens) into "
+                            f"{stats['blocks']} blocks of {max_length} tokens ({stats['fill']:.1%} full)")
             
             # Training arguments
             training_args = TrainingArguments(
@@ -114,39 +272,59 @@ class GCPTrainer:
                 save_steps=100,
                 warmup_steps=100,
                 weight_decay=0.01,
-                fp16=True,  # Enable mixed precision training
-                report_to="none"
+                gradient_checkpointing=gradient_checkpointing,
+                # Non-reentrant checkpointing also works when the embeddings are frozen (LoRA)
+                gradient_checkpointing_kwargs={"use_reentrant": False} if gradient_checkpointing else None,
+                group_by_length=not packing,
+                # Packed blocks carry segment_ids that only the collator consumes
+                remove_unused_columns=not packing,
+                report_to="none",
+                **hardware.training_args()
             )
             
+            if packing:
+                data_collator = PackedCollator()
+            else:
+                # Pad each batch to its longest example; labels are padded with -100
+                data_collator = DataCollatorForSeq2Seq(tokenizer, label_pad_token_id=-100, pad_to_multiple_of=8)
+            
+            metrics = TrainingMetricsCallback(metrics_path or os.path.join(output_dir, "metrics.jsonl"),
+                                              profile_steps=profile_steps)
+            
             # Initialize trainer
-            trainer = Trainer(
-                model=model,
-                args=training_args,
-                train_dataset=tokenized_dataset,
-                tokenizer=tokenizer
-            )
+            if max_tokens_per_batch and not packing:
+                trainer = TokenBudgetTrainer(
+                    model=model,
+                    args=training_args,
+                    train_dataset=tokenized_dataset,
+                    data_collator=data_collator,
+                    tokenizer=tokenizer,
+                    max_tokens_per_batch=max_tokens_per_batch,
+                    callbacks=[metrics]
+                )
+            else:
+                trainer = Trainer(
+                    model=model,
+                    args=training_args,
+                    train_dataset=tokenized_dataset,
+                    data_collator=data_collator,
+                    tokenizer=tokenizer,
+                    callbacks=[metrics]
+                )
             
             # Start training
             logger.info("Starting training...")
             trainer.train()
             
-            # Save model
+            # Save model (only the adapter weights in LoRA mode)
             logger.info(f"Saving model to {output_dir}")
             trainer.save_model(output_dir)
             tokenizer.save_pretrained(output_dir)
             
-            # Upload model to GCS
-            logger.info("Uploading model to GCS...")
-            model_blob_name = f"models/{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            model_blob = self.bucket.blob(model_blob_name)
-            
-            # Upload each file in the model directory
-            for root, _, files in os.walk(output_dir):
-                for file in files:
-                    local_path = os.path.join(root, file)
-                    remote_path = os.path.join(model_blob_name, os.path.relpath(local_path, output_dir))
-                    blob = self.bucket.blob(remote_path)
-                    blob.upload_from_filename(local_path)
+            if upload:
+                # Upload model to GCS
+                logger.info("Uploading model to GCS...")
+                self.upload_model(output_dir)
             
             logger.info("Training completed successfully!")
             
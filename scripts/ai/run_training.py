@@ -3,61 +3,164 @@ Run the complete training pipeline:
 1. Process website content
 2. Train model on GCP
 3. Save and upload model
+
+The steps run as cached stages (see ``utils/pipeline.py``):
+
+    ingest -> format -> tokenize -> train -> export -> publish
+                     \\-> publish_data
+
+A stage is skipped when its inputs, settings and code are unchanged since its
+last successful run. ``publish_data`` runs alongside tokenization and
+training. After a failure, rerunning resumes from the stage that failed.
 """
 
 import os
+import json
+import time
+import shutil
+import argparse
 import logging
-from pathlib import Path
+import threading
+from typing import Any, Dict
 from dotenv import load_dotenv
 from data.content_processor import ContentProcessor
 from models.train_on_gcp import GCPTrainer
+from utils.pipeline import Pipeline, Stage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+TRAINING_DATA_PATH = "data/processed/training_data.jsonl"
+MODEL_DIR = "models/finetuned_phi"
+# Written once the trained model is saved; MODEL_DIR itself always exists (.gitkeep)
+TRAIN_STAMP = os.path.join(MODEL_DIR, "train_complete.json")
+# Final weights, config and tokenizer only; checkpoints stay in MODEL_DIR
+EXPORT_DIR = "models/export/finetuned_phi"
+
+TRAINING_CONFIG = {
+    "model_id": "microsoft/phi-2",  # You can change this to other models
+    "num_train_epochs": 3,
+    # Examples per optimizer step; the memory planner picks the micro-batch and accumulation
+    "target_batch_size": 16,
+    "learning_rate": 2e-4,  # Adapters train with a higher rate than full fine-tuning
+    "max_steps": 1000,
+    "max_length": 512,
+    "max_tokens_per_batch": 4 * 512,  # Token-budgeted batches; the planner resizes the budget
+    # Train LoRA adapters on a frozen base; checkpoints and uploads hold only the adapter
+    "lora": True,
+    "lora_rank": 16
+}
+
+def export_model(model_dir: str, export_dir: str) -> Dict[str, Any]:
+    """Copy the final model files, without checkpoints or trainer state, into ``export_dir``."""
+    if os.path.exists(export_dir):
+        shutil.rmtree(export_dir)
+    os.makedirs(export_dir)
+    files = 0
+    size = 0
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if os.path.isdir(path) or name in ("training_args.bin", os.path.basename(TRAIN_STAMP)):
+            continue
+        target = os.path.join(export_dir, name)
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copyfile(path, target)
+        files += 1
+        size += os.path.getsize(path)
+    return {'files': files, 'bytes': size}
+
+def build_pipeline(get_trainer, content_dir: str = "content") -> Pipeline:
+    """
+    Args:
+        get_trainer: Returns the shared ``GCPTrainer``; only called by stages that run
+        content_dir (str): Hugo content directory
+    """
+    processor = ContentProcessor(content_dir=content_dir)
+    collected = {}
+
+    def ingest(results):
+        # Cheap on unchanged content: the processor's manifest skips unchanged files
+        collected['content'] = processor.collect_content()
+        return {'fingerprint': processor.changes['fingerprint'], 'items': len(collected['content'])}
+
+    def format_data(results):
+        num_records, num_examples = processor.write_training_data(collected['content'], TRAINING_DATA_PATH)
+        logger.info(f"Processed {len(collected['content'])} content items into {num_examples} training examples "
+                    f"({num_records} unique responses)")
+        return {'records': num_records, 'examples': num_examples, 'corpus': results['ingest']['fingerprint']}
+
+    def publish_data(results):
+        return {'uri': get_trainer().upload_training_data(TRAINING_DATA_PATH)}
+
+    def tokenize(results):
+        trainer = get_trainer()
+        tokenizer = trainer.load_tokenizer(TRAINING_CONFIG["model_id"])
+        dataset = trainer.tokenize_dataset(tokenizer, TRAINING_DATA_PATH, TRAINING_CONFIG["max_length"])
+        return {'examples': len(dataset)}
+
+    def train(results):
+        # A run that dies part-way leaves no stamp, so the stage reruns
+        if os.path.exists(TRAIN_STAMP):
+            os.remove(TRAIN_STAMP)
+        # Reuses the tokenization cache filled by the tokenize stage
+        get_trainer().train_model(training_data_path=TRAINING_DATA_PATH, output_dir=MODEL_DIR,
+                                  upload=False, **TRAINING_CONFIG)
+        with open(TRAIN_STAMP, 'w') as f:
+            json.dump({'finished': time.strftime('%Y-%m-%dT%H:%M:%S')}, f)
+        return {'output_dir': MODEL_DIR}
+
+    def export(results):
+        return export_model(MODEL_DIR, EXPORT_DIR)
+
+    def publish(results):
+        manifest = get_trainer().upload_model(EXPORT_DIR)
+        return {'run_id': manifest['run_id'], 'uploaded_bytes': manifest['stats']['uploaded_bytes']}
+
+    return Pipeline([
+        Stage("ingest", ingest, always_run=True),
+        Stage("format", format_data, deps=["ingest"], outputs=[TRAINING_DATA_PATH]),
+        Stage("publish_data", publish_data, deps=["format"], inputs=[TRAINING_DATA_PATH]),
+        Stage("tokenize", tokenize, deps=["format"], inputs=[TRAINING_DATA_PATH],
+              params={k: TRAINING_CONFIG[k] for k in ("model_id", "max_length")}),
+        Stage("train", train, deps=["tokenize"], inputs=[TRAINING_DATA_PATH], outputs=[TRAIN_STAMP],
+              params=TRAINING_CONFIG),
+        Stage("export", export, deps=["train"], inputs=[MODEL_DIR], outputs=[EXPORT_DIR]),
+        Stage("publish", publish, deps=["export"], inputs=[EXPORT_DIR])
+    ])
+
 def main():
+    parser = argparse.ArgumentParser(description="Run the training pipeline, skipping up-to-date stages")
+    parser.add_argument("--from", dest="force_from", help="Rerun this stage and every stage after it")
+    parser.add_argument("--until", help="Stop after this stage")
+    parser.add_argument("--force", action="store_true", help="Rerun every stage")
+    parser.add_argument("--content-dir", default="content", help="Hugo content directory")
+    args = parser.parse_args()
+
     # Load environment variables
     load_dotenv()
-    
+
     # Verify GCP configuration
     project_id = os.getenv("GCP_PROJECT_ID")
     bucket_name = os.getenv("GCP_BUCKET_NAME")
-    
+
     if not project_id or not bucket_name:
         raise ValueError("GCP_PROJECT_ID and GCP_BUCKET_NAME environment variables must be set")
-    
-    # Process content
-    logger.info("Processing website content...")
-    processor = ContentProcessor()
-    content = processor.collect_content()
-    training_data = processor.format_for_training(content)
-    
-    # Save processed data
-    output_dir = Path("data/processed")
-    output_dir.mkdir(parents=True, exist_ok=True)
-    
-    import json
-    training_data_path = output_dir / "training_data.json"
-    with open(training_data_path, 'w', encoding='utf-8') as f:
-        json.dump(training_data, f, indent=2, ensure_ascii=False)
-    
-    logger.info(f"Processed {len(content)} content items into {len(training_data)} training examples")
-    
-    # Train model
-    logger.info("Starting model training on GCP...")
-    trainer = GCPTrainer(project_id=project_id, bucket_name=bucket_name)
-    trainer.train_model(
-        model_id="microsoft/phi-2",  # You can change this to other models
-        training_data_path=str(training_data_path),
-        output_dir="models/finetuned_phi",
-        num_train_epochs=3,
-        per_device_train_batch_size=4,
-        gradient_accumulation_steps=4,
-        learning_rate=2e-5,
-        max_steps=1000
-    )
-    
+
+    # Created on first use, so runs where every GCP stage is cached never connect
+    trainer = {}
+    lock = threading.Lock()
+
+    def get_trainer() -> GCPTrainer:
+        with lock:
+            if 'instance' not in trainer:
+                trainer['instance'] = GCPTrainer(project_id=project_id, bucket_name=bucket_name)
+            return trainer['instance']
+
+    build_pipeline(get_trainer, args.content_dir).run(force_from=args.force_from, until=args.until, force=args.force)
+
     logger.info("Training pipeline completed successfully!")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,122 @@
+"""
+Low-rank adapter (LoRA) fine-tuning.
+
+``apply_lora`` freezes a causal LM and adds trainable rank-``r`` updates to
+its attention and MLP projections through ``peft``. For phi-2 at r=16 that
+is about 24M parameters, under 1% of the model, and the optimizer keeps
+state for those only. ``Trainer`` checkpoints and ``save_model`` write just the
+adapter (``adapter_config.json`` and ``adapter_model.safetensors``), a few
+MB instead of the multi-GB base model.
+
+``load_base_model`` can load the frozen base in 8-bit through bitsandbytes,
+which halves its memory again. That needs CUDA; on other devices the base is
+loaded at full size with a warning.
+
+``ModelLoader`` recognizes adapter directories and loads their base model
+first; see ``models/model_loader.py``.
+"""
+
+import os
+import json
+import logging
+from typing import List, Optional, Tuple
+
+import torch
+from transformers import AutoModelForCausalLM
+
+logger = logging.getLogger(__name__)
+
+ADAPTER_CONFIG = "adapter_config.json"
+
+# Projections to adapt per architecture: attention first, then MLP
+LORA_TARGET_MODULES = {
+    "phi": ["q_proj", "k_proj", "v_proj", "dense", "fc1", "fc2"],
+    "gpt2": ["c_attn", "c_proj", "c_fc"],
+    "llama": ["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"],
+    "mistral": ["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"]
+}
+
+def is_adapter_dir(path: str) -> bool:
+    """True when ``path`` holds a saved adapter rather than a full model."""
+    return os.path.exists(os.path.join(path, ADAPTER_CONFIG)) and not os.path.exists(os.path.join(path, "config.json"))
+
+def adapter_base_model(path: str) -> Optional[str]:
+    """Base model name or path recorded in a saved adapter."""
+    with open(os.path.join(path, ADAPTER_CONFIG), 'r', encoding='utf-8') as f:
+        return json.load(f).get('base_model_name_or_path')
+
+def target_modules(model) -> List[str]:
+    """Names of the Linear projections to adapt, by architecture or by scanning the model."""
+    model_type = getattr(model.config, 'model_type', None)
+    if model_type in LORA_TARGET_MODULES:
+        return LORA_TARGET_MODULES[model_type]
+    # Unknown architecture: every Linear layer except the output head
+    output_head = model.get_output_embeddings()
+    return sorted({
+        name.rsplit('.', 1)[-1] for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and module is not output_head
+    })
+
+def load_base_model(model_id: str, load_in_8bit: bool = False, device: str = "cpu"):
+    """
+    Load the frozen base model for adapter training.
+
+    Args:
+        model_id (str): Model name or path
+        load_in_8bit (bool): Quantize the base weights to int8 with bitsandbytes (CUDA only)
+        device (str): Device training runs on
+    """
+    if load_in_8bit and device.startswith("cuda"):
+        from transformers import BitsAndBytesConfig
+        from peft import prepare_model_for_kbit_training
+
+        model = AutoModelForCausalLM.from_pretrained(
+            model_id, quantization_config=BitsAndBytesConfig(load_in_8bit=True), device_map={"": 0}
+        )
+        # Casts norms and the head to fp32 so the frozen int8 base trains stably
+        return prepare_model_for_kbit_training(model, use_gradient_checkpointing=False)
+    if load_in_8bit:
+        logger.warning(f"8-bit base weights need bitsandbytes on CUDA; loading {model_id} unquantized on {device}")
+    return AutoModelForCausalLM.from_pretrained(model_id)
+
+def apply_lora(model,
+               r: int = 16,
+               alpha: int = 32,
+               dropout: float = 0.05,
+               modules: List[str] = None):
+    """
+    Freeze ``model`` and wrap it with trainable LoRA adapters.
+
+    Args:
+        model: Causal LM to adapt
+        r (int): Rank of each update
+        alpha (int): Scaling numerator; updates are scaled by ``alpha / r``
+        dropout (float): Dropout on the adapter inputs
+        modules (List[str]): Module names to adapt (default: ``target_modules(model)``)
+
+    Returns:
+        The ``PeftModel``
+    """
+    from peft import LoraConfig, TaskType, get_peft_model
+
+    config = LoraConfig(
+        task_type=TaskType.CAUSAL_LM,
+        r=r,
+        lora_alpha=alpha,
+        lora_dropout=dropout,
+        target_modules=modules or target_modules(model)
+    )
+    model = get_peft_model(model, config)
+    trainable, total = count_parameters(model)
+    logger.info(f"LoRA r={r} on {', '.join(config.target_modules)}: "
+                f"{trainable:,} of {total:,} parameters trainable ({trainable / total:.2%})")
+    return model
+
+def count_parameters(model) -> Tuple[int, int]:
+    """Trainable and total parameter counts."""
+    trainable = total = 0
+    for param in model.parameters():
+        total += param.numel()
+        if param.requires_grad:
+            trainable += param.numel()
+    return trainable, total
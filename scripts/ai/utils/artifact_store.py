@@ -0,0 +1,342 @@
+"""
+Content-addressed store for datasets and model checkpoints.
+
+File contents are stored once as blobs named by their SHA-256. Each
+published run adds a small JSON manifest that maps the run's relative paths
+to blob hashes:
+
+    blobs/ab/abcdef...          file contents, written once
+    manifests/<name>/<run>.json {"files": {"config.json": {"sha256": ..., "size": ...}}, ...}
+    leases/<name>/<run>.json    blobs of a publish in progress
+
+Publishing a run hashes the files and uploads only the blobs the store does
+not have. Re-publishing an unchanged model therefore writes one manifest.
+``materialize`` rebuilds a run's directory by hard-linking blobs from a local
+store or cache, and falls back to copying. ``gc`` deletes blobs that no
+manifest or live lease references. A publish writes its lease before it
+checks which blobs exist, so a blob it reuses cannot be collected before its
+manifest lands; ``gc`` removes the lease once the manifest exists.
+
+``LocalBackend`` keeps the store in a directory. ``BucketBackend`` keeps it
+under a prefix of a GCS bucket (or a ``LocalBucket``) and caches downloaded
+blobs locally.
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+from utils.uploader import Uploader, file_sha256
+
+logger = logging.getLogger(__name__)
+
+def _blob_key(digest: str) -> str:
+    return f"blobs/{digest[:2]}/{digest}"
+
+class LocalBackend:
+    """Store in a local directory; blobs are read-only so hard links cannot modify them."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def has(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def put_files(self, files: Dict[str, str]):
+        """Store ``{key: local_path}``; keys already present are left alone."""
+        for key, local_path in files.items():
+            path = self.path(key)
+            if os.path.exists(path):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp-{os.getpid()}"
+            shutil.copyfile(local_path, tmp_path)
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, path)
+
+    def put_bytes(self, key: str, data: bytes):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get_bytes(self, key: str) -> bytes:
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def local_path(self, key: str) -> str:
+        """Path of a blob on the local filesystem."""
+        return self.path(key)
+
+    def list_keys(self, prefix: str) -> Iterator[str]:
+        base = self.path(prefix)
+        for root, _, files in os.walk(base):
+            for file in files:
+                if '.tmp-' not in file:
+                    yield os.path.relpath(os.path.join(root, file), self.root).replace(os.sep, '/')
+
+    def age_seconds(self, key: str) -> float:
+        return time.time() - os.path.getmtime(self.path(key))
+
+    def delete(self, key: str):
+        os.remove(self.path(key))
+
+class BucketBackend:
+    """Store under ``prefix`` in a bucket, with downloaded blobs cached in ``cache_dir``."""
+
+    def __init__(self, bucket, prefix: str = "artifacts", cache_dir: str = None, max_workers: int = 8):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+        self.cache = LocalBackend(cache_dir or os.path.join("data", "cache", "artifacts"))
+        self.max_workers = max_workers
+        # Existence was already checked, so the uploader need not compare checksums
+        self.uploader = Uploader(bucket, max_workers=max_workers, skip_unchanged=False)
+
+    def name(self, key: str) -> str:
+        return f"{self.prefix}/{key}"
+
+    def has(self, key: str) -> bool:
+        # The cache only serves reads; a cached blob may have been collected from the bucket
+        return self.bucket.get_blob(self.name(key)) is not None
+
+    def put_files(self, files: Dict[str, str]):
+        self.uploader.upload_files([(local_path, self.name(key)) for key, local_path in files.items()])
+
+    def put_bytes(self, key: str, data: bytes):
+        self.bucket.blob(self.name(key)).upload_from_string(data, content_type="application/json")
+
+    def get_bytes(self, key: str) -> bytes:
+        return self.bucket.blob(self.name(key)).download_as_bytes()
+
+    def local_path(self, key: str) -> str:
+        """Download a blob into the local cache once and return its cached path."""
+        path = self.cache.path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp-{os.getpid()}"
+            self.bucket.blob(self.name(key)).download_to_filename(tmp_path)
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, path)
+        return path
+
+    def list_keys(self, prefix: str) -> Iterator[str]:
+        for blob in self.bucket.list_blobs(prefix=self.name(prefix)):
+            yield blob.name[len(self.prefix) + 1:]
+
+    def age_seconds(self, key: str) -> float:
+        blob = self.bucket.get_blob(self.name(key))
+        if blob is None or blob.updated is None:
+            return 0.0
+        return (datetime.now(timezone.utc) - blob.updated).total_seconds()
+
+    def delete(self, key: str):
+        self.bucket.blob(self.name(key)).delete()
+        if self.cache.has(key):
+            self.cache.delete(key)
+
+class ArtifactStore:
+    def __init__(self, backend, max_workers: int = 8):
+        """
+        Args:
+            backend: ``LocalBackend`` or ``BucketBackend``
+            max_workers (int): Threads used to hash files and check for blobs
+        """
+        self.backend = backend
+        self.max_workers = max_workers
+
+    def publish(self,
+                path: str,
+                name: str,
+                run_id: str = None,
+                metadata: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Store a file or directory as run ``run_id`` of artifact ``name``.
+
+        Args:
+            path (str): File or directory to publish
+            name (str): Artifact name, e.g. 'finetuned_phi' or 'training_data'
+            run_id (str): Run identifier (default: a timestamp with microseconds)
+            metadata (Dict[str, Any]): Extra information kept in the manifest
+
+        Returns:
+            Dict[str, Any]: The manifest, with upload totals under 'stats'
+        """
+        run_id = run_id or datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        if os.path.isdir(path):
+            paths = {}
+            for root, _, names in os.walk(path):
+                for file in names:
+                    local_path = os.path.join(root, file)
+                    paths[os.path.relpath(local_path, path).replace(os.sep, '/')] = local_path
+        else:
+            paths = {os.path.basename(path): path}
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            digests = dict(zip(paths, executor.map(file_sha256, paths.values())))
+            unique = {digest: paths[relative] for relative, digest in digests.items()}
+            # Claim the blobs before looking for them, so gc keeps the ones found present
+            lease_key = f"leases/{name}/{run_id}.json"
+            self.backend.put_bytes(lease_key, json.dumps({'blobs': sorted(unique)}).encode('utf-8'))
+            present = dict(zip(unique, executor.map(lambda digest: self.backend.has(_blob_key(digest)), unique)))
+
+        missing = {_blob_key(digest): local_path for digest, local_path in unique.items() if not present[digest]}
+        if missing:
+            self.backend.put_files(missing)
+
+        files = {
+            relative: {'sha256': digests[relative], 'size': os.path.getsize(local_path)}
+            for relative, local_path in sorted(paths.items())
+        }
+        uploaded = sum(os.path.getsize(local_path) for local_path in missing.values())
+        manifest = {
+            'name': name,
+            'run_id': run_id,
+            'created': datetime.now(timezone.utc).isoformat(),
+            'files': files,
+            'metadata': metadata or {},
+            'stats': {
+                'files': len(files),
+                'bytes': sum(entry['size'] for entry in files.values()),
+                'new_blobs': len(missing),
+                'uploaded_bytes': uploaded,
+                'seconds': time.perf_counter() - start
+            }
+        }
+        # The manifest goes last, so a run is only visible once all of its blobs exist
+        self.backend.put_bytes(f"manifests/{name}/{run_id}.json", json.dumps(manifest, indent=2).encode('utf-8'))
+        # A gc that read the leases before ours was written may still have collected a reused blob
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            reused = [digest for digest in unique if present[digest]]
+            lost = [digest for digest, exists in zip(reused, executor.map(
+                lambda digest: self.backend.has(_blob_key(digest)), reused)) if not exists]
+        if lost:
+            logger.warning(f"{len(lost)} blobs were collected during the publish; uploading them again")
+            self.backend.put_files({_blob_key(digest): unique[digest] for digest in lost})
+        logger.info(
+            f"Published {name}/{run_id}: {len(files)} files ({manifest['stats']['bytes'] / 2**20:.1f} MB), "
+            f"{len(missing)} new blobs ({uploaded / 2**20:.1f} MB uploaded)"
+        )
+        return manifest
+
+    def runs(self, name: str) -> List[str]:
+        """Run IDs of an artifact, oldest first (timestamp IDs sort chronologically)."""
+        return sorted(
+            key.rsplit('/', 1)[-1][:-len('.json')]
+            for key in self.backend.list_keys(f"manifests/{name}/")
+            if key.endswith('.json')
+        )
+
+    def manifest(self, name: str, run_id: str = None) -> Dict[str, Any]:
+        """Manifest of a run; the latest run when ``run_id`` is None."""
+        if run_id is None:
+            runs = self.runs(name)
+            if not runs:
+                raise FileNotFoundError(f"No published runs of {name}")
+            run_id = runs[-1]
+        return json.loads(self.backend.get_bytes(f"manifests/{name}/{run_id}.json"))
+
+    def materialize(self, name: str, dest: str, run_id: str = None, link: bool = True) -> Dict[str, Any]:
+        """
+        Recreate a run's files under ``dest``.
+
+        Blobs are hard-linked from the local store or blob cache when
+        ``link`` is set and the filesystem allows it, and copied otherwise.
+        Linked files are read-only because they share storage with the blob.
+
+        Returns:
+            Dict[str, Any]: The manifest of the materialized run
+        """
+        manifest = self.manifest(name, run_id)
+
+        def place(item):
+            relative, entry = item
+            source = self.backend.local_path(_blob_key(entry['sha256']))
+            target = os.path.join(dest, *relative.split('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.exists(target):
+                os.remove(target)
+            if link:
+                try:
+                    os.link(source, target)
+                    return
+                except OSError:
+                    pass
+            shutil.copyfile(source, target)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(place, manifest['files'].items()))
+        logger.info(f"Materialized {name}/{manifest['run_id']} into {dest}")
+        return manifest
+
+    def gc(self,
+           keep_last: Optional[int] = None,
+           min_age_seconds: float = 3600,
+           lease_seconds: float = 86400,
+           dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Delete blobs that no manifest or publish in progress references.
+
+        Args:
+            keep_last (Optional[int]): Also delete all but the newest
+                ``keep_last`` runs of every artifact
+            min_age_seconds (float): Leave younger blobs alone
+            lease_seconds (float): Leases older than this are left by publishes
+                that failed; they protect nothing and are deleted
+            dry_run (bool): Only report what would be deleted
+
+        Returns:
+            Dict[str, Any]: Counts of deleted runs and blobs
+        """
+        names = sorted({key.split('/')[1] for key in self.backend.list_keys("manifests/")})
+        deleted_runs = []
+        if keep_last is not None:
+            for name in names:
+                for run_id in self.runs(name)[:-keep_last or None]:
+                    deleted_runs.append(f"{name}/{run_id}")
+                    if not dry_run:
+                        self.backend.delete(f"manifests/{name}/{run_id}.json")
+
+        referenced = set()
+        for name in names:
+            for run_id in self.runs(name):
+                if dry_run and f"{name}/{run_id}" in deleted_runs:
+                    continue
+                referenced.update(entry['sha256'] for entry in self.manifest(name, run_id)['files'].values())
+
+        candidates = [key for key in self.backend.list_keys("blobs/") if key.rsplit('/', 1)[-1] not in referenced]
+        # Leases are read last, so a publish that started while the manifests were read is still seen
+        for key in list(self.backend.list_keys("leases/")):
+            if not key.endswith('.json'):
+                continue
+            run = key[len('leases/'):-len('.json')]
+            if run in deleted_runs or self.backend.age_seconds(key) > lease_seconds:
+                if not dry_run:
+                    self.backend.delete(key)
+                continue
+            referenced.update(json.loads(self.backend.get_bytes(key))['blobs'])
+            # Leases of finished publishes are no longer needed once their blobs are counted
+            if not dry_run and self.backend.has(f"manifests/{run}.json"):
+                self.backend.delete(key)
+
+        deleted_blobs = 0
+        for key in candidates:
+            if key.rsplit('/', 1)[-1] in referenced or self.backend.age_seconds(key) < min_age_seconds:
+                continue
+            deleted_blobs += 1
+            if not dry_run:
+                self.backend.delete(key)
+
+        logger.info(f"{'Would delete' if dry_run else 'Deleted'} {len(deleted_runs)} runs and {deleted_blobs} unreferenced blobs")
+        return {'runs': deleted_runs, 'blobs': deleted_blobs}
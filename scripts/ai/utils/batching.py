@@ -0,0 +1,210 @@
+"""
+Length-bucketed batching with a per-batch token budget.
+
+Instead of padding every example to a fixed ``max_length`` and batching a
+fixed number of examples, ``TokenBudgetBatchSampler`` groups examples of
+similar length and fills each batch up to ``max_tokens`` padded tokens. The
+collator then pads only to the longest example in each batch. Under
+data-parallel training every worker builds the same batches from the same
+seed and takes every ``num_replicas``-th one.
+"""
+
+import random
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from torch.utils.data import DataLoader, IterableDataset, Sampler
+from transformers import Trainer
+
+logger = logging.getLogger(__name__)
+
+class TokenBudgetBatchSampler(Sampler):
+    def __init__(self,
+                 lengths: Sequence[int],
+                 max_tokens: int,
+                 max_batch_size: Optional[int] = None,
+                 shuffle: bool = True,
+                 window_size: int = 2048,
+                 seed: int = 0,
+                 num_replicas: int = 1,
+                 rank: int = 0):
+        """
+        Args:
+            lengths (Sequence[int]): Token count of every example
+            max_tokens (int): Budget of padded tokens (longest length x batch size) per batch
+            max_batch_size (Optional[int]): Upper bound on examples per batch
+            shuffle (bool): Randomize which examples share a window and the batch order
+            window_size (int): Examples are sorted by length within windows of this
+                size, trading padding efficiency against randomness
+            seed (int): Base seed; each epoch uses ``seed + epoch``
+            num_replicas (int): Data-parallel workers sharing the batches
+            rank (int): This worker's index among them
+        """
+        self.lengths = list(lengths)
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.window_size = window_size if shuffle else len(self.lengths)
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self._batches = None
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+        self._batches = None
+
+    def batches(self) -> List[List[int]]:
+        """The batches (lists of example indices) for the current epoch."""
+        if self._batches is None:
+            self._batches = self._build_batches()
+        return self._batches
+
+    def _build_batches(self) -> List[List[int]]:
+        rng = random.Random(self.seed + self.epoch)
+        order = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(order)
+
+        batches = []
+        for start in range(0, len(order), max(1, self.window_size)):
+            window = sorted(order[start:start + self.window_size], key=self.lengths.__getitem__)
+            batch, longest = [], 0
+            for index in window:
+                length = self.lengths[index]
+                candidate = max(longest, length)
+                full = self.max_batch_size is not None and len(batch) >= self.max_batch_size
+                if batch and (full or candidate * (len(batch) + 1) > self.max_tokens):
+                    batches.append(batch)
+                    batch, candidate = [], length
+                batch.append(index)
+                longest = candidate
+            if batch:
+                batches.append(batch)
+
+        if self.shuffle:
+            rng.shuffle(batches)
+        if self.num_replicas > 1:
+            # Every worker must run the same number of steps, so repeat batches to even the shards
+            missing = -len(batches) % self.num_replicas
+            batches += (batches * self.num_replicas)[:missing]
+            batches = batches[self.rank::self.num_replicas]
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self.batches()
+        # Advance so the next pass reshuffles even if set_epoch is never called
+        self.set_epoch(self.epoch + 1)
+        return iter(batches)
+
+    def __len__(self) -> int:
+        return len(self.batches())
+
+def padding_efficiency(lengths: Sequence[int], batches: List[List[int]]) -> Dict[str, Any]:
+    """
+    Compare real tokens against the padded tokens a set of batches will compute on.
+
+    Returns:
+        Dict[str, Any]: ``real_tokens``, ``padded_tokens``, ``efficiency`` (0-1)
+        and ``num_batches``
+    """
+    real = sum(lengths[i] for batch in batches for i in batch)
+    padded = sum(max(lengths[i] for i in batch) * len(batch) for batch in batches)
+    return {
+        'real_tokens': real,
+        'padded_tokens': padded,
+        'efficiency': real / padded if padded else 1.0,
+        'num_batches': len(batches)
+    }
+
+def example_lengths(dataset) -> List[int]:
+    """Token count per example, from a ``length`` column if tokenization added one."""
+    if "length" in dataset.column_names:
+        return dataset["length"]
+    return dataset.map(
+        lambda batch: {"length": [len(ids) for ids in batch["input_ids"]]},
+        batched=True,
+        remove_columns=dataset.column_names
+    )["length"]
+
+class TokenBudgetTrainer(Trainer):
+    """
+    ``Trainer`` whose training batches are length-bucketed and sized by a token budget.
+
+    ``per_device_train_batch_size`` is ignored for training; use
+    ``max_tokens_per_batch`` (and optionally ``max_batch_size``) instead. The
+    data collator must pad dynamically. Under data-parallel training each worker
+    loads only its shard of the batches.
+
+    Streaming (iterable) training datasets have no lengths to bucket by. They
+    get batches of ``per_device_train_batch_size`` examples, still padded per
+    batch, and must shard themselves between workers.
+    """
+
+    def __init__(self, *args, max_tokens_per_batch: int, max_batch_size: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.max_batch_size = max_batch_size
+
+    def _token_budget_dataloader(self, dataset, shuffle: bool, description: str) -> DataLoader:
+        lengths = example_lengths(dataset)
+        dataset = self._remove_unused_columns(dataset, description=description)
+        batch_sampler = TokenBudgetBatchSampler(
+            lengths,
+            max_tokens=self.max_tokens_per_batch,
+            max_batch_size=self.max_batch_size,
+            shuffle=shuffle,
+            seed=self.args.seed,
+            num_replicas=self.args.world_size,
+            rank=self.args.process_index
+        )
+
+        report = padding_efficiency(lengths, batch_sampler.batches())
+        logger.info(
+            f"{description.capitalize()} batches: {report['num_batches']} with <= "
+            f"{self.max_tokens_per_batch} tokens each, padding efficiency "
+            f"{report['efficiency']:.1%} ({report['real_tokens']} real / "
+            f"{report['padded_tokens']} padded tokens)"
+        )
+
+        dataloader = DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory
+        )
+        if self.args.world_size > 1:
+            # Already sharded; accelerate would shard again and needs fixed-size batches to do it
+            return dataloader
+        return self.accelerator.prepare(dataloader)
+
+    def _streaming_dataloader(self, dataset: IterableDataset) -> DataLoader:
+        dataloader = DataLoader(
+            dataset,
+            batch_size=self.args.per_device_train_batch_size,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+            persistent_workers=self.args.dataloader_num_workers > 0
+        )
+        if self.args.world_size > 1:
+            # The dataset reads only its own rank's share
+            return dataloader
+        return self.accelerator.prepare(dataloader)
+
+    def get_train_dataloader(self) -> DataLoader:
+        if self.train_dataset is None:
+            raise ValueError("Trainer: training requires a train_dataset.")
+        if isinstance(self.train_dataset, IterableDataset):
+            return self._streaming_dataloader(self.train_dataset)
+        return self._token_budget_dataloader(self.train_dataset, shuffle=True, description="training")
+
+    def get_eval_dataloader(self, eval_dataset=None) -> DataLoader:
+        if isinstance(eval_dataset, str):
+            eval_dataset = self.eval_dataset[eval_dataset]
+        eval_dataset = eval_dataset if eval_dataset is not None else self.eval_dataset
+        if eval_dataset is None:
+            raise ValueError("Trainer: evaluation requires an eval_dataset.")
+        return self._token_budget_dataloader(eval_dataset, shuffle=False, description="evaluation")
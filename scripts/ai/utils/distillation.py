@@ -0,0 +1,359 @@
+"""
+Knowledge distillation from a causal LM teacher into a smaller student.
+
+``build_logit_cache`` runs the teacher once over the tokenized training data.
+For every position, it stores the teacher's top-k next-token log-probabilities
+in memory-mapped numpy files: token IDs as uint16 (int32 for vocabularies
+over 65536 entries) and log-probabilities as fp16. At k=32 that is 128 bytes
+per token, where phi-2's full distribution over 51200 tokens would take 200 KB
+in fp32. The teacher's per-example loss is stored too, so the quality gap can
+be reported without the teacher. The cache key covers the teacher's files, the
+tokenized data and k, so repeated student runs never run the teacher again.
+
+``DistillationTrainer`` trains the student on
+
+    alpha * T^2 * KL(teacher || student) + (1 - alpha) * CE(labels)
+
+The KL term covers the teacher's top-k tokens, with the teacher's
+distribution renormalized over them at temperature T.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset as TorchDataset
+from transformers import Trainer
+
+from data.tokenization import dataset_fingerprint
+from utils.batching import TokenBudgetBatchSampler, example_lengths
+from utils.hardware import HardwareProfile
+
+logger = logging.getLogger(__name__)
+
+TEACHER_LOGITS_CACHE_DIR = os.getenv("TEACHER_LOGITS_CACHE_DIR", os.path.join("data", "cache", "teacher_logits"))
+
+# Bumped when the cache layout changes
+CACHE_FORMAT = 1
+
+def directory_fingerprint(path: str) -> str:
+    """Identity of a model directory from its files' names, sizes and mtimes (checkpoints excluded)."""
+    files = sorted(
+        (entry.name, entry.stat().st_size, int(entry.stat().st_mtime))
+        for entry in Path(path).iterdir() if entry.is_file()
+    )
+    return hashlib.sha256(json.dumps(files).encode('utf-8')).hexdigest()
+
+def logit_cache_path(teacher_fingerprint: str, dataset, top_k: int, cache_dir: str = None) -> str:
+    """Cache directory for a teacher, tokenized dataset and k."""
+    key = hashlib.sha256(json.dumps({
+        'teacher': teacher_fingerprint,
+        'data': dataset_fingerprint(dataset),
+        'top_k': top_k,
+        'format': CACHE_FORMAT
+    }, sort_keys=True).encode('utf-8')).hexdigest()[:24]
+    return os.path.join(cache_dir or TEACHER_LOGITS_CACHE_DIR, key)
+
+class LogitCache:
+    """Read access to a teacher logit cache written by ``build_logit_cache``."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.indices = np.load(os.path.join(path, "indices.npy"), mmap_mode="r")
+        self.logprobs = np.load(os.path.join(path, "logprobs.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.nll = np.load(os.path.join(path, "nll.npy"))
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, "meta.json"))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def top_k(self) -> int:
+        return self.meta['top_k']
+
+    def example(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k token IDs and log-probabilities for each next-token position of an example."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.indices[start:end], self.logprobs[start:end]
+
+    def nbytes(self) -> int:
+        return sum(path.stat().st_size for path in Path(self.path).iterdir())
+
+    def update_meta(self, **values):
+        """Add values (e.g. a teacher benchmark) to the cache's metadata."""
+        self.meta.update(values)
+        tmp_path = os.path.join(self.path, f"meta.json.tmp-{os.getpid()}")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, "meta.json"))
+
+def build_logit_cache(teacher,
+                      dataset,
+                      path: str,
+                      top_k: int = 32,
+                      max_tokens: int = 4096,
+                      hardware: HardwareProfile = None) -> LogitCache:
+    """
+    Run the teacher over ``dataset`` and store its top-k next-token log-probabilities at ``path``.
+
+    Args:
+        teacher: Causal LM, already on its device
+        dataset: Tokenized dataset with ``input_ids`` (and ideally ``length``)
+        path (str): Cache directory, from ``logit_cache_path``
+        top_k (int): Tokens kept per position
+        max_tokens (int): Padded tokens per teacher forward pass; the logits
+            take ``max_tokens x vocab_size`` floats
+        hardware (HardwareProfile): Autocast settings (default: detected)
+
+    Returns:
+        LogitCache: The written cache
+    """
+    hardware = hardware or HardwareProfile()
+    lengths = example_lengths(dataset)
+    positions = np.array([max(length - 1, 0) for length in lengths], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(positions)])
+    vocab_size = teacher.config.vocab_size
+    index_dtype = np.uint16 if vocab_size <= 2**16 else np.int32
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    indices = np.lib.format.open_memmap(os.path.join(tmp_path, "indices.npy"), mode="w+",
+                                        dtype=index_dtype, shape=(int(offsets[-1]), top_k))
+    logprobs = np.lib.format.open_memmap(os.path.join(tmp_path, "logprobs.npy"), mode="w+",
+                                         dtype=np.float16, shape=(int(offsets[-1]), top_k))
+    nll = np.zeros(len(lengths), dtype=np.float32)
+
+    # Length-sorted batches keep padding, and so wasted teacher compute, low
+    batches = TokenBudgetBatchSampler(lengths, max_tokens=max_tokens, shuffle=False).batches()
+    device = next(teacher.parameters()).device
+    teacher.eval()
+    start = time.perf_counter()
+    logger.info(f"Caching top-{top_k} teacher log-probs for {len(lengths)} examples "
+                f"({int(offsets[-1])} positions) in {len(batches)} batches")
+    for number, batch in enumerate(batches, 1):
+        rows = [dataset[i]["input_ids"] for i in batch]
+        longest = max(len(row) for row in rows)
+        input_ids = torch.zeros((len(rows), longest), dtype=torch.long)
+        attention_mask = torch.zeros((len(rows), longest), dtype=torch.long)
+        for j, row in enumerate(rows):
+            input_ids[j, :len(row)] = torch.tensor(row)
+            attention_mask[j, :len(row)] = 1
+
+        with torch.no_grad(), hardware.autocast():
+            logits = teacher(input_ids=input_ids.to(device), attention_mask=attention_mask.to(device)).logits
+        with torch.no_grad():
+            for j, index in enumerate(batch):
+                count = int(positions[index])
+                if count == 0:
+                    continue
+                # One example at a time: fp32 log-softmax over the vocabulary is the largest tensor here
+                row_logprobs = torch.log_softmax(logits[j, :count].float(), dim=-1)
+                top = row_logprobs.topk(top_k, dim=-1)
+                targets = input_ids[j, 1:count + 1].to(device)
+                begin = int(offsets[index])
+                indices[begin:begin + count] = top.indices.cpu().numpy().astype(index_dtype)
+                logprobs[begin:begin + count] = top.values.cpu().numpy().astype(np.float16)
+                nll[index] = -row_logprobs.gather(-1, targets.unsqueeze(-1)).sum().item()
+        if number % 50 == 0:
+            logger.info(f"Cached {number}/{len(batches)} teacher batches")
+
+    seconds = time.perf_counter() - start
+    indices.flush()
+    logprobs.flush()
+    del indices, logprobs
+    np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+    np.save(os.path.join(tmp_path, "nll.npy"), nll)
+    with open(os.path.join(tmp_path, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump({
+            'top_k': top_k,
+            'vocab_size': vocab_size,
+            'examples': len(lengths),
+            'positions': int(offsets[-1]),
+            'teacher_seconds': seconds,
+            'teacher_tokens_per_s': int(offsets[-1]) / seconds if seconds else 0.0
+        }, f, indent=2)
+
+    # Rename into place so an interrupted run never leaves a partial cache
+    if os.path.exists(path):
+        shutil.rmtree(tmp_path)
+    else:
+        os.replace(tmp_path, path)
+    cache = LogitCache(path)
+    logger.info(f"Teacher logits cached in {seconds:.0f}s: {cache.nbytes() / 2**20:.1f} MB at {path}")
+    return cache
+
+class DistillationDataset(TorchDataset):
+    """Tokenized examples paired with their cached teacher log-probabilities."""
+
+    def __init__(self, dataset, cache: LogitCache, indices: Optional[Sequence[int]] = None):
+        """
+        Args:
+            dataset: Tokenized dataset the cache was built from
+            cache (LogitCache): The teacher's cache for ``dataset``
+            indices (Optional[Sequence[int]]): Subset of examples (default: all)
+        """
+        if len(cache) != len(dataset):
+            raise ValueError(f"Logit cache has {len(cache)} examples, dataset {len(dataset)}")
+        self.dataset = dataset
+        self.cache = cache
+        self.indices = list(indices) if indices is not None else list(range(len(dataset)))
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, position: int) -> Dict[str, Any]:
+        index = self.indices[position]
+        row = self.dataset[index]
+        teacher_indices, teacher_logprobs = self.cache.example(index)
+        return {
+            'input_ids': row['input_ids'],
+            'labels': row.get('labels', row['input_ids']),
+            'teacher_indices': teacher_indices,
+            'teacher_logprobs': teacher_logprobs
+        }
+
+class DistillationCollator:
+    """Pad token IDs, labels (with -100) and teacher log-probs to the longest example."""
+
+    def __init__(self, pad_token_id: int, pad_to_multiple_of: int = 8):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        longest = max(len(feature['input_ids']) for feature in features)
+        if self.pad_to_multiple_of:
+            longest = -(-longest // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        top_k = features[0]['teacher_indices'].shape[-1]
+
+        batch = {
+            'input_ids': torch.full((len(features), longest), self.pad_token_id, dtype=torch.long),
+            'attention_mask': torch.zeros((len(features), longest), dtype=torch.long),
+            'labels': torch.full((len(features), longest), -100, dtype=torch.long),
+            # Position t holds the teacher's distribution over token t + 1
+            'teacher_indices': torch.zeros((len(features), longest - 1, top_k), dtype=torch.long),
+            'teacher_logprobs': torch.zeros((len(features), longest - 1, top_k), dtype=torch.float32)
+        }
+        for i, feature in enumerate(features):
+            length = len(feature['input_ids'])
+            batch['input_ids'][i, :length] = torch.tensor(feature['input_ids'])
+            batch['attention_mask'][i, :length] = 1
+            batch['labels'][i, :length] = torch.tensor(feature['labels'])
+            positions = len(feature['teacher_indices'])
+            batch['teacher_indices'][i, :positions] = torch.from_numpy(feature['teacher_indices'].astype(np.int64))
+            batch['teacher_logprobs'][i, :positions] = torch.from_numpy(feature['teacher_logprobs'].astype(np.float32))
+        return batch
+
+def distillation_loss(logits: torch.Tensor,
+                      labels: torch.Tensor,
+                      teacher_indices: torch.Tensor,
+                      teacher_logprobs: torch.Tensor,
+                      alpha: float = 0.5,
+                      temperature: float = 2.0) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Blend of the KL to the teacher's top-k distribution and the label cross-entropy.
+
+    Args:
+        logits (torch.Tensor): Student logits, (batch, seq, vocab)
+        labels (torch.Tensor): Token labels with -100 for ignored positions, (batch, seq)
+        teacher_indices (torch.Tensor): Teacher top-k token IDs, (batch, seq - 1, k)
+        teacher_logprobs (torch.Tensor): Teacher top-k log-probabilities, (batch, seq - 1, k)
+        alpha (float): Weight of the KL term; 1 - alpha weighs the cross-entropy
+        temperature (float): Softening applied to both distributions in the KL term
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor, torch.Tensor]: Loss, cross-entropy and KL,
+        each a mean over the predicted tokens
+    """
+    targets = labels[:, 1:]
+    mask = targets != -100
+    logits = logits[:, :-1][mask].float()
+
+    ce = F.cross_entropy(logits, targets[mask])
+    teacher = torch.softmax(teacher_logprobs[mask] / temperature, dim=-1)
+    student = torch.log_softmax(logits / temperature, dim=-1).gather(-1, teacher_indices[mask])
+    kl = (teacher * (torch.log(teacher.clamp_min(1e-9)) - student)).sum(-1).mean()
+    # T^2 keeps the KL gradients on the same scale as the cross-entropy's
+    loss = alpha * temperature ** 2 * kl + (1 - alpha) * ce
+    return loss, ce, kl
+
+class DistillationTrainer(Trainer):
+    """``Trainer`` for a student on ``DistillationDataset`` batches (use ``remove_unused_columns=False``)."""
+
+    def __init__(self, *args, alpha: float = 0.5, temperature: float = 2.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.alpha = alpha
+        self.temperature = temperature
+        # The loss is a per-token mean, so Trainer must scale it for gradient accumulation itself
+        self.model_accepts_loss_kwargs = False
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        teacher_indices = inputs.pop("teacher_indices")
+        teacher_logprobs = inputs.pop("teacher_logprobs")
+        labels = inputs.pop("labels")
+        outputs = model(**inputs)
+        loss, _, _ = distillation_loss(outputs.logits, labels, teacher_indices, teacher_logprobs,
+                                       self.alpha, self.temperature)
+        return (loss, outputs) if return_outputs else loss
+
+def evaluate_distillation(model,
+                          dataset: DistillationDataset,
+                          collator: DistillationCollator,
+                          batch_size: int = 8,
+                          hardware: HardwareProfile = None) -> Dict[str, float]:
+    """
+    Compare the student with the cached teacher on held-out examples.
+
+    Returns:
+        Dict[str, float]: Per-token cross-entropy and perplexity of both models,
+        the student's KL to the teacher's top-k distribution (at T=1) and how
+        often its top token matches the teacher's
+    """
+    hardware = hardware or HardwareProfile()
+    device = next(model.parameters()).device
+    model.eval()
+    totals = {'ce': 0.0, 'kl': 0.0, 'agree': 0, 'tokens': 0}
+    with torch.no_grad():
+        for start in range(0, len(dataset), batch_size):
+            batch = collator([dataset[i] for i in range(start, min(start + batch_size, len(dataset)))])
+            batch = {key: value.to(device) for key, value in batch.items()}
+            with hardware.autocast():
+                logits = model(input_ids=batch['input_ids'], attention_mask=batch['attention_mask']).logits
+            _, ce, kl = distillation_loss(logits, batch['labels'], batch['teacher_indices'],
+                                          batch['teacher_logprobs'], alpha=1.0, temperature=1.0)
+            mask = batch['labels'][:, 1:] != -100
+            tokens = int(mask.sum())
+            predictions = logits[:, :-1].argmax(-1)
+            totals['ce'] += ce.item() * tokens
+            totals['kl'] += kl.item() * tokens
+            # The cache keeps the teacher's top tokens in descending order
+            totals['agree'] += int((predictions == batch['teacher_indices'][..., 0])[mask].sum())
+            totals['tokens'] += tokens
+
+    teacher_nll = sum(float(dataset.cache.nll[i]) for i in dataset.indices)
+    teacher_tokens = sum(int(dataset.cache.offsets[i + 1] - dataset.cache.offsets[i]) for i in dataset.indices)
+    tokens = max(totals['tokens'], 1)
+    student_ce = totals['ce'] / tokens
+    teacher_ce = teacher_nll / max(teacher_tokens, 1)
+    return {
+        'tokens': totals['tokens'],
+        'student_ce': student_ce,
+        'student_perplexity': float(np.exp(student_ce)),
+        'teacher_ce': teacher_ce,
+        'teacher_perplexity': float(np.exp(teacher_ce)),
+        'kl_to_teacher': totals['kl'] / tokens,
+        'top1_agreement': totals['agree'] / tokens
+    }
@@ -0,0 +1,172 @@
+"""
+Data-parallel training on CPU hosts with ``torch.distributed`` and gloo.
+
+Each worker process trains a full replica of the model on its own shard of
+the batches, and DDP all-reduces the gradients after every backward pass.
+Workers are started by ``utils/launch.py`` (or ``torchrun``). They find each
+other through the standard environment variables: ``RANK``, ``WORLD_SIZE``,
+``LOCAL_RANK``, ``LOCAL_WORLD_SIZE``, ``MASTER_ADDR`` and ``MASTER_PORT``.
+
+The launcher gives every worker on a host its own set of physical cores,
+taken from one NUMA node where possible, in ``WORKER_CPUS``.
+``init_distributed`` pins the process to those cores before torch starts its
+thread pools, so ``HardwareProfile`` sizes its threads to the worker's share
+of the machine.
+"""
+
+import os
+import glob
+import logging
+import contextlib
+from datetime import timedelta
+from typing import Any, Dict, List, Tuple
+
+import torch.distributed as dist
+
+from utils.hardware import available_cpus
+
+logger = logging.getLogger(__name__)
+
+BACKEND = "gloo"
+
+def rank() -> int:
+    return int(os.getenv("RANK", 0))
+
+def world_size() -> int:
+    return int(os.getenv("WORLD_SIZE", 1))
+
+def local_rank() -> int:
+    return int(os.getenv("LOCAL_RANK", 0))
+
+def local_world_size() -> int:
+    return int(os.getenv("LOCAL_WORLD_SIZE", world_size()))
+
+def is_distributed() -> bool:
+    return world_size() > 1
+
+def is_main_process() -> bool:
+    return rank() == 0
+
+def is_local_main_process() -> bool:
+    return local_rank() == 0
+
+def parse_cpulist(value: str) -> List[int]:
+    """Parse a kernel CPU list such as '0-3,8,10-11'."""
+    cpus = []
+    for part in value.strip().split(','):
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        cpus.extend(range(int(start), int(end or start) + 1))
+    return cpus
+
+def format_cpulist(cpus: List[int]) -> str:
+    """Inverse of ``parse_cpulist``."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
+
+def numa_nodes() -> Dict[int, List[int]]:
+    """Available CPUs per NUMA node; a single node 0 where the topology is unknown."""
+    cpus = available_cpus()
+    nodes = {}
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        node = int(os.path.basename(os.path.dirname(path))[4:])
+        with open(path, "r") as f:
+            node_cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in cpus]
+        if node_cpus:
+            nodes[node] = node_cpus
+    return nodes or {0: sorted(cpus)}
+
+def _core_groups(cpus: List[int]) -> List[List[int]]:
+    """CPUs grouped by physical core (hyperthread siblings together), in CPU order."""
+    groups = {}
+    for cpu in cpus:
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list", "r") as f:
+                key = f.read().strip()
+        except OSError:
+            key = str(cpu)
+        groups.setdefault(key, []).append(cpu)
+    return sorted(groups.values())
+
+def worker_cpu_sets(workers: int) -> List[Tuple[int, List[int], int]]:
+    """
+    Split this host's physical cores into one contiguous set per worker.
+
+    Cores are ordered node by node, so with as many workers as nodes (or a
+    multiple of it) every set lies within one NUMA node.
+
+    Returns:
+        List[Tuple[int, List[int], int]]: The NUMA node holding most of each
+        set, its CPUs and its number of physical cores
+    """
+    cores = [(node, group) for node, cpus in numa_nodes().items() for group in _core_groups(cpus)]
+    if workers > len(cores):
+        raise ValueError(f"{workers} workers need at least as many physical cores; {len(cores)} available")
+
+    sets = []
+    for worker in range(workers):
+        share = cores[worker * len(cores) // workers:(worker + 1) * len(cores) // workers]
+        nodes = [node for node, _ in share]
+        cpus = [cpu for _, group in share for cpu in group]
+        sets.append((max(set(nodes), key=nodes.count), cpus, len(share)))
+    return sets
+
+def pin_worker():
+    """Restrict this process to the CPUs the launcher assigned it in ``WORKER_CPUS``."""
+    value = os.getenv("WORKER_CPUS")
+    if not value or not hasattr(os, "sched_setaffinity"):
+        return
+    os.sched_setaffinity(0, parse_cpulist(value))
+
+def init_distributed(timeout_minutes: int = 60) -> bool:
+    """
+    Pin this worker and join the process group, when started as one of several workers.
+
+    Call before building a ``HardwareProfile`` so its thread count follows the
+    pinned cores.
+
+    Returns:
+        bool: Whether training is distributed
+    """
+    pin_worker()
+    if not is_distributed():
+        return False
+    if not dist.is_initialized():
+        dist.init_process_group(backend=BACKEND, timeout=timedelta(minutes=timeout_minutes))
+        logger.info(f"Worker {rank()}/{world_size()} joined via {os.getenv('MASTER_ADDR')}:"
+                    f"{os.getenv('MASTER_PORT')} on CPUs {format_cpulist(sorted(available_cpus()))}")
+    return True
+
+def barrier():
+    if dist.is_available() and dist.is_initialized():
+        dist.barrier()
+
+@contextlib.contextmanager
+def local_main_process_first():
+    """
+    Run the block on each host's first worker first, e.g. to fill that host's
+    cache the other workers then read. The hosts go ahead at the same time.
+    """
+    if not is_local_main_process():
+        barrier()
+    yield
+    if is_local_main_process():
+        barrier()
+
+def broadcast_object(obj: Any) -> Any:
+    """Rank 0's ``obj`` on every worker."""
+    if not (dist.is_available() and dist.is_initialized()):
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=0)
+    return objects[0]
+
+def cleanup_distributed():
+    if dist.is_available() and dist.is_initialized():
+        dist.destroy_process_group()
@@ -0,0 +1,189 @@
+"""
+Hardware profile shared by the training scripts.
+
+``HardwareProfile`` detects the device and picks the matching settings:
+
+- precision: bf16 autocast on GPUs that support it, fp16 on older GPUs, and
+  fp32 on Apple MPS. On CPUs, bf16 is used only when the CPU has native bf16
+  instructions (AVX512-BF16 or AMX). Elsewhere bf16 is emulated and slower
+  than fp32, and CPU fp16 autocast is slower than fp32 everywhere.
+- threads: one intra-op thread per physical core in the process's CPU
+  affinity, because hyperthread siblings share the matrix units. Inter-op
+  threads are set to 1 on CPU, since a transformer's ops run one after another.
+- data-loader workers: none on small CPU hosts, where collating pre-tokenized
+  batches is cheap and workers would take cores from the math. GPU hosts get
+  a few workers with pinned memory.
+- optional ``torch.compile``, and channels-last for convolutional models.
+
+``training_args()`` returns the matching ``TrainingArguments`` keywords. Each
+setting can be overridden by a constructor argument or by one of the
+environment variables ``TRAIN_DEVICE``, ``TRAIN_PRECISION``, ``TRAIN_THREADS``,
+``TRAIN_DATALOADER_WORKERS`` and ``TRAIN_COMPILE``.
+"""
+
+import os
+import logging
+import contextlib
+from typing import Any, Dict, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("bf16", "fp16", "fp32")
+
+AUTOCAST_DTYPES = {
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16
+}
+
+def available_cpus() -> set:
+    """CPUs this process may run on (its affinity mask where supported)."""
+    try:
+        return os.sched_getaffinity(0)
+    except AttributeError:
+        return set(range(os.cpu_count() or 1))
+
+def physical_cores() -> int:
+    """Physical cores among the available CPUs, counting hyperthread siblings once."""
+    cpus = available_cpus()
+    cores = set()
+    for cpu in cpus:
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list", "r") as f:
+                cores.add(f.read().strip())
+        except OSError:
+            # No topology information (not Linux); assume no hyperthreading
+            return len(cpus)
+    return len(cores) or len(cpus)
+
+def cpu_flags() -> set:
+    """Feature flags from /proc/cpuinfo (empty where unavailable)."""
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+def cpu_supports_bf16() -> bool:
+    """True when the CPU has native bf16 matrix instructions."""
+    return bool(cpu_flags() & {"avx512_bf16", "amx_bf16"})
+
+def _env_flag(name: str) -> Optional[bool]:
+    value = os.getenv(name)
+    if value is None:
+        return None
+    return value.lower() in ("1", "true", "yes", "on")
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+class HardwareProfile:
+    def __init__(self,
+                 device: str = None,
+                 precision: str = None,
+                 threads: int = None,
+                 interop_threads: int = None,
+                 dataloader_workers: int = None,
+                 compile: bool = None,
+                 channels_last: bool = False):
+        """
+        Args:
+            device (str): 'cuda', 'mps' or 'cpu' (default: ``TRAIN_DEVICE``, else detected)
+            precision (str): 'bf16', 'fp16' or 'fp32' (default: ``TRAIN_PRECISION``,
+                else the fastest the device supports)
+            threads (int): Intra-op threads (default: ``TRAIN_THREADS``, else physical cores)
+            interop_threads (int): Inter-op threads (default: 1 on CPU, torch's default otherwise)
+            dataloader_workers (int): Data-loader processes (default: ``TRAIN_DATALOADER_WORKERS``,
+                else chosen for the device)
+            compile (bool): Train with ``torch.compile`` (default: ``TRAIN_COMPILE``, else off)
+            channels_last (bool): Store 4D weights channels-last in ``prepare_model``;
+                only helps convolutional models
+        """
+        self.device = device or os.getenv("TRAIN_DEVICE") or self.detect_device()
+        self.precision = precision or os.getenv("TRAIN_PRECISION") or self.detect_precision(self.device)
+        if self.precision not in PRECISIONS:
+            raise ValueError(f"Unsupported precision: {self.precision}")
+        if self.precision == "fp16" and self.device == "cpu":
+            logger.warning("fp16 autocast on CPU is slower than fp32; consider bf16 or fp32")
+
+        cores = physical_cores()
+        self.threads = threads or _env_int("TRAIN_THREADS") or cores
+        self.interop_threads = interop_threads or (1 if self.device == "cpu" else None)
+        if dataloader_workers is None:
+            dataloader_workers = _env_int("TRAIN_DATALOADER_WORKERS")
+        if dataloader_workers is None:
+            if self.device == "cpu":
+                dataloader_workers = 0 if cores < 8 else 2
+            else:
+                dataloader_workers = min(4, max(1, cores // 2))
+        self.dataloader_workers = dataloader_workers
+        self.compile = compile if compile is not None else bool(_env_flag("TRAIN_COMPILE"))
+        self.channels_last = channels_last
+
+    @staticmethod
+    def detect_device() -> str:
+        if torch.cuda.is_available():
+            return "cuda"
+        if getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+            return "mps"
+        return "cpu"
+
+    @staticmethod
+    def detect_precision(device: str) -> str:
+        if device == "cuda":
+            return "bf16" if torch.cuda.is_bf16_supported() else "fp16"
+        if device == "cpu" and cpu_supports_bf16():
+            return "bf16"
+        return "fp32"
+
+    def apply(self) -> "HardwareProfile":
+        """Set torch's thread pools and matmul options for this profile; returns self."""
+        torch.set_num_threads(self.threads)
+        if self.interop_threads:
+            try:
+                torch.set_num_interop_threads(self.interop_threads)
+            except RuntimeError:
+                # Only allowed before the first parallel op; keep the current setting
+                logger.debug("Inter-op threads already started; leaving them unchanged")
+        if self.device == "cuda":
+            # TF32 matmuls for the fp32 parts (optimizer, norms) on Ampere and newer
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.allow_tf32 = True
+        logger.info(f"Hardware profile: {self.describe()}")
+        return self
+
+    def describe(self) -> str:
+        return (f"device={self.device} precision={self.precision} threads={self.threads} "
+                f"interop_threads={self.interop_threads or 'default'} "
+                f"dataloader_workers={self.dataloader_workers} compile={self.compile}")
+
+    def training_args(self) -> Dict[str, Any]:
+        """``TrainingArguments`` keywords for this profile."""
+        return {
+            'use_cpu': self.device == "cpu",
+            'bf16': self.precision == "bf16",
+            'fp16': self.precision == "fp16",
+            'dataloader_num_workers': self.dataloader_workers,
+            'dataloader_pin_memory': self.device == "cuda",
+            'dataloader_persistent_workers': self.dataloader_workers > 0,
+            'torch_compile': self.compile
+        }
+
+    def prepare_model(self, model):
+        """Move a model to the device (and channels-last when enabled) for manual loops."""
+        model = model.to(self.device)
+        if self.channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        return model
+
+    def autocast(self):
+        """Autocast context for manual training or inference loops."""
+        dtype = AUTOCAST_DTYPES.get(self.precision)
+        if dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device, dtype=dtype)
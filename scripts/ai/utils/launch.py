@@ -0,0 +1,209 @@
+"""
+Launch data-parallel training workers on CPU hosts.
+
+Starts ``--nproc`` copies of a training module on this host, each pinned to
+its own set of physical cores (``utils/distributed.worker_cpu_sets``). When
+``numactl`` is installed, each worker's memory is also bound to the NUMA node
+of its cores. For several hosts, run the launcher once on each host, with the
+same ``--nnodes``, ``--master-addr`` and ``--master-port`` and that host's
+``--node-rank``. Node 0 hosts the rendezvous. Set ``GLOO_SOCKET_IFNAME`` if
+the hosts should talk over a particular network interface.
+
+``--scaling 1,2,4`` instead runs the module once per worker count on this
+host and writes a throughput report. The module must accept
+``--output-dir`` and ``--metrics-path`` and write ``TrainingMetricsCallback``
+records to the latter. Both point into a temporary directory, so the runs
+leave no models behind. Pass ``--max-steps`` through to keep the runs short.
+
+Example:
+    python -m utils.launch --nproc 4 models.fine_tune
+    python -m utils.launch --nproc 2 --nnodes 2 --node-rank 0 --master-addr 10.0.0.2 models.fine_tune
+    python -m utils.launch --scaling 1,2,4 --report scaling.json models.fine_tune -- --max-steps 50
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import logging
+import tempfile
+import subprocess
+from typing import Any, Dict, List
+
+from utils.distributed import format_cpulist, worker_cpu_sets
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 29500
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("", 0))
+        return s.getsockname()[1]
+
+def worker_commands(module: str,
+                    module_args: List[str],
+                    nproc: int,
+                    nnodes: int = 1,
+                    node_rank: int = 0,
+                    master_addr: str = "127.0.0.1",
+                    master_port: int = DEFAULT_PORT,
+                    pin: bool = True) -> List[Dict[str, Any]]:
+    """
+    Command line and environment for each worker on this host.
+
+    Returns:
+        List[Dict[str, Any]]: ``cmd``, ``env`` and ``cpus`` per local worker
+    """
+    cpu_sets = worker_cpu_sets(nproc) if pin else [(None, None, None)] * nproc
+    numactl = shutil.which("numactl") if pin else None
+    workers = []
+    for local_rank, (node, cpus, cores) in enumerate(cpu_sets):
+        env = dict(os.environ)
+        if nnodes * nproc > 1:
+            # A lone worker runs as a plain process; the rendezvous variables would make it wrap the model in DDP
+            env.update({
+                'RANK': str(node_rank * nproc + local_rank),
+                'WORLD_SIZE': str(nnodes * nproc),
+                'LOCAL_RANK': str(local_rank),
+                'LOCAL_WORLD_SIZE': str(nproc),
+                'MASTER_ADDR': master_addr,
+                'MASTER_PORT': str(master_port)
+            })
+        cmd = [sys.executable, "-m", module, *module_args]
+        if cpus:
+            env['WORKER_CPUS'] = format_cpulist(cpus)
+            # One thread per pinned core. HardwareProfile counts them itself, but
+            # accelerate resets torch's threads unless OMP_NUM_THREADS is set.
+            env['OMP_NUM_THREADS'] = str(cores)
+            env.pop('TRAIN_THREADS', None)
+            if numactl:
+                cmd = [numactl, f"--membind={node}", "--", *cmd]
+        workers.append({'cmd': cmd, 'env': env, 'cpus': env.get('WORKER_CPUS')})
+    return workers
+
+def run_workers(workers: List[Dict[str, Any]]) -> int:
+    """
+    Run the workers until all exit; if one fails, stop the rest.
+
+    Returns:
+        int: 0, or the first non-zero exit code
+    """
+    processes = []
+    for worker in workers:
+        logger.info(f"Starting rank {worker['env'].get('RANK', 0)} on CPUs {worker['cpus'] or 'all'}")
+        processes.append(subprocess.Popen(worker['cmd'], env=worker['env']))
+
+    exit_code = 0
+    try:
+        while True:
+            # Poll every worker, so a crash is seen even while an earlier rank still runs
+            codes = [process.poll() for process in processes]
+            failed = [code for code in codes if code not in (None, 0)]
+            if failed:
+                exit_code = failed[0]
+                logger.error(f"A worker exited with code {exit_code}; stopping the others")
+                break
+            if all(code is not None for code in codes):
+                break
+            time.sleep(1)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+    return exit_code or next((process.returncode for process in processes if process.returncode), 0)
+
+def read_summary(metrics_path: str) -> Dict[str, Any]:
+    """The summary record ``TrainingMetricsCallback`` writes at the end of training."""
+    with open(metrics_path, 'r', encoding='utf-8') as f:
+        for line in reversed(f.readlines()):
+            record = json.loads(line)
+            if 'summary' in record:
+                return record['summary']
+    raise ValueError(f"No training summary in {metrics_path}")
+
+def scaling_report(module: str, module_args: List[str], worker_counts: List[int], pin: bool = True) -> Dict[str, Any]:
+    """
+    Train with each worker count on this host and compare throughput.
+
+    Returns:
+        Dict[str, Any]: Per worker count: samples/s and tokens/s over all
+        workers, the speedup over the smallest count and the scaling
+        efficiency (speedup per added worker)
+    """
+    runs = []
+    with tempfile.TemporaryDirectory(prefix="scaling_") as tmp:
+        for workers in worker_counts:
+            # Each run writes its model into the temporary directory, never over a trained one
+            output_dir = os.path.join(tmp, f"run_{workers}")
+            metrics_path = os.path.join(tmp, f"metrics_{workers}.jsonl")
+            commands = worker_commands(
+                module, [*module_args, "--output-dir", output_dir, "--metrics-path", metrics_path], workers,
+                master_port=free_port(), pin=pin
+            )
+            start = time.perf_counter()
+            exit_code = run_workers(commands)
+            if exit_code:
+                raise RuntimeError(f"Training with {workers} workers failed with exit code {exit_code}")
+            summary = read_summary(metrics_path)
+            runs.append({
+                'workers': workers,
+                'cpus': [command['cpus'] for command in commands],
+                'steps': summary['steps'],
+                'step_seconds': summary['seconds'] / summary['steps'] if summary['steps'] else 0.0,
+                'samples_per_s': summary['global_samples_per_s'],
+                'tokens_per_s': summary['global_tokens_per_s'],
+                'wall_seconds': time.perf_counter() - start
+            })
+
+    base = runs[0]
+    for run in runs:
+        run['speedup'] = run['samples_per_s'] / base['samples_per_s'] if base['samples_per_s'] else 0.0
+        run['efficiency'] = run['speedup'] * base['workers'] / run['workers']
+    return {'module': module, 'args': module_args, 'runs': runs}
+
+def main():
+    parser = argparse.ArgumentParser(description="Launch data-parallel training workers")
+    parser.add_argument("--nproc", type=int, default=1, help="Workers on this host")
+    parser.add_argument("--nnodes", type=int, default=1, help="Hosts taking part")
+    parser.add_argument("--node-rank", type=int, default=0, help="This host's index, 0 on the rendezvous host")
+    parser.add_argument("--master-addr", default="127.0.0.1", help="Address of the node-rank 0 host")
+    parser.add_argument("--master-port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--no-pin", action="store_true", help="Do not pin workers to cores and NUMA nodes")
+    parser.add_argument("--scaling", help="Comma-separated worker counts for a scaling report on this host")
+    parser.add_argument("--report", help="Write the scaling report as JSON to this path")
+    parser.add_argument("module", help="Training module to run, e.g. models.fine_tune")
+    parser.add_argument("module_args", nargs=argparse.REMAINDER, help="Arguments for the module, after --")
+    args = parser.parse_args()
+    module_args = args.module_args[1:] if args.module_args[:1] == ["--"] else args.module_args
+
+    if args.scaling:
+        if args.nnodes != 1:
+            parser.error("--scaling runs on a single host")
+        report = scaling_report(module=args.module, module_args=module_args,
+                                worker_counts=[int(n) for n in args.scaling.split(',')], pin=not args.no_pin)
+        print(f"{'workers':>8}{'samples/s':>12}{'tokens/s':>12}{'speedup':>10}{'efficiency':>12}")
+        for run in report['runs']:
+            print(f"{run['workers']:>8}{run['samples_per_s']:>12.1f}{run['tokens_per_s']:>12.0f}"
+                  f"{run['speedup']:>9.2f}x{run['efficiency']:>12.0%}")
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        return
+
+    workers = worker_commands(args.module, module_args, args.nproc, args.nnodes, args.node_rank,
+                              args.master_addr, args.master_port, pin=not args.no_pin)
+    sys.exit(run_workers(workers))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Memory-fit planning for training runs.
+
+``plan_batch`` finds the largest per-device micro-batch that fits in memory
+for a model and sequence length. It turns on gradient checkpointing only
+when that buys a bigger micro-batch and more tokens/s, and sets the gradient
+accumulation steps needed to reach a target effective batch size. The target
+is then spread evenly over those steps, so the micro-batch can be smaller than
+the largest that fits (e.g. a target of 32 with room for 12 gives 3 x 11).
+The expected tokens/s is timed at that micro-batch.
+
+The planner runs short trial steps: forward and backward on random tokens
+padded to the full sequence length, with no optimizer update. It starts at a
+micro-batch of 1 and at most doubles each time. Each next size is capped by
+scaling the last measured peak in proportion to the batch size. That
+overestimates growth, because part of the peak does not depend on the batch,
+so a trial never starts beyond what the measurements say fits. Gradients and
+AdamW state (two fp32 values per trainable parameter) are added to the trial
+peaks by calculation.
+
+On CUDA the trials read the allocator's peak, and an out-of-memory error ends
+the search. On CPU, running out of memory kills the process rather than
+raising, which is why the search never extrapolates. On Linux, the CPU peak
+is measured by returning freed heap memory to the OS and resetting the
+kernel's peak-RSS counter. Elsewhere it falls back to the bytes autograd
+saves for backward.
+"""
+
+import gc
+import os
+import math
+import time
+import ctypes
+import logging
+import contextlib
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+
+from utils.hardware import HardwareProfile
+
+logger = logging.getLogger(__name__)
+
+# Share of free memory the plan may use; the rest covers fragmentation and the data pipeline
+MEMORY_HEADROOM = 0.85
+
+def memory_limit(device: str) -> int:
+    """
+    Bytes available for training state beyond what is already allocated.
+
+    ``TRAIN_MEMORY_LIMIT`` overrides the detected value.
+    """
+    override = os.getenv("TRAIN_MEMORY_LIMIT")
+    if override:
+        return int(override)
+    if device.startswith("cuda"):
+        free, _ = torch.cuda.mem_get_info()
+        return int(free * MEMORY_HEADROOM)
+
+    available = None
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # A container's cgroup limit can be lower than the host's free memory
+    try:
+        with open("/sys/fs/cgroup/memory.max", "r") as f:
+            limit = f.read().strip()
+        with open("/sys/fs/cgroup/memory.current", "r") as f:
+            current = int(f.read().strip())
+        if limit != "max":
+            cgroup_free = int(limit) - current
+            available = cgroup_free if available is None else min(available, cgroup_free)
+    except (OSError, ValueError):
+        pass
+    if available is None:
+        raise RuntimeError("Cannot determine free memory; set TRAIN_MEMORY_LIMIT")
+    return int(available * MEMORY_HEADROOM)
+
+def _read_status(field: str) -> Optional[int]:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def _reset_peak_rss() -> bool:
+    """Reset the process's peak-RSS counter; False where the kernel does not allow it."""
+    gc.collect()
+    try:
+        # Freed tensors otherwise stay resident in malloc's arenas and hide the next peak
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def sample_batch(model, batch_size: int, seq_len: int, task: str = "causal_lm") -> Dict[str, torch.Tensor]:
+    """Random full-length batch for a trial step."""
+    device = next(model.parameters()).device
+    input_ids = torch.randint(0, model.config.vocab_size, (batch_size, seq_len), device=device)
+    batch = {'input_ids': input_ids, 'attention_mask': torch.ones_like(input_ids)}
+    if task == "classifier":
+        batch['labels'] = torch.zeros(batch_size, dtype=torch.long, device=device)
+    else:
+        batch['labels'] = input_ids
+    return batch
+
+def _trial(model, batch: Dict[str, torch.Tensor], hardware: HardwareProfile) -> Tuple[int, float]:
+    """Peak bytes above the resident baseline for one forward and backward, and its seconds."""
+    model.zero_grad(set_to_none=True)
+    cuda = hardware.device.startswith("cuda")
+    parameters = {param.untyped_storage().data_ptr() for param in model.parameters()}
+    saved = {}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in parameters:
+            saved[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        baseline = torch.cuda.memory_allocated()
+        measure_rss = False
+    else:
+        measure_rss = _reset_peak_rss()
+        baseline = _read_status("VmRSS")
+    hooks = contextlib.nullcontext() if cuda or measure_rss else torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t)
+
+    start = time.perf_counter()
+    with hooks:
+        with hardware.autocast():
+            loss = model(**batch).loss
+        loss.backward()
+    if cuda:
+        torch.cuda.synchronize()
+    seconds = time.perf_counter() - start
+
+    if cuda:
+        peak = torch.cuda.max_memory_allocated() - baseline
+    elif measure_rss:
+        peak = _read_status("VmHWM") - baseline
+    else:
+        peak = sum(saved.values())
+    model.zero_grad(set_to_none=True)
+    return max(peak, 0), seconds
+
+def _fits(model, batch_size: int, seq_len: int, task: str, hardware: HardwareProfile,
+          budget: int) -> Tuple[bool, int, float]:
+    """Run a trial at ``batch_size``; whether its peak fits ``budget``, the peak and the seconds."""
+    try:
+        peak, seconds = _trial(model, sample_batch(model, batch_size, seq_len, task), hardware)
+    except torch.cuda.OutOfMemoryError:
+        torch.cuda.empty_cache()
+        return False, budget + 1, float('inf')
+    return peak <= budget, peak, seconds
+
+def _largest_batch(model, seq_len: int, task: str, hardware: HardwareProfile, budget: int,
+                   max_batch_size: int) -> Tuple[int, float]:
+    """Largest micro-batch up to ``max_batch_size`` whose trial fits ``budget``, and its step seconds."""
+    fits, peak, seconds = _fits(model, 1, seq_len, task, hardware, budget)
+    if not fits:
+        return 0, float('inf')
+    batch_size = 1
+    # The first trial pays for warmup; time size 1 again if nothing bigger runs
+    timed = False
+
+    while batch_size < max_batch_size:
+        # Proportional scaling overestimates the next peak, so this size is safe to try
+        bound = int(budget * batch_size // max(peak, 1))
+        candidate = min(max_batch_size, 2 * batch_size, bound)
+        if candidate <= batch_size:
+            break
+        fits, candidate_peak, candidate_seconds = _fits(model, candidate, seq_len, task, hardware, budget)
+        if not fits:
+            break
+        batch_size, peak, seconds, timed = candidate, candidate_peak, candidate_seconds, True
+
+    if not timed:
+        seconds = _fits(model, 1, seq_len, task, hardware, budget)[2]
+    return batch_size, seconds
+
+def _set_checkpointing(model, enabled: bool):
+    if enabled:
+        # Non-reentrant checkpointing also works with frozen embeddings (LoRA)
+        model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+    else:
+        model.gradient_checkpointing_disable()
+
+def plan_batch(model,
+               target_batch_size: int,
+               seq_len: int,
+               hardware: HardwareProfile = None,
+               task: str = "causal_lm",
+               limit: int = None,
+               allow_checkpointing: bool = True) -> Dict[str, Any]:
+    """
+    Choose the micro-batch, gradient checkpointing and accumulation for a training run.
+
+    Args:
+        model: Model to train, already on its device (adapters attached, if any)
+        target_batch_size (int): Examples per optimizer step
+        seq_len (int): Longest training sequence, in tokens
+        hardware (HardwareProfile): Device and precision (default: detected)
+        task (str): 'causal_lm' or 'classifier', for the trial labels
+        limit (int): Bytes available for training (default: ``memory_limit``)
+        allow_checkpointing (bool): Consider gradient checkpointing
+
+    Returns:
+        Dict[str, Any]: ``per_device_train_batch_size``,
+        ``gradient_accumulation_steps``, ``gradient_checkpointing``,
+        ``max_tokens_per_batch`` and the figures behind them
+    """
+    hardware = hardware or HardwareProfile()
+    limit = limit if limit is not None else memory_limit(hardware.device)
+    trainable = [param for param in model.parameters() if param.requires_grad]
+    # Gradients plus AdamW's two fp32 moments. Trial peaks include the gradients too, but with
+    # accumulation they stay allocated through the next micro-batch's forward pass.
+    state_bytes = sum(param.numel() * (param.element_size() + 8) for param in trainable)
+    budget = limit - state_bytes
+    if budget <= 0:
+        raise MemoryError(f"Optimizer state ({state_bytes / 2**20:.0f} MB) does not fit in {limit / 2**20:.0f} MB")
+
+    was_training = model.training
+    model.train()
+    logger.info(f"Planning batch size: seq_len={seq_len}, target batch {target_batch_size}, "
+                f"{limit / 2**20:.0f} MB available, {state_bytes / 2**20:.0f} MB for gradients and optimizer")
+
+    options = {}
+    _set_checkpointing(model, False)
+    options[False] = _largest_batch(model, seq_len, task, hardware, budget, target_batch_size)
+    plain_size = options[False][0]
+    if allow_checkpointing and plain_size < target_batch_size and hasattr(model, "gradient_checkpointing_enable"):
+        _set_checkpointing(model, True)
+        options[True] = _largest_batch(model, seq_len, task, hardware, budget, target_batch_size)
+        _set_checkpointing(model, False)
+    model.train(was_training)
+
+    def tokens_per_second(option):
+        batch_size, seconds = option
+        return batch_size * seq_len / seconds if batch_size else 0.0
+
+    checkpointing = False
+    if True in options:
+        # Checkpointing recomputes the forward pass; use it only when the bigger batch is faster overall
+        bigger = options[True][0] > plain_size
+        checkpointing = bigger and (plain_size == 0 or tokens_per_second(options[True]) > tokens_per_second(options[False]))
+    batch_size, seconds = options[checkpointing]
+    if batch_size == 0:
+        raise MemoryError(f"A single sequence of {seq_len} tokens does not fit in {limit / 2**20:.0f} MB")
+
+    fitted = batch_size
+    accumulation = math.ceil(target_batch_size / fitted)
+    # Spread the target evenly over the micro-batches, so the effective batch does not overshoot it
+    batch_size = math.ceil(target_batch_size / accumulation)
+    if batch_size < fitted:
+        # Time the micro-batch the plan uses; it fits, because a bigger one did
+        model.train()
+        _set_checkpointing(model, checkpointing)
+        seconds = _fits(model, batch_size, seq_len, task, hardware, budget)[2]
+        _set_checkpointing(model, False)
+        model.train(was_training)
+    plan = {
+        'per_device_train_batch_size': batch_size,
+        'gradient_accumulation_steps': accumulation,
+        'gradient_checkpointing': checkpointing,
+        'max_tokens_per_batch': batch_size * seq_len,
+        'effective_batch_size': batch_size * accumulation,
+        'largest_batch_size': fitted,
+        'seq_len': seq_len,
+        'memory_limit_mb': limit / 2**20,
+        'optimizer_state_mb': state_bytes / 2**20,
+        'expected_tokens_per_s': tokens_per_second((batch_size, seconds)),
+        'options': {
+            ('checkpointing' if key else 'plain'): {'batch_size': size, 'tokens_per_s': tokens_per_second((size, secs))}
+            for key, (size, secs) in options.items()
+        }
+    }
+    logger.info(
+        f"Plan: micro-batch {batch_size} x {accumulation} accumulation steps = {plan['effective_batch_size']} "
+        f"per step, gradient checkpointing {'on' if checkpointing else 'off'}, "
+        f"~{plan['expected_tokens_per_s']:.0f} tokens/s (forward and backward)"
+    )
+    return plan
+
+def training_args(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """``TrainingArguments`` keywords for a plan."""
+    args = {
+        'per_device_train_batch_size': plan['per_device_train_batch_size'],
+        'gradient_accumulation_steps': plan['gradient_accumulation_steps'],
+        'gradient_checkpointing': plan['gradient_checkpointing']
+    }
+    if plan['gradient_checkpointing']:
+        args['gradient_checkpointing_kwargs'] = {"use_reentrant": False}
+    return args
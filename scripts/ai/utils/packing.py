@@ -0,0 +1,129 @@
+"""
+Sequence packing for causal-LM fine-tuning.
+
+Tokenized examples are joined with EOS separators into one token stream that
+is cut into fixed-size blocks. Every block is full except possibly the last,
+and examples longer than a block continue into the next one instead of being
+truncated, so no content is dropped.
+
+Each block remembers which segment (example piece) every token belongs to.
+``PackedCollator`` turns that into a block-diagonal causal attention mask, so
+attention never crosses example boundaries, and resets position IDs at the
+start of every segment. The mask is additive (0 where attention is allowed,
+the dtype's minimum elsewhere), which Phi, Llama, Mistral and similar models
+take as-is from transformers 4.42. Releases 4.38 to 4.41 instead read a 4D
+mask as 1/0 and invert it, which would block every allowed position, so
+``PackedCollator`` refuses to run on them.
+"""
+
+import bisect
+import logging
+from array import array
+from itertools import accumulate
+from typing import Any, Dict, List
+
+import torch
+import transformers
+from packaging import version
+from torch.utils.data import Dataset as TorchDataset
+
+from utils.batching import example_lengths
+
+logger = logging.getLogger(__name__)
+
+class PackedDataset(TorchDataset):
+    def __init__(self, dataset, block_size: int, eos_token_id: int, pad_token_id: int = None):
+        """
+        Args:
+            dataset: Tokenized ``datasets.Dataset`` with ``input_ids`` (unpadded, untruncated)
+            block_size (int): Tokens per packed block
+            eos_token_id (int): Separator appended after every example
+            pad_token_id (int): Fills the tail of the last block (default: EOS)
+        """
+        self.dataset = dataset
+        self.block_size = block_size
+        self.eos_token_id = eos_token_id
+        self.pad_token_id = eos_token_id if pad_token_id is None else pad_token_id
+        # End offset of every example (plus its EOS) in the packed token stream
+        self.ends = array('q', accumulate(length + 1 for length in example_lengths(dataset)))
+        self.total_tokens = self.ends[-1] if self.ends else 0
+
+    def __len__(self) -> int:
+        return -(-self.total_tokens // self.block_size)
+
+    def __getitem__(self, index: int) -> Dict[str, List[int]]:
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+
+        start = index * self.block_size
+        end = min(start + self.block_size, self.total_tokens)
+        example = bisect.bisect_right(self.ends, start)
+
+        input_ids, labels, position_ids, segment_ids = [], [], [], []
+        position, segment = start, 0
+        while position < end:
+            example_start = self.ends[example - 1] if example else 0
+            tokens = self.dataset[example]["input_ids"] + [self.eos_token_id]
+            piece = tokens[position - example_start:end - example_start]
+
+            input_ids.extend(piece)
+            # The first token of a segment would be predicted from the previous
+            # segment, which it cannot attend to, so it carries no loss
+            labels.append(-100)
+            labels.extend(piece[1:])
+            position_ids.extend(range(len(piece)))
+            segment_ids.extend([segment] * len(piece))
+
+            position += len(piece)
+            segment += 1
+            example += 1
+
+        num_pad = self.block_size - len(input_ids)
+        return {
+            "input_ids": input_ids + [self.pad_token_id] * num_pad,
+            "labels": labels + [-100] * num_pad,
+            "position_ids": position_ids + [0] * num_pad,
+            "segment_ids": segment_ids + [-1] * num_pad
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Examples, tokens and blocks, for logging."""
+        return {
+            'examples': len(self.ends),
+            'tokens': self.total_tokens,
+            'blocks': len(self),
+            'fill': self.total_tokens / (len(self) * self.block_size) if len(self) else 1.0
+        }
+
+class PackedCollator:
+    """Stack packed blocks and build their block-diagonal causal attention masks."""
+
+    def __init__(self, mask_dtype: torch.dtype = torch.float32):
+        """
+        Args:
+            mask_dtype (torch.dtype): dtype of the additive mask; match the model's
+                weights when they are loaded in half precision
+        """
+        if version.parse(transformers.__version__) < version.parse("4.42"):
+            raise RuntimeError(f"Packed training needs transformers>=4.42 for additive 4D attention masks "
+                               f"(found {transformers.__version__})")
+        self.mask_dtype = mask_dtype
+
+    def __call__(self, features: List[Dict[str, List[int]]]) -> Dict[str, torch.Tensor]:
+        batch = {
+            key: torch.tensor([feature[key] for feature in features], dtype=torch.long)
+            for key in ("input_ids", "labels", "position_ids")
+        }
+        segments = torch.tensor([feature["segment_ids"] for feature in features], dtype=torch.long)
+        length = segments.shape[1]
+
+        same_segment = segments[:, :, None] == segments[:, None, :]
+        causal = torch.ones(length, length, dtype=torch.bool).tril()
+        allowed = same_segment & causal & (segments[:, :, None] >= 0)
+        # Padding rows attend to themselves so softmax never sees an all-masked row
+        allowed |= torch.eye(length, dtype=torch.bool)
+
+        mask = torch.zeros(allowed.shape, dtype=self.mask_dtype)
+        mask.masked_fill_(~allowed, torch.finfo(self.mask_dtype).min)
+        batch["attention_mask"] = mask[:, None, :, :]
+        return batch
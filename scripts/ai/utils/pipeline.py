@@ -0,0 +1,245 @@
+"""
+Cached stage-graph runner.
+
+A pipeline is a set of named stages. Each stage declares the stages it
+depends on, its parameters, the files it reads and the files it writes. A
+stage's fingerprint hashes its parameters, its code, the size and mtime of its
+input files, and the results of the stages it depends on. When the fingerprint
+matches the last successful run and the outputs still exist, the stage is
+skipped and its recorded result is reused. Otherwise it runs.
+
+Stages whose dependencies are done run concurrently in a thread pool. State
+is written after every stage, so a failed run resumes after the last stage
+that succeeded. A per-stage timing report is printed at the end.
+"""
+
+import os
+import json
+import time
+import hashlib
+import inspect
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_STATE_DIR = os.path.join("data", "cache", "pipeline")
+
+def path_signature(path: str) -> Any:
+    """Size and mtime of a file, or of every file under a directory; None if missing."""
+    if os.path.isdir(path):
+        return sorted(
+            (os.path.relpath(os.path.join(root, name), path), *path_signature(os.path.join(root, name)))
+            for root, _, names in os.walk(path) for name in names
+        )
+    if os.path.exists(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+    return None
+
+class Stage:
+    def __init__(self,
+                 name: str,
+                 run: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+                 deps: Iterable[str] = (),
+                 params: Dict[str, Any] = None,
+                 inputs: Iterable[str] = (),
+                 outputs: Iterable[str] = (),
+                 always_run: bool = False):
+        """
+        Args:
+            name (str): Stage name
+            run (Callable): Called with the results of the completed stages,
+                keyed by stage name; returns a JSON-serializable result
+            deps (Iterable[str]): Stages that must finish first
+            params (Dict[str, Any]): Settings that change the stage's output
+            inputs (Iterable[str]): Files or directories the stage reads
+            outputs (Iterable[str]): Files or directories the stage writes;
+                the stage reruns if any is missing
+            always_run (bool): Run even when the fingerprint is unchanged (for
+                cheap stages that detect changes themselves)
+        """
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+        self.params = params or {}
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.always_run = always_run
+
+    def code_hash(self) -> str:
+        try:
+            source = inspect.getsource(self.run)
+        except (OSError, TypeError):
+            source = getattr(self.run, '__qualname__', repr(self.run))
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+class Pipeline:
+    def __init__(self, stages: List[Stage], state_dir: str = None, max_workers: int = 2):
+        """
+        Args:
+            stages (List[Stage]): Stages in any order; dependencies must be acyclic
+            state_dir (str): Where stage results and fingerprints are kept
+                (default: ``PIPELINE_STATE_DIR``)
+            max_workers (int): Stages run at the same time
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_dir = state_dir or PIPELINE_STATE_DIR
+        self.max_workers = max_workers
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[str]:
+        order, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage dependency cycle through {name}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def _descendants(self, name: str) -> Set[str]:
+        found = {name}
+        for stage_name in self.order:
+            if any(dep in found for dep in self.stages[stage_name].deps):
+                found.add(stage_name)
+        return found
+
+    def _ancestors(self, name: str) -> Set[str]:
+        found, pending = set(), [name]
+        while pending:
+            current = pending.pop()
+            if current not in found:
+                found.add(current)
+                pending.extend(self.stages[current].deps)
+        return found
+
+    def _state_path(self, name: str) -> str:
+        return os.path.join(self.state_dir, f"{name}.json")
+
+    def load_state(self, name: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._state_path(name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self, name: str, state: Dict[str, Any]):
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = f"{self._state_path(name)}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2, default=str)
+        os.replace(tmp_path, self._state_path(name))
+
+    def fingerprint(self, stage: Stage, results: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps({
+            'params': stage.params,
+            'code': stage.code_hash(),
+            'inputs': {path: path_signature(path) for path in stage.inputs},
+            'deps': {dep: results.get(dep) for dep in stage.deps}
+        }, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def run(self, force_from: str = None, until: str = None, force: bool = False) -> List[Dict[str, Any]]:
+        """
+        Run every stage that is out of date.
+
+        Args:
+            force_from (str): Rerun this stage and everything after it,
+                cached or not
+            until (str): Stop after this stage (and whatever it depends on)
+            force (bool): Rerun every stage
+
+        Returns:
+            List[Dict[str, Any]]: Per stage: name, status ('ran', 'skipped',
+            'failed' or 'not run') and seconds
+        """
+        for name in (force_from, until):
+            if name is not None and name not in self.stages:
+                raise ValueError(f"Unknown stage: {name}")
+        selected = self._ancestors(until) if until else set(self.stages)
+        forced = set(self.stages) if force else (self._descendants(force_from) if force_from else set())
+
+        results: Dict[str, Any] = {}
+        report: Dict[str, Dict[str, Any]] = {
+            name: {'stage': name, 'status': 'not run', 'seconds': 0.0} for name in self.order if name in selected
+        }
+        pending = [name for name in self.order if name in selected]
+        running = {}
+        failure = None
+        start = time.perf_counter()
+
+        def execute(stage: Stage, inputs: Dict[str, Any]):
+            stage_start = time.perf_counter()
+            result = stage.run(inputs)
+            return result, time.perf_counter() - stage_start
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                # Start every stage whose dependencies are done
+                for name in list(pending):
+                    stage = self.stages[name]
+                    if failure or not all(dep in results for dep in stage.deps):
+                        continue
+                    pending.remove(name)
+                    fingerprint = self.fingerprint(stage, results)
+                    state = self.load_state(name)
+                    if (name not in forced and not stage.always_run and state
+                            and state.get('fingerprint') == fingerprint
+                            and all(os.path.exists(path) for path in stage.outputs)):
+                        results[name] = state.get('result')
+                        report[name]['status'] = 'skipped'
+                        logger.info(f"Stage {name}: up to date, skipped")
+                        continue
+                    logger.info(f"Stage {name}: running")
+                    inputs = {dep: results[dep] for dep in self._ancestors(name) if dep != name}
+                    running[executor.submit(execute, stage, inputs)] = (name, fingerprint)
+
+                if not running:
+                    # Everything runnable has finished; after a failure the rest stays 'not run'
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, fingerprint = running.pop(future)
+                    try:
+                        result, seconds = future.result()
+                    except Exception as e:
+                        logger.error(f"Stage {name} failed: {e}")
+                        report[name]['status'] = 'failed'
+                        failure = failure or e
+                        continue
+                    results[name] = result
+                    report[name].update(status='ran', seconds=seconds)
+                    self._save_state(name, {
+                        'fingerprint': fingerprint,
+                        'result': result,
+                        'seconds': seconds,
+                        'finished': time.strftime('%Y-%m-%dT%H:%M:%S')
+                    })
+
+        rows = list(report.values())
+        self.print_report(rows, time.perf_counter() - start)
+        if failure:
+            raise failure
+        return rows
+
+    @staticmethod
+    def print_report(rows: List[Dict[str, Any]], total_seconds: float):
+        logger.info(f"{'stage':<16}{'status':<10}{'seconds':>10}")
+        for row in rows:
+            logger.info(f"{row['stage']:<16}{row['status']:<10}{row['seconds']:>10.1f}")
+        logger.info(f"{'total':<26}{total_seconds:>10.1f}")
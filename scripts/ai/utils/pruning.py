@@ -0,0 +1,209 @@
+"""
+Structured pruning of DistilBERT classifiers, driven by calibration-set importance.
+
+Three structures are removed, and the pruned model stays dense:
+
+- Layers: each transformer block's importance is the rise in calibration loss
+  when it is skipped. The least important blocks are dropped, and
+  ``config.n_layers`` shrinks.
+- Attention heads: importance is the first-order Taylor estimate
+  |dL/dg| for a gate g on the head's output (Michel et al., 2019). Scores are
+  normalized per layer and ranked globally, and every layer keeps at least one
+  head. Removed heads are recorded in ``config.pruned_heads``, from which
+  ``from_pretrained`` rebuilds the smaller projections. Transformers releases
+  without head pruning (5.x) skip this step.
+- FFN neurons: the same Taylor estimate, with a gate on each hidden unit. The
+  FFN width has a single ``hidden_dim`` in the config, so every layer keeps
+  the same number of neurons, its own highest-scoring ones.
+
+``prune_model`` applies one level of pruning to a copy of the model. The
+result saves and loads with plain ``save_pretrained``/``from_pretrained``.
+"""
+
+import copy
+import logging
+from typing import Any, Dict, List, Sequence
+
+import torch
+from transformers.pytorch_utils import prune_linear_layer
+
+logger = logging.getLogger(__name__)
+
+# FFN widths are rounded to a multiple of this, which keeps CPU matmul kernels efficient
+FFN_MULTIPLE = 8
+
+def transformer_blocks(model) -> torch.nn.ModuleList:
+    """The transformer blocks of a DistilBERT model or task model built on one."""
+    return getattr(model, model.base_model_prefix, model).transformer.layer
+
+def supports_head_pruning(model) -> bool:
+    return hasattr(model, "prune_heads")
+
+def head_size(model) -> int:
+    return model.config.dim // model.config.n_heads
+
+def calibration_loss(model, batches: Sequence[Dict[str, torch.Tensor]]) -> float:
+    """Mean loss of ``model`` over the calibration batches."""
+    model.eval()
+    with torch.no_grad():
+        return sum(model(**batch).loss.item() for batch in batches) / max(len(batches), 1)
+
+def layer_importance(model, batches: Sequence[Dict[str, torch.Tensor]]) -> List[float]:
+    """Rise in calibration loss when each transformer block is skipped."""
+    base = getattr(model, model.base_model_prefix, model).transformer
+    blocks = base.layer
+    baseline = calibration_loss(model, batches)
+    scores = []
+    try:
+        for i in range(len(blocks)):
+            base.layer = torch.nn.ModuleList([block for j, block in enumerate(blocks) if j != i])
+            scores.append(calibration_loss(model, batches) - baseline)
+    finally:
+        base.layer = blocks
+    return scores
+
+def gate_importance(model, batches: Sequence[Dict[str, torch.Tensor]]) -> Dict[str, List[torch.Tensor]]:
+    """
+    Taylor importance of every attention head and FFN neuron on the calibration batches.
+
+    A gate of ones is multiplied into each head's output (before ``out_lin``)
+    and each FFN hidden unit (before ``lin2``). The gradient of the loss with
+    respect to a gate estimates how much the loss would change if that unit
+    were removed.
+
+    Returns:
+        Dict[str, List[torch.Tensor]]: ``heads`` and ``neurons``, one score vector per layer
+    """
+    blocks = transformer_blocks(model)
+    size = head_size(model)
+    device = next(model.parameters()).device
+    head_gates = [torch.ones(block.attention.out_lin.in_features // size, device=device, requires_grad=True)
+                  for block in blocks]
+    neuron_gates = [torch.ones(block.ffn.lin2.in_features, device=device, requires_grad=True) for block in blocks]
+
+    def gate_heads(gate):
+        def hook(module, args):
+            x = args[0]
+            return ((x.reshape(*x.shape[:-1], -1, size) * gate[:, None]).reshape(x.shape),)
+        return hook
+
+    def gate_neurons(gate):
+        def hook(module, args):
+            return (args[0] * gate,)
+        return hook
+
+    handles = []
+    for block, head_gate, neuron_gate in zip(blocks, head_gates, neuron_gates):
+        handles.append(block.attention.out_lin.register_forward_pre_hook(gate_heads(head_gate)))
+        handles.append(block.ffn.lin2.register_forward_pre_hook(gate_neurons(neuron_gate)))
+
+    heads = [torch.zeros_like(gate) for gate in head_gates]
+    neurons = [torch.zeros_like(gate) for gate in neuron_gates]
+    # Eval mode: dropout would add noise to the scores
+    model.eval()
+    try:
+        for batch in batches:
+            loss = model(**batch).loss
+            grads = torch.autograd.grad(loss, head_gates + neuron_gates)
+            for total, grad in zip(heads + neurons, grads):
+                total += grad.abs().detach()
+    finally:
+        for handle in handles:
+            handle.remove()
+    return {'heads': [score.cpu() for score in heads], 'neurons': [score.cpu() for score in neurons]}
+
+def select_heads(scores: List[torch.Tensor], fraction: float) -> Dict[int, List[int]]:
+    """
+    Heads to remove: the lowest ``fraction`` of all heads by per-layer normalized score.
+
+    Every layer keeps its best head.
+    """
+    normalized = [score / (score.norm() + 1e-12) for score in scores]
+    ranked = sorted((float(value), layer, head) for layer, score in enumerate(normalized)
+                    for head, value in enumerate(score))
+    budget = int(round(fraction * len(ranked)))
+    remaining = [len(score) for score in scores]
+    prune = {}
+    for _, layer, head in ranked:
+        if budget == 0:
+            break
+        if remaining[layer] == 1:
+            continue
+        prune.setdefault(layer, []).append(head)
+        remaining[layer] -= 1
+        budget -= 1
+    return {layer: sorted(heads) for layer, heads in prune.items()}
+
+def drop_layers(model, layers: Sequence[int]):
+    """Remove transformer blocks in place."""
+    base = getattr(model, model.base_model_prefix, model).transformer
+    layers = set(layers)
+    base.layer = torch.nn.ModuleList([block for i, block in enumerate(base.layer) if i not in layers])
+    base.n_layers = len(base.layer)
+    model.config.n_layers = len(base.layer)
+
+def prune_ffn(model, scores: List[torch.Tensor], fraction: float):
+    """Keep the highest-scoring ``1 - fraction`` of every layer's FFN neurons, in place."""
+    hidden_dim = model.config.hidden_dim
+    keep = max(FFN_MULTIPLE, int(round(hidden_dim * (1 - fraction) / FFN_MULTIPLE)) * FFN_MULTIPLE)
+    if keep >= hidden_dim:
+        return
+    for block, score in zip(transformer_blocks(model), scores):
+        index = score.topk(keep).indices.sort().values.to(block.ffn.lin1.weight.device)
+        block.ffn.lin1 = prune_linear_layer(block.ffn.lin1, index, dim=0)
+        block.ffn.lin2 = prune_linear_layer(block.ffn.lin2, index, dim=1)
+    model.config.hidden_dim = keep
+
+def prune_model(model,
+                batches: Sequence[Dict[str, torch.Tensor]],
+                layers: int = 0,
+                heads: float = 0.0,
+                ffn: float = 0.0,
+                layer_scores: List[float] = None) -> Dict[str, Any]:
+    """
+    Prune a copy of a DistilBERT classifier.
+
+    Layers go first. Head and neuron importance is then scored on the
+    shallower model, so it reflects the blocks that remain.
+
+    Args:
+        model: Fine-tuned DistilBERT classifier (left unchanged)
+        batches (Sequence[Dict[str, torch.Tensor]]): Labelled calibration batches
+        layers (int): Transformer blocks to drop
+        heads (float): Fraction of all attention heads to remove
+        ffn (float): Fraction of each layer's FFN neurons to remove
+        layer_scores (List[float]): ``layer_importance`` of ``model``, if already computed
+
+    Returns:
+        Dict[str, Any]: ``model`` (the pruned copy) and what was removed
+    """
+    pruned = copy.deepcopy(model)
+    summary = {'dropped_layers': [], 'pruned_heads': {}}
+
+    if layers:
+        if layers >= model.config.n_layers:
+            raise ValueError(f"Cannot drop {layers} of {model.config.n_layers} layers")
+        scores = layer_scores if layer_scores is not None else layer_importance(pruned, batches)
+        dropped = sorted(sorted(range(len(scores)), key=scores.__getitem__)[:layers])
+        drop_layers(pruned, dropped)
+        summary['dropped_layers'] = dropped
+
+    if heads or ffn:
+        scores = gate_importance(pruned, batches)
+        if heads:
+            if supports_head_pruning(pruned):
+                summary['pruned_heads'] = select_heads(scores['heads'], heads)
+                pruned.prune_heads(summary['pruned_heads'])
+            else:
+                logger.warning("This transformers release cannot prune attention heads; keeping all heads")
+        if ffn:
+            prune_ffn(pruned, scores['neurons'], ffn)
+
+    size = head_size(pruned)
+    summary.update(
+        model=pruned,
+        layers=pruned.config.n_layers,
+        heads=sum(block.attention.out_lin.in_features // size for block in transformer_blocks(pruned)),
+        ffn_dim=pruned.config.hidden_dim
+    )
+    return summary
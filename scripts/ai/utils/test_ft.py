@@ -1,18 +1,34 @@
 """
-Self-contained script to fine-tune the `microsoft/phi-2` model using a small instruction-style dataset.
+Script to fine-tune the `microsoft/phi-2` model using a small instruction-style dataset.
+It uses the repo's tokenization, batching, hardware and memory planning modules.
 Tested on Apple M1 (CPU or MPS). Adjust batch size and length for your machine.
 """
 
-import os
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, TrainingArguments, Trainer
+import sys
+from pathlib import Path
+
+from transformers import AutoTokenizer, AutoModelForCausalLM, TrainingArguments
 from datasets import Dataset
 from transformers import DataCollatorForLanguageModeling
 import multiprocessing
 
+# Also runnable as ``python utils/test_ft.py``
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from data.tokenization import tokenize_cached, tokenize_text
+from utils.batching import TokenBudgetTrainer
+from utils.hardware import HardwareProfile
+from utils.memory_plan import plan_batch, training_args as plan_training_args
+from utils.text_processor import set_parallelism
+from utils.training_metrics import TrainingMetricsCallback
+
+# Processes used to tokenize the dataset. With one, the Rust tokenizer threads
+# do the parallel work; with more, they are switched off in the forked workers.
+TOKENIZE_PROCESSES = 1
+
 def main():
-    os.environ["TOKENIZERS_PARALLELISM"] = "false"
-    torch.set_num_threads(os.cpu_count())
+    set_parallelism(TOKENIZE_PROCESSES == 1)
+    hardware = HardwareProfile().apply()
 
     examples = [
         {"instruction": "What is AI?", "response": "AI stands for Artificial Intelligence."},
@@ -28,46 +44,39 @@ def main():
     tokenizer = AutoTokenizer.from_pretrained(model_id)
     model = AutoModelForCausalLM.from_pretrained(model_id)
 
-    device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
-    model = model.to(device)
+    model = hardware.prepare_model(model)
     tokenizer.pad_token = tokenizer.eos_token
     model.config.pad_token_id = tokenizer.eos_token_id
 
-    def tokenize(example):
-        out = tokenizer(
-            example["text"],
-            padding="max_length",
-            truncation=True,
-            max_length=256
-        )
-        out["labels"] = out["input_ids"]
-        return out
-
-    tokenized_dataset = dataset.map(tokenize, remove_columns=["text"])
+    # No padding here: the collator pads each batch and builds the labels
+    tokenized_dataset = tokenize_cached(dataset, tokenize_text, tokenizer, max_length=256,
+                                        remove_columns=["text"], num_proc=TOKENIZE_PROCESSES)
 
     data_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
 
+    # Largest micro-batch of 256 tokens that fits this machine, accumulated to 2 examples per step
+    plan = plan_batch(model, target_batch_size=2, seq_len=256, hardware=hardware)
+
     training_args = TrainingArguments(
         output_dir="./finetuned_phi2",
         num_train_epochs=3,
-        per_device_train_batch_size=1,
-        gradient_accumulation_steps=2,
         logging_steps=1,
         save_strategy="epoch",
         save_total_limit=1,
         learning_rate=5e-5,
-        fp16=False,
-        bf16=False,
-        dataloader_num_workers=2,
         report_to="none",
-        disable_tqdm=False
+        disable_tqdm=False,
+        **plan_training_args(plan),
+        **hardware.training_args()
     )
 
-    trainer = Trainer(
+    trainer = TokenBudgetTrainer(
         model=model,
         args=training_args,
         train_dataset=tokenized_dataset,
         data_collator=data_collator,
+        max_tokens_per_batch=plan['max_tokens_per_batch'],
+        callbacks=[TrainingMetricsCallback("./finetuned_phi2/metrics.jsonl")]
     )
 
     trainer.train()
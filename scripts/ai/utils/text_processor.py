@@ -1,19 +1,98 @@
 """
 Text processing utilities for AI tasks.
 Handles text preprocessing, tokenization, and other text-related operations.
+
+``TextProcessor.tokenize`` wraps a Rust-backed fast tokenizer. Each batch is
+encoded with one ``encode_batch`` call, which runs across cores unless
+tokenizer parallelism is disabled. Padded ID and mask arrays are filled in
+NumPy, and ``pt`` outputs share that memory. Short strings that repeat across
+a dataset (titles, tags, prompts) are kept in a bounded LRU cache, so they are
+encoded only once.
+
+``processor_for`` returns one shared processor per tokenizer. The training
+tokenization in ``data/tokenization.py`` and ``data/streaming.py`` goes
+through it, so the cache carries across map batches and loader chunks.
 """
 
+import os
+import weakref
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Texts longer than this are encoded every time instead of being cached
+MAX_CACHED_CHARS = 512
+
+def set_parallelism(enabled: bool):
+    """
+    Turn the Rust tokenizer thread pool on or off for this process.
+
+    Leave it off when tokenization runs inside forked workers (e.g.
+    ``Dataset.map(num_proc>1)`` or DataLoader workers): a pool that was
+    already used before a fork can deadlock in the child.
+    """
+    os.environ["TOKENIZERS_PARALLELISM"] = "true" if enabled else "false"
+
 class TextProcessor:
-    def __init__(self):
-        self.tokenizer = None
-    
+    def __init__(self,
+                 tokenizer=None,
+                 max_length: Optional[int] = None,
+                 cache_size: int = 65536,
+                 parallelism: Optional[bool] = None):
+        """
+        Args:
+            tokenizer: A fast Hugging Face tokenizer, or a model name/path to
+                load one from
+            max_length (Optional[int]): Default truncation length, special
+                tokens included
+            cache_size (int): Most distinct short strings kept encoded
+            parallelism (Optional[bool]): Enable or disable the Rust thread
+                pool; None leaves ``TOKENIZERS_PARALLELISM`` as it is
+        """
+        if parallelism is not None:
+            set_parallelism(parallelism)
+        if isinstance(tokenizer, str):
+            from transformers import AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer, use_fast=True)
+        if tokenizer is not None and not getattr(tokenizer, 'is_fast', False):
+            raise ValueError(f"{type(tokenizer).__name__} is not a fast (Rust-backed) tokenizer")
+
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.hits = self.misses = 0
+
+        if tokenizer is not None:
+            # Special tokens the tokenizer wraps around a single sequence, e.g. [CLS] ... [SEP]
+            backend = tokenizer.backend_tokenizer
+            plain = backend.encode("a", add_special_tokens=False).ids
+            wrapped = backend.encode("a", add_special_tokens=True).ids
+            split = next((i for i in range(len(wrapped)) if wrapped[i:i + len(plain)] == plain), None)
+            if split is None:
+                raise ValueError(f"{type(tokenizer).__name__} changes the text's tokens when it adds special "
+                                 f"tokens, so TextProcessor cannot place them")
+            self._prefix = np.asarray(wrapped[:split], dtype=np.int64)
+            self._suffix = np.asarray(wrapped[split + len(plain):], dtype=np.int64)
+            pad_token_id = tokenizer.pad_token_id
+            self.pad_token_id = pad_token_id if pad_token_id is not None else tokenizer.eos_token_id or 0
+
+    @property
+    def prefix(self) -> np.ndarray:
+        """Special tokens the tokenizer puts in front of a sequence (e.g. BOS or [CLS])."""
+        return self._prefix
+
     def preprocess_text(self, text: str) -> str:
         """
         Preprocess text for model input.
-        
+
         Args:
             text (str): Input text to preprocess
-            
+
         Returns:
             str: Preprocessed text
         """
@@ -21,15 +100,110 @@ class TextProcessor:
         text = text.strip()
         text = text.lower()
         return text
-    
-    def tokenize(self, text: str):
+
+    def _encode(self, texts: List[str]) -> List[np.ndarray]:
+        """IDs without special tokens for each text, using the cache for short strings."""
+        encoded: List[Optional[np.ndarray]] = [None] * len(texts)
+        missing: Dict[str, List[int]] = {}
+        for index, text in enumerate(texts):
+            ids = self._cache.get(text)
+            if ids is not None:
+                self._cache.move_to_end(text)
+                encoded[index] = ids
+                self.hits += 1
+            else:
+                # Duplicates inside the batch are encoded once
+                missing.setdefault(text, []).append(index)
+
+        if missing:
+            unique = list(missing)
+            self.misses += len(unique)
+            encodings = self.tokenizer.backend_tokenizer.encode_batch(unique, add_special_tokens=False)
+            for text, encoding in zip(unique, encodings):
+                ids = np.asarray(encoding.ids, dtype=np.int64)
+                ids.flags.writeable = False
+                for index in missing[text]:
+                    encoded[index] = ids
+                if len(text) <= MAX_CACHED_CHARS and self.cache_size > 0:
+                    self._cache[text] = ids
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return encoded
+
+    def tokenize(self,
+                 text: Union[str, List[str]],
+                 max_length: Optional[int] = None,
+                 return_tensors: Optional[str] = "np",
+                 add_special_tokens: bool = True,
+                 pad_to_multiple_of: Optional[int] = None):
         """
         Tokenize text for model input.
-        
+
         Args:
-            text (str): Text to tokenize
-            
+            text (Union[str, List[str]]): A string or a batch of strings
+            max_length (Optional[int]): Truncation length (default: the one
+                given to the constructor; None keeps texts whole)
+            return_tensors (Optional[str]): 'np' or 'pt' for padded
+                ``input_ids``/``attention_mask`` arrays of shape (batch, length);
+                None for a list of unpadded ID arrays
+            add_special_tokens (bool): Wrap each text in the tokenizer's special tokens
+            pad_to_multiple_of (Optional[int]): Round the padded length up
+
         Returns:
-            list: Tokenized text
+            Dict with ``input_ids``, ``attention_mask`` and ``length`` arrays,
+            or a list of ID arrays when ``return_tensors`` is None. A single
+            string gives a batch of one.
         """
-        raise NotImplementedError("Tokenization not implemented yet") 
\ No newline at end of file
+        if self.tokenizer is None:
+            raise ValueError("TextProcessor was created without a tokenizer")
+        texts = [text] if isinstance(text, str) else list(text)
+        max_length = max_length if max_length is not None else self.max_length
+
+        prefix = self._prefix if add_special_tokens else self._prefix[:0]
+        suffix = self._suffix if add_special_tokens else self._suffix[:0]
+        budget = None if max_length is None else max(0, max_length - len(prefix) - len(suffix))
+
+        body = [ids if budget is None else ids[:budget] for ids in self._encode(texts)]
+        lengths = np.fromiter((len(prefix) + len(ids) + len(suffix) for ids in body), dtype=np.int64, count=len(body))
+
+        if return_tensors is None:
+            return [np.concatenate([prefix, ids, suffix]) for ids in body]
+        if return_tensors not in ("np", "pt"):
+            raise ValueError(f"Unsupported return_tensors: {return_tensors}")
+
+        width = int(lengths.max()) if len(lengths) else 0
+        if pad_to_multiple_of:
+            width = -(-width // pad_to_multiple_of) * pad_to_multiple_of
+        input_ids = np.full((len(body), width), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(body), width), dtype=np.int64)
+        left = self.tokenizer.padding_side == "left"
+        for row, (ids, length) in enumerate(zip(body, lengths)):
+            start = width - length if left else 0
+            input_ids[row, start:start + len(prefix)] = prefix
+            input_ids[row, start + len(prefix):start + len(prefix) + len(ids)] = ids
+            input_ids[row, start + len(prefix) + len(ids):start + length] = suffix
+            attention_mask[row, start:start + length] = 1
+
+        output = {"input_ids": input_ids, "attention_mask": attention_mask, "length": lengths}
+        if return_tensors == "pt":
+            import torch
+
+            output = {key: torch.from_numpy(value) for key, value in output.items()}
+        return output
+
+    def cache_info(self) -> Dict[str, int]:
+        return {'size': len(self._cache), 'max_size': self.cache_size, 'hits': self.hits, 'misses': self.misses}
+
+_processors = weakref.WeakKeyDictionary()
+
+def processor_for(tokenizer) -> TextProcessor:
+    """
+    The shared ``TextProcessor`` of ``tokenizer``, created on first use.
+
+    Batched map functions and data-loader workers get the same tokenizer
+    object on every call, so they also share one encoding cache.
+    """
+    processor = _processors.get(tokenizer)
+    if processor is None:
+        processor = _processors[tokenizer] = TextProcessor(tokenizer)
+    return processor
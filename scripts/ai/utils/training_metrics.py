@@ -0,0 +1,278 @@
+"""
+Throughput and hot-path instrumentation for Hugging Face Trainer runs.
+
+``TrainingMetricsCallback`` splits each optimizer step's wall time into:
+
+- data wait: the time until the model's forward starts (loading, collation, host-to-device copies)
+- forward and backward
+- optimizer: from the end of backward to the end of the step (clipping, optimizer, scheduler, zero_grad)
+- checkpoint: time spent in ``save_steps`` saves after the step
+
+Trainer fetches a step's first micro-batch before ``on_step_begin``, so each
+step is timed from the end of the previous step's log, evaluation and save
+window, and that fetch counts as data wait. Logging and evaluation are left
+out of every phase.
+
+It also records samples/s, tokens/s, the padding ratio, peak RSS and peak GPU
+memory. Forward is timed with hooks on the model. The end of backward is taken
+when the first trainable parameter gets its gradient, which happens last in
+the backward pass. Records are appended to a JSONL file, one per step.
+
+Under data-parallel training only rank 0 records. The summary's ``global_*``
+rates scale its throughput by the number of workers.
+
+Set ``profile_steps`` (or ``PROFILE_STEPS=start:end``) to record a
+``torch.profiler`` trace of those steps for chrome://tracing or Perfetto.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import resource
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+from transformers import TrainerCallback
+
+logger = logging.getLogger(__name__)
+
+PHASES = ("data_wait", "forward", "backward", "optimizer", "checkpoint")
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def parse_step_window(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Parse 'start:end' (inclusive optimizer steps) into a tuple."""
+    if not value:
+        return None
+    start, _, end = value.partition(':')
+    return int(start), int(end or start)
+
+class TrainingMetricsCallback(TrainerCallback):
+    def __init__(self,
+                 metrics_path: str,
+                 profile_steps: Optional[Tuple[int, int]] = None,
+                 profile_dir: str = None,
+                 synchronize: bool = True):
+        """
+        Args:
+            metrics_path (str): JSONL file the per-step records are appended to
+            profile_steps (Optional[Tuple[int, int]]): First and last optimizer
+                step to trace with torch.profiler (default: ``PROFILE_STEPS``)
+            profile_dir (str): Where the trace goes (default: next to ``metrics_path``)
+            synchronize (bool): Wait for CUDA kernels at phase boundaries so the
+                split is exact; costs a little throughput on GPU
+        """
+        self.metrics_path = metrics_path
+        self.profile_steps = profile_steps or parse_step_window(os.getenv("PROFILE_STEPS"))
+        self.profile_dir = profile_dir or os.path.dirname(os.path.abspath(metrics_path))
+        self.synchronize = synchronize and torch.cuda.is_available()
+
+        self._handles = []
+        self._profiler = None
+        self._file = None
+        self.world_size = 1
+        # End of the last step's log/evaluate/save window; the next step starts here
+        self._window_end = None
+        self._save_start = None
+        self._reset_step()
+        self.totals = {phase: 0.0 for phase in PHASES}
+        self.totals.update(seconds=0.0, samples=0, tokens=0, padded_tokens=0, steps=0, peak_gpu_mb=0.0)
+
+    def _now(self) -> float:
+        if self.synchronize:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _reset_step(self):
+        self.step = {phase: 0.0 for phase in PHASES}
+        self.step.update(samples=0, tokens=0, padded_tokens=0)
+        self._mark = None
+        self._step_start = None
+        self._forward_start = None
+        self._forward_end = None
+        self._backward_end = None
+
+    def _forward_pre_hook(self, module, args, kwargs):
+        if not module.training:
+            return
+        now = self._now()
+        if self._mark is not None:
+            self.step['data_wait'] += now - self._mark
+        self._forward_start = now
+
+        input_ids = kwargs.get('input_ids', args[0] if args else None)
+        attention_mask = kwargs.get('attention_mask')
+        if isinstance(input_ids, torch.Tensor):
+            self.step['samples'] += input_ids.shape[0]
+            self.step['padded_tokens'] += input_ids.numel()
+            # Packed batches carry a 4D mask and have no padding inside blocks
+            if isinstance(attention_mask, torch.Tensor) and attention_mask.dim() == 2:
+                self.step['tokens'] += int(attention_mask.sum())
+            else:
+                self.step['tokens'] += input_ids.numel()
+
+    def _forward_hook(self, module, args, kwargs, output):
+        if not module.training or self._forward_start is None:
+            return
+        self._forward_end = self._now()
+        self.step['forward'] += self._forward_end - self._forward_start
+        self._forward_start = None
+
+    def _grad_hook(self, grad):
+        if self._forward_end is None:
+            return
+        self._backward_end = self._now()
+        self.step['backward'] += self._backward_end - self._forward_end
+        self._forward_end = None
+        # The next micro-batch's data wait starts here
+        self._mark = self._backward_end
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        if not state.is_world_process_zero:
+            return
+        self.world_size = args.world_size
+        self._handles.append(model.register_forward_pre_hook(self._forward_pre_hook, with_kwargs=True))
+        self._handles.append(model.register_forward_hook(self._forward_hook, with_kwargs=True))
+        # Parameters run input to output, so the first trainable one gets its gradient last
+        first_trainable = next((p for p in model.parameters() if p.requires_grad), None)
+        if first_trainable is not None:
+            self._handles.append(first_trainable.register_hook(self._grad_hook))
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.metrics_path)), exist_ok=True)
+        self._file = open(self.metrics_path, 'a', encoding='utf-8')
+        self._window_end = self._now()
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        if self._file is None:
+            return
+        if self._step_start is None:
+            if torch.cuda.is_available():
+                # Per-step peak; the run's peak is kept in the totals
+                torch.cuda.reset_peak_memory_stats()
+            # Include the first micro-batch's fetch, which happened before this callback
+            self._step_start = self._window_end if self._window_end is not None else self._now()
+            self._mark = self._step_start
+        if self.profile_steps and state.global_step + 1 == self.profile_steps[0] and self._profiler is None:
+            self._start_profiler()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if self._file is None or self._step_start is None:
+            return
+        now = self._now()
+        if self._backward_end is not None:
+            self.step['optimizer'] += now - self._backward_end
+        seconds = now - self._step_start
+
+        record = {
+            'step': state.global_step,
+            'epoch': state.epoch,
+            'seconds': seconds,
+            **{f"{phase}_s": self.step[phase] for phase in PHASES if phase != 'checkpoint'},
+            'samples': self.step['samples'],
+            'tokens': self.step['tokens'],
+            'samples_per_s': self.step['samples'] / seconds if seconds > 0 else 0.0,
+            'tokens_per_s': self.step['tokens'] / seconds if seconds > 0 else 0.0,
+            'padding_ratio': 1 - self.step['tokens'] / self.step['padded_tokens'] if self.step['padded_tokens'] else 0.0,
+            'peak_rss_mb': peak_rss_mb()
+        }
+        if torch.cuda.is_available():
+            record['peak_gpu_mb'] = torch.cuda.max_memory_allocated() / 2**20
+            self.totals['peak_gpu_mb'] = max(self.totals['peak_gpu_mb'], record['peak_gpu_mb'])
+        self._file.write(json.dumps(record) + '\n')
+
+        for key in PHASES + ('samples', 'tokens', 'padded_tokens'):
+            self.totals[key] += self.step[key]
+        self.totals['seconds'] += seconds
+        self.totals['steps'] += 1
+
+        if self._profiler is not None and state.global_step >= self.profile_steps[1]:
+            self._stop_profiler()
+
+        self._reset_step()
+        # Trainer logs, then evaluates, then saves; a save starts when the others are done
+        self._save_start = self._window_end = now
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if self._file is not None:
+            self._file.flush()
+            self._save_start = self._window_end = self._now()
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        if self._file is not None:
+            self._save_start = self._window_end = self._now()
+
+    def on_save(self, args, state, control, **kwargs):
+        if self._file is None or self._save_start is None:
+            return
+        now = self._now()
+        seconds = now - self._save_start
+        self.totals['checkpoint'] += seconds
+        self._file.write(json.dumps({'step': state.global_step, 'checkpoint_s': seconds}) + '\n')
+        self._file.flush()
+        self._save_start = None
+        self._window_end = now
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self._file is None:
+            return
+        if self._profiler is not None:
+            self._stop_profiler()
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+        summary = self.summary()
+        self._file.write(json.dumps({'summary': summary}) + '\n')
+        self._file.close()
+        self._file = None
+
+        logger.info(
+            f"Throughput: {summary['samples_per_s']:.1f} samples/s, {summary['tokens_per_s']:.0f} tokens/s, "
+            f"padding {summary['padding_ratio']:.1%}, peak RSS {summary['peak_rss_mb']:.0f} MB"
+        )
+        logger.info("Step time: " + ", ".join(
+            f"{phase} {summary['fractions'][phase]:.0%}" for phase in PHASES
+        ))
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals over the run so far, with each phase's share of the time."""
+        seconds = self.totals['seconds'] + self.totals['checkpoint']
+        return {
+            'steps': self.totals['steps'],
+            'seconds': seconds,
+            'samples_per_s': self.totals['samples'] / seconds if seconds else 0.0,
+            'tokens_per_s': self.totals['tokens'] / seconds if seconds else 0.0,
+            'padding_ratio': (1 - self.totals['tokens'] / self.totals['padded_tokens']
+                              if self.totals['padded_tokens'] else 0.0),
+            # Workers step in lockstep, so each trains at about rank 0's rate
+            'world_size': self.world_size,
+            'global_samples_per_s': self.world_size * self.totals['samples'] / seconds if seconds else 0.0,
+            'global_tokens_per_s': self.world_size * self.totals['tokens'] / seconds if seconds else 0.0,
+            'fractions': {phase: self.totals[phase] / seconds if seconds else 0.0 for phase in PHASES},
+            'peak_rss_mb': peak_rss_mb(),
+            **({'peak_gpu_mb': self.totals['peak_gpu_mb']} if torch.cuda.is_available() else {})
+        }
+
+    def _start_profiler(self):
+        from torch.profiler import ProfilerActivity, profile
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        self._profiler = profile(activities=activities, record_shapes=True, profile_memory=True)
+        self._profiler.start()
+        logger.info(f"Profiling steps {self.profile_steps[0]}-{self.profile_steps[1]}")
+
+    def _stop_profiler(self):
+        self._profiler.stop()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"trace_steps_{self.profile_steps[0]}-{self.profile_steps[1]}.json")
+        self._profiler.export_chrome_trace(path)
+        logger.info(f"Wrote profiler trace to {path}")
+        self._profiler = None
@@ -0,0 +1,285 @@
+"""
+Concurrent artifact upload to Cloud Storage.
+
+``Uploader`` pushes files from a thread pool. Each file is first checked
+against the remote object: when the sizes match and the MD5 (or CRC32C for
+composite objects) matches, the upload is skipped, so re-running an
+interrupted or repeated upload only sends what is missing. Large files use
+chunked resumable uploads, so a failed chunk is retried on its own rather
+than restarting the file.
+
+``LocalBucket`` is a filesystem-backed stand-in with the subset of the
+``google.cloud.storage.Bucket`` API used here, for offline runs and tests.
+"""
+
+import os
+import time
+import base64
+import shutil
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Files at least this large are uploaded in resumable chunks
+RESUMABLE_THRESHOLD = 8 * 2**20
+# GCS requires chunk sizes to be a multiple of 256 KiB
+DEFAULT_CHUNK_SIZE = 64 * 2**20
+HASH_BLOCK_SIZE = 2**20
+
+def file_md5(path: str) -> str:
+    """Base64 MD5 of a file, in the format of ``Blob.md5_hash``."""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return base64.b64encode(digest.digest()).decode('ascii')
+
+def file_crc32c(path: str) -> Optional[str]:
+    """Base64 CRC32C of a file, in the format of ``Blob.crc32c``; None without google-crc32c."""
+    try:
+        import google_crc32c
+    except ImportError:
+        return None
+    checksum = google_crc32c.Checksum()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            checksum.update(block)
+    return base64.b64encode(checksum.digest()).decode('ascii')
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class LocalBlob:
+    """A file under a ``LocalBucket`` root, with the Blob methods the uploader uses."""
+
+    def __init__(self, bucket: "LocalBucket", name: str, chunk_size: int = None):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = chunk_size
+        self.path = os.path.join(bucket.root, *name.split('/'))
+
+    @property
+    def size(self) -> Optional[int]:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else None
+
+    @property
+    def md5_hash(self) -> Optional[str]:
+        return file_md5(self.path) if os.path.exists(self.path) else None
+
+    @property
+    def crc32c(self) -> Optional[str]:
+        return file_crc32c(self.path) if os.path.exists(self.path) else None
+
+    @property
+    def updated(self) -> Optional[datetime]:
+        if not os.path.exists(self.path):
+            return None
+        return datetime.fromtimestamp(os.path.getmtime(self.path), tz=timezone.utc)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def upload_from_filename(self, filename: str, **kwargs):
+        """
+        Copy ``filename`` into the bucket. With a ``chunk_size`` the copy is
+        resumable: a ``.partial`` file left by an interrupted upload is
+        continued from its current size. The partial's source size and MD5
+        are kept next to it, and a partial of any other file is started over.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        partial = f"{self.path}.partial"
+        source = f"{partial}.source"
+        if not self.chunk_size:
+            shutil.copyfile(filename, partial)
+        else:
+            identity = f"{os.path.getsize(filename)} {file_md5(filename)}"
+            recorded = None
+            if os.path.exists(source):
+                with open(source, encoding='utf-8') as f:
+                    recorded = f.read()
+            if recorded != identity:
+                # Truncate before recording the new source, so a crash in between starts over again
+                open(partial, 'wb').close()
+                with open(source, 'w', encoding='utf-8') as f:
+                    f.write(identity)
+            with open(filename, 'rb') as src, open(partial, 'ab') as dst:
+                src.seek(dst.tell())
+                for chunk in iter(lambda: src.read(self.chunk_size), b""):
+                    dst.write(chunk)
+                    dst.flush()
+        os.replace(partial, self.path)
+        if os.path.exists(source):
+            os.remove(source)
+
+    def upload_from_string(self, data, content_type: str = None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        partial = f"{self.path}.partial"
+        with open(partial, 'wb') as f:
+            f.write(data.encode('utf-8') if isinstance(data, str) else data)
+        os.replace(partial, self.path)
+
+    def download_to_filename(self, filename: str):
+        shutil.copyfile(self.path, filename)
+
+    def download_as_bytes(self) -> bytes:
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def delete(self):
+        os.remove(self.path)
+
+class LocalBucket:
+    """Filesystem-backed stand-in for ``google.cloud.storage.Bucket``."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.name = os.path.basename(os.path.abspath(root))
+        os.makedirs(root, exist_ok=True)
+
+    def blob(self, name: str, chunk_size: int = None) -> LocalBlob:
+        return LocalBlob(self, name, chunk_size=chunk_size)
+
+    def get_blob(self, name: str) -> Optional[LocalBlob]:
+        blob = self.blob(name)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix: str = "") -> Iterator[LocalBlob]:
+        for root, _, files in os.walk(self.root):
+            for file in sorted(files):
+                if file.endswith(('.partial', '.partial.source')):
+                    continue
+                name = os.path.relpath(os.path.join(root, file), self.root).replace(os.sep, '/')
+                if name.startswith(prefix):
+                    yield self.blob(name)
+
+class Uploader:
+    def __init__(self,
+                 bucket,
+                 max_workers: int = 8,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 skip_unchanged: bool = True,
+                 retries: int = 3,
+                 progress: Callable[[Dict[str, Any]], None] = None):
+        """
+        Args:
+            bucket: ``google.cloud.storage.Bucket`` or ``LocalBucket``
+            max_workers (int): Concurrent uploads
+            chunk_size (int): Resumable chunk size for files of at least
+                ``RESUMABLE_THRESHOLD`` bytes (a multiple of 256 KiB)
+            skip_unchanged (bool): Skip files whose remote copy has the same size and hash
+            retries (int): Attempts per file before giving up
+            progress: Called with each file's result as it finishes
+        """
+        if chunk_size % (256 * 1024):
+            raise ValueError(f"chunk_size must be a multiple of 256 KiB, got {chunk_size}")
+        self.bucket = bucket
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.skip_unchanged = skip_unchanged
+        self.retries = retries
+        self.progress = progress
+        self._lock = threading.Lock()
+
+    def is_unchanged(self, local_path: str, blob_name: str) -> bool:
+        """True when the remote object has the same size and checksum as the local file."""
+        remote = self.bucket.get_blob(blob_name)
+        if remote is None or remote.size != os.path.getsize(local_path):
+            return False
+        # Composite objects have no MD5; fall back to CRC32C
+        if remote.md5_hash:
+            return remote.md5_hash == file_md5(local_path)
+        local_crc = file_crc32c(local_path)
+        return bool(remote.crc32c) and remote.crc32c == local_crc
+
+    def upload_file(self, local_path: str, blob_name: str) -> Dict[str, Any]:
+        """
+        Upload one file unless an identical copy is already in the bucket.
+
+        Returns:
+            Dict[str, Any]: ``name``, ``bytes``, ``skipped`` and ``seconds``
+        """
+        start = time.perf_counter()
+        size = os.path.getsize(local_path)
+        if self.skip_unchanged and self.is_unchanged(local_path, blob_name):
+            return {'name': blob_name, 'bytes': size, 'skipped': True, 'seconds': time.perf_counter() - start}
+
+        chunk_size = self.chunk_size if size >= RESUMABLE_THRESHOLD else None
+        for attempt in range(1, self.retries + 1):
+            try:
+                self.bucket.blob(blob_name, chunk_size=chunk_size).upload_from_filename(local_path)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"Upload of {blob_name} failed ({e}); retrying in {delay}s")
+                time.sleep(delay)
+
+        return {'name': blob_name, 'bytes': size, 'skipped': False, 'seconds': time.perf_counter() - start}
+
+    def upload_files(self, files: List[Tuple[str, str]]) -> Dict[str, Any]:
+        """
+        Upload ``(local_path, blob_name)`` pairs concurrently.
+
+        Returns:
+            Dict[str, Any]: Totals (files, uploaded, skipped, bytes sent,
+            seconds, MB/s) and the per-file results
+        """
+        total_bytes = sum(os.path.getsize(path) for path, _ in files)
+        done_bytes = 0
+        results = []
+        start = time.perf_counter()
+
+        # Largest first, so one big shard does not start last and stretch the tail
+        files = sorted(files, key=lambda pair: os.path.getsize(pair[0]), reverse=True)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.upload_file, path, name) for path, name in files]
+            for future in as_completed(futures):
+                result = future.result()
+                with self._lock:
+                    results.append(result)
+                    done_bytes += result['bytes']
+                    elapsed = time.perf_counter() - start
+                logger.info(
+                    f"[{len(results)}/{len(files)}] {'skipped' if result['skipped'] else 'uploaded'} "
+                    f"{result['name']} ({result['bytes'] / 2**20:.1f} MB); "
+                    f"{done_bytes / max(total_bytes, 1):.0%} of {total_bytes / 2**20:.1f} MB in {elapsed:.1f}s"
+                )
+                if self.progress:
+                    self.progress(result)
+
+        seconds = time.perf_counter() - start
+        sent = sum(result['bytes'] for result in results if not result['skipped'])
+        report = {
+            'files': len(results),
+            'uploaded': sum(not result['skipped'] for result in results),
+            'skipped': sum(result['skipped'] for result in results),
+            'bytes': sent,
+            'seconds': seconds,
+            'mb_per_s': sent / 2**20 / seconds if seconds > 0 else 0.0,
+            'results': sorted(results, key=lambda result: result['name'])
+        }
+        logger.info(
+            f"Uploaded {report['uploaded']} files ({sent / 2**20:.1f} MB), skipped {report['skipped']} "
+            f"unchanged, in {seconds:.1f}s ({report['mb_per_s']:.1f} MB/s)"
+        )
+        return report
+
+    def upload_directory(self, local_dir: str, prefix: str) -> Dict[str, Any]:
+        """Upload every file under ``local_dir`` to ``prefix/<relative path>``."""
+        files = []
+        for root, _, names in os.walk(local_dir):
+            for name in names:
+                local_path = os.path.join(root, name)
+                relative = os.path.relpath(local_path, local_dir).replace(os.sep, '/')
+                files.append((local_path, f"{prefix.rstrip('/')}/{relative}"))
+        return self.upload_files(files)